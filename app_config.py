@@ -0,0 +1,18 @@
+import functools
+import os
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+
+
+# --- Centralized Environment Configuration ---
+@functools.lru_cache(maxsize=None)
+def load_config() -> bool:
+    """加载 `.env`；整个进程只执行一次。"""
+    return load_dotenv()
+
+
+def get_env(name: str, default: Any = None) -> Optional[str]:
+    """读取环境变量，首次调用时确保 `.env` 已加载，与模块导入顺序无关。"""
+    load_config()
+    return os.getenv(name, default)
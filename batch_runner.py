@@ -0,0 +1,351 @@
+"""
+离线批处理：对一整个文件夹的论文 / 数据文件批量运行 ChemInsight。
+
+清单 (manifest) 为 JSONL 格式，每行一个任务:
+    {"id": "paper-001", "query": "分析这篇论文的检测原理", "files": ["papers/a.pdf"]}
+
+- 任务在有界的工作池中并发执行，失败时按指数退避重试。
+- 结果在每个任务完成时立即追加写入输出 JSONL。
+- 中断后重新运行同一命令即可从断点继续：输出文件中已成功的任务会被跳过。
+- 结束时报告吞吐量 (items/min, tokens/min)。
+
+命令行用法:
+    python batch_runner.py manifest.jsonl --output results.jsonl --concurrency 4
+
+也可以通过 FastAPI 路由 `POST /batch/jobs` 提交任务、`GET /batch/jobs/{job_id}` 查询进度。
+通过接口提交时，清单、输出文件和清单中的所有文件都必须是 `BATCH_ROOT`（默认 `./batch`）下的相对路径，
+不允许绝对路径、`..` 或指向该目录之外的符号链接；并发数不能超过 `BATCH_MAX_CONCURRENCY`（默认 8），
+重试次数不能超过 10。
+"""
+
+import argparse
+import asyncio
+import json
+import mimetypes
+import os
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+from google.adk.apps import App
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+from pydantic import BaseModel, Field
+
+from app_config import get_env
+from logger_config import logger
+
+APP_NAME = "multimodal_agent"
+BATCH_USER_ID = "batch"
+# 通过接口提交的任务允许的并发数和重试次数上限（命令行不受限制）
+BATCH_MAX_CONCURRENCY = int(get_env("BATCH_MAX_CONCURRENCY", 8))
+BATCH_MAX_RETRIES = 10
+
+
+@dataclass
+class BatchItem:
+    id: str
+    query: str
+    files: list[str] = field(default_factory=list)
+
+
+@dataclass
+class BatchStats:
+    total: int = 0
+    skipped: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    tokens: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: Optional[float] = None
+
+    def as_dict(self) -> dict:
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        minutes = max(elapsed / 60, 1e-9)
+        done = self.succeeded + self.failed
+        return {
+            "total": self.total,
+            "skipped": self.skipped,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "elapsed_s": round(elapsed, 2),
+            "items_per_min": round(done / minutes, 2),
+            "tokens_per_min": round(self.tokens / minutes, 2),
+        }
+
+
+class ManifestError(ValueError):
+    """清单格式错误，或其中的路径不合法。"""
+
+
+def resolve_under_root(path: str, root: str) -> str:
+    """
+    把相对于 `root` 的路径解析为绝对路径；绝对路径、`..` 以及解析符号链接后位于 `root` 之外的路径都会被拒绝。
+    """
+    if not path or os.path.isabs(path) or ".." in path.replace("\\", "/").split("/"):
+        raise ManifestError(f"路径必须是 {root} 下的相对路径: {path!r}")
+    real_root = os.path.realpath(root)
+    resolved = os.path.realpath(os.path.join(real_root, path))
+    if os.path.commonpath([real_root, resolved]) != real_root:
+        raise ManifestError(f"路径不在 {root} 之内: {path!r}")
+    return resolved
+
+
+def load_manifest(path: str, root: Optional[str] = None) -> list[BatchItem]:
+    """
+    读取 JSONL 清单；相对路径的文件以清单所在目录为基准。
+
+    指定 `root` 时，清单中的文件必须是相对路径，且解析后仍位于 `root` 之内。
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                query, files = record["query"], record.get("files", [])
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                raise ManifestError(f"清单第 {line_no} 行格式错误: {e}") from None
+            if not isinstance(query, str) or not isinstance(files, list) or not all(isinstance(p, str) for p in files):
+                raise ManifestError(f"清单第 {line_no} 行格式错误: query 须为字符串，files 须为字符串列表")
+            if root is not None:
+                relative_dir = os.path.relpath(base_dir, os.path.realpath(root))
+                # 绝对路径经 join 后保持不变，由 resolve_under_root 拒绝
+                files = [resolve_under_root(os.path.join(relative_dir, p), root) for p in files]
+            else:
+                files = [p if os.path.isabs(p) else os.path.join(base_dir, p) for p in files]
+            items.append(BatchItem(id=str(record.get("id", line_no)), query=query, files=files))
+    return items
+
+
+def load_checkpoint(output_path: str) -> set[str]:
+    """返回输出文件中已成功完成的任务 ID。"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 上次中断时可能留下写了一半的行
+                continue
+            if record.get("status") == "success":
+                done.add(record["id"])
+    return done
+
+
+def build_message(item: BatchItem) -> types.Content:
+    parts = []
+    for path in item.files:
+        mime_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        with open(path, "rb") as f:
+            parts.append(types.Part(inline_data=types.Blob(
+                data=f.read(), mime_type=mime_type, display_name=os.path.basename(path)
+            )))
+    parts.append(types.Part(text=item.query))
+    return types.Content(role="user", parts=parts)
+
+
+class BatchRunner:
+    """
+    在有界工作池中批量运行 `root_agent`。
+
+    Args:
+        output_path: 结果 JSONL 文件路径，同时作为断点文件。
+        concurrency: 同时运行的任务数。
+        max_retries: 单个任务失败后的最大重试次数。
+        backoff_s: 第一次重试前的等待时间，之后按指数增长。
+    """
+
+    def __init__(self, output_path: str, concurrency: int = 4, max_retries: int = 3,
+                 backoff_s: float = 2.0, runner: Optional[Runner] = None):
+        self.output_path = output_path
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self.stats = BatchStats()
+        self._runner = runner
+        self._write_lock = asyncio.Lock()
+
+    @property
+    def runner(self) -> Runner:
+        if self._runner is None:
+            from multimodal_agent.agent import root_agent
+            from tools.artifact_store import artifact_offload_plugin
+            from tools.paper_index import paper_index_plugin
+
+            app = App(name=APP_NAME, root_agent=root_agent, plugins=[artifact_offload_plugin, paper_index_plugin])
+            self._runner = Runner(app=app, session_service=InMemorySessionService())
+        return self._runner
+
+    async def _run_item_once(self, item: BatchItem) -> tuple[str, int]:
+        session = await self.runner.session_service.create_session(app_name=APP_NAME, user_id=BATCH_USER_ID)
+        final_text = ""
+        tokens = 0
+        try:
+            async for event in self.runner.run_async(
+                user_id=BATCH_USER_ID, session_id=session.id, new_message=build_message(item)
+            ):
+                if event.usage_metadata and event.usage_metadata.total_token_count:
+                    tokens += event.usage_metadata.total_token_count
+                if event.is_final_response() and event.content and event.content.parts:
+                    text = "".join(p.text for p in event.content.parts if p.text and not p.thought)
+                    if text:
+                        final_text = text
+        finally:
+            await self.runner.session_service.delete_session(
+                app_name=APP_NAME, user_id=BATCH_USER_ID, session_id=session.id
+            )
+        return final_text, tokens
+
+    async def _run_item(self, item: BatchItem) -> dict:
+        started = time.monotonic()
+        error = None
+        for attempt in range(1, self.max_retries + 2):
+            try:
+                final_text, tokens = await self._run_item_once(item)
+                return {
+                    "id": item.id, "status": "success", "attempts": attempt, "tokens": tokens,
+                    "duration_s": round(time.monotonic() - started, 2), "result": final_text,
+                }
+            except Exception as e:
+                error = e
+                if attempt > self.max_retries:
+                    break
+                delay = self.backoff_s * (2 ** (attempt - 1)) * (0.5 + random.random())
+                logger.warning(f"批处理任务 {item.id} 第 {attempt} 次失败: {e}，{delay:.1f}s 后重试")
+                await asyncio.sleep(delay)
+        return {
+            "id": item.id, "status": "error", "attempts": self.max_retries + 1, "tokens": 0,
+            "duration_s": round(time.monotonic() - started, 2), "error": str(error),
+        }
+
+    async def _write_result(self, record: dict) -> None:
+        async with self._write_lock:
+            with open(self.output_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+
+    async def run(self, items: list[BatchItem]) -> dict:
+        done = load_checkpoint(self.output_path)
+        pending = [item for item in items if item.id not in done]
+        self.stats = BatchStats(total=len(items), skipped=len(items) - len(pending))
+        if self.stats.skipped:
+            logger.info(f"从断点继续: 跳过 {self.stats.skipped} 个已完成的任务")
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in pending:
+            queue.put_nowait(item)
+
+        async def worker():
+            while True:
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                record = await self._run_item(item)
+                await self._write_result(record)
+                if record["status"] == "success":
+                    self.stats.succeeded += 1
+                    self.stats.tokens += record["tokens"]
+                else:
+                    self.stats.failed += 1
+                logger.info(f"批处理进度: {self.stats.as_dict()}")
+
+        await asyncio.gather(*(worker() for _ in range(max(1, self.concurrency))))
+        self.stats.finished_at = time.monotonic()
+        summary = self.stats.as_dict()
+        logger.info(f"批处理完成: {summary}")
+        return summary
+
+
+# --- 任务提交接口 ---
+class BatchJobRequest(BaseModel):
+    manifest_path: str
+    output_path: Optional[str] = None
+    concurrency: int = Field(default=min(4, BATCH_MAX_CONCURRENCY), ge=1, le=BATCH_MAX_CONCURRENCY)
+    max_retries: int = Field(default=3, ge=0, le=BATCH_MAX_RETRIES)
+
+
+_jobs: dict[str, dict] = {}
+
+batch_router = APIRouter(prefix="/batch", tags=["batch"])
+
+
+@batch_router.post("/jobs")
+async def submit_batch_job(request: BatchJobRequest):
+    """提交一个批处理任务，立即返回任务 ID；任务在后台运行。所有路径都相对于 `BATCH_ROOT`。"""
+    root = get_env("BATCH_ROOT", "./batch")
+    try:
+        manifest_path = resolve_under_root(request.manifest_path, root)
+        if not os.path.isfile(manifest_path):
+            raise ManifestError(f"清单文件不存在: {request.manifest_path}")
+        items = load_manifest(manifest_path, root=root)
+        missing = [p for item in items for p in item.files if not os.path.isfile(p)]
+        if missing:
+            raise ManifestError(f"清单中的文件不存在: {os.path.relpath(missing[0], os.path.realpath(root))}")
+        output_path = resolve_under_root(
+            request.output_path or os.path.splitext(request.manifest_path)[0] + ".results.jsonl", root
+        )
+    except (ManifestError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    runner = BatchRunner(output_path, concurrency=request.concurrency, max_retries=request.max_retries)
+    job_id = uuid.uuid4().hex
+    # 接口只返回相对于 BATCH_ROOT 的路径
+    relative_output = os.path.relpath(output_path, os.path.realpath(root))
+    job = {"job_id": job_id, "status": "running", "output_path": relative_output, "runner": runner}
+
+    async def run_job():
+        try:
+            job["summary"] = await runner.run(items)
+            job["status"] = "finished"
+        except Exception as e:
+            logger.error(f"批处理任务 {job_id} 失败: {e}")
+            job["status"] = "error"
+            job["error"] = str(e)
+
+    job["task"] = asyncio.create_task(run_job())
+    _jobs[job_id] = job
+    return {"job_id": job_id, "output_path": relative_output, "items": len(items)}
+
+
+@batch_router.get("/jobs/{job_id}")
+async def get_batch_job(job_id: str):
+    job = _jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "output_path": job["output_path"],
+        "progress": job["runner"].stats.as_dict(),
+        "error": job.get("error"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ChemInsight 离线批处理")
+    parser.add_argument("manifest", help="JSONL 清单文件路径")
+    parser.add_argument("--output", help="结果 JSONL 文件路径 (默认: <manifest>.results.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发任务数")
+    parser.add_argument("--max-retries", type=int, default=3, help="单个任务的最大重试次数")
+    parser.add_argument("--backoff", type=float, default=2.0, help="首次重试前的等待秒数")
+    args = parser.parse_args()
+
+    output_path = args.output or os.path.splitext(args.manifest)[0] + ".results.jsonl"
+    runner = BatchRunner(output_path, concurrency=args.concurrency,
+                         max_retries=args.max_retries, backoff_s=args.backoff)
+    summary = asyncio.run(runner.run(load_manifest(args.manifest)))
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+"""
+压测使用的应用入口：先注册假模型，再导入 `main.app`。
+
+    CHEMINSIGHT_MODEL=fake-llm CHEMINSIGHT_FAST_MODEL=fake-llm-fast uvicorn benchmarks.bench_app:app
+"""
+
+import benchmarks.fake_llm  # noqa: F401  注册 FakeLlm
+from main import app  # noqa: F401
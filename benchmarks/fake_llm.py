@@ -0,0 +1,122 @@
+"""
+确定性的假模型，用于离线压测，不消耗真实的 Gemini 配额。
+
+导入本模块即把 `FakeLlm` 注册到 ADK 的模型注册表，之后设置 `CHEMINSIGHT_MODEL=fake-llm`
+即可让所有代理的 pro 档都使用它；再设置 `CHEMINSIGHT_FAST_MODEL=fake-llm-fast` 让 fast 档也使用它
+（见 `multimodal_agent/model_router.py`）。
+
+脚本化的行为（按系统指令中的代理名区分）：
+- SupervisorAgent: 收到用户新消息时，根据上传的文件类型转交给子代理
+  （CSV 交给 DataAnalyzeAgent，其余交给 PaperAnalyzeAgent），否则直接给出最终回答。
+- 子代理: 先调用一次自己的工具（DataAnalyzeAgent 为本地的 `profile_dataset`，
+  其余为 MCP 的 `search_knowledge_base`），收到工具结果后给出最终回答。
+
+延迟和输出长度通过环境变量配置:
+- `FAKE_LLM_LATENCY_MS`: 每次调用的固定延迟（毫秒），默认 200。
+- `FAKE_LLM_FAST_LATENCY_MS`: 模型名以 `-fast` 结尾时每次调用的延迟（毫秒），默认 80。
+- `FAKE_LLM_OUTPUT_TOKENS`: 最终回答的 token 数，默认 300。
+"""
+
+import asyncio
+import re
+from typing import AsyncGenerator
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.adk.models.registry import LLMRegistry
+from google.genai import types
+
+from app_config import get_env
+from tools.context_budget import estimate_request_tokens
+
+_AGENT_NAME_RE = re.compile(r'Your internal name is "(?P<name>[^"]+)"')
+_FILLER = "实验 数据 表明 该 方法 具有 良好 的 灵敏度 与 选择性 。"
+
+SUPERVISOR = "SupervisorAgent"
+# 子代理在收到转交后调用的工具
+AGENT_TOOLS = {
+    "DataAnalyzeAgent": "profile_dataset",
+    "ExperimentDesignAgent": "search_knowledge_base",
+    "PaperAnalyzeAgent": "search_knowledge_base",
+    "PaperAnalyzeWorker": "search_knowledge_base",
+}
+
+
+def _agent_name(llm_request: LlmRequest) -> str:
+    instruction = llm_request.config.system_instruction if llm_request.config else None
+    match = _AGENT_NAME_RE.search(str(instruction or ""))
+    return match.group("name") if match else ""
+
+
+def _has_csv(llm_request: LlmRequest) -> bool:
+    for content in llm_request.contents or []:
+        for part in content.parts or []:
+            if part.inline_data and "csv" in (part.inline_data.mime_type or ""):
+                return True
+            if part.text and ".csv'" in part.text:
+                return True
+    return False
+
+
+def _last_is_tool_result(llm_request: LlmRequest) -> bool:
+    contents = llm_request.contents or []
+    return bool(contents) and any(part.function_response for part in contents[-1].parts or [])
+
+
+class FakeLlm(BaseLlm):
+    """按脚本回复的假模型：固定延迟、固定输出长度、结果只取决于请求内容。"""
+
+    model: str = "fake-llm"
+    latency_s: float = float(get_env("FAKE_LLM_LATENCY_MS", 200)) / 1000
+    fast_latency_s: float = float(get_env("FAKE_LLM_FAST_LATENCY_MS", 80)) / 1000
+    output_tokens: int = int(get_env("FAKE_LLM_OUTPUT_TOKENS", 300))
+
+    @classmethod
+    def supported_models(cls) -> list[str]:
+        return [r"fake-.*"]
+
+    def _function_call(self, name: str, args: dict) -> types.Content:
+        return types.Content(role="model", parts=[types.Part(function_call=types.FunctionCall(name=name, args=args))])
+
+    def _final_answer(self, agent_name: str) -> types.Content:
+        words = _FILLER.split()
+        body = " ".join(words[i % len(words)] for i in range(self.output_tokens))
+        return types.Content(role="model", parts=[types.Part(text=f"[{agent_name}] 分析完成。{body}")])
+
+    def _script(self, llm_request: LlmRequest) -> types.Content:
+        agent_name = _agent_name(llm_request)
+        tools = llm_request.tools_dict or {}
+
+        if agent_name == SUPERVISOR:
+            if _last_is_tool_result(llm_request) or "transfer_to_agent" not in tools:
+                return self._final_answer(agent_name)
+            target = "DataAnalyzeAgent" if _has_csv(llm_request) else "PaperAnalyzeAgent"
+            return self._function_call("transfer_to_agent", {"agent_name": target})
+
+        tool_name = AGENT_TOOLS.get(agent_name)
+        if tool_name and tool_name in tools and not _last_is_tool_result(llm_request):
+            if tool_name == "profile_dataset":
+                return self._function_call(tool_name, {"file_name": "", "group_by": "group"})
+            return self._function_call(tool_name, {"query": "荧光探针 检测 原理"})
+        return self._final_answer(agent_name)
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        await asyncio.sleep(self.fast_latency_s if self.model.endswith("-fast") else self.latency_s)
+        content = self._script(llm_request)
+        input_tokens = estimate_request_tokens(llm_request)
+        output_tokens = self.output_tokens if content.parts[0].text else 20
+        yield LlmResponse(
+            content=content,
+            model_version=self.model,
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=input_tokens,
+                candidates_token_count=output_tokens,
+                total_token_count=input_tokens + output_tokens,
+            ),
+        )
+
+
+LLMRegistry.register(FakeLlm)
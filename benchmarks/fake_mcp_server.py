@@ -0,0 +1,74 @@
+"""
+本地 MCP 替身服务器，提供与远程服务器同名的工具，返回脚本化的结果。
+
+- `analyze_csv_file`: 返回固定的统计摘要。
+- `search_knowledge_base` / `ragflow_retrieval`: 返回固定的知识库片段。
+
+每次工具调用的延迟由 `FAKE_MCP_LATENCY_MS`（毫秒，默认 50）控制。
+
+用法:
+    python -m benchmarks.fake_mcp_server --port 8765
+    MCP_SERVER_URL=http://127.0.0.1:8765/mcp ...
+"""
+
+import argparse
+import asyncio
+
+from mcp.server.mcpserver import MCPServer
+
+from app_config import get_env
+
+LATENCY_S = float(get_env("FAKE_MCP_LATENCY_MS", 50)) / 1000
+
+server = MCPServer(name="cheminsight-fake-mcp")
+
+_KB_CHUNKS = [
+    "荧光探针通过目标物与识别基团的特异性结合，引起荧光强度或波长的变化，从而实现检测。",
+    "比率型荧光探针利用两个发射峰的强度比作为信号，可以抵消探针浓度和仪器波动带来的误差。",
+    "检测限通常按 3σ/k 计算，其中 σ 为空白样品的标准偏差，k 为校准曲线的斜率。",
+]
+
+
+@server.tool()
+async def analyze_csv_file(file_name: str = "", question: str = "") -> dict:
+    """分析上传的 CSV 数据文件，返回描述性统计结果。"""
+    await asyncio.sleep(LATENCY_S)
+    return {
+        "file_name": file_name,
+        "question": question,
+        "rows": 120,
+        "columns": ["group", "concentration", "intensity"],
+        "summary": {
+            "intensity": {"mean": 1532.4, "std": 88.1, "min": 1301.0, "max": 1790.5},
+            "concentration": {"mean": 5.0, "std": 2.9, "min": 0.1, "max": 10.0},
+        },
+        "figures": ["https://example.invalid/figures/intensity_vs_concentration.png"],
+    }
+
+
+@server.tool()
+async def search_knowledge_base(query: str, top_k: int = 3) -> dict:
+    """在知识库中检索与查询相关的文献片段。"""
+    await asyncio.sleep(LATENCY_S)
+    return {
+        "query": query,
+        "chunks": [{"content": chunk, "score": round(0.9 - 0.1 * i, 2)} for i, chunk in enumerate(_KB_CHUNKS[:top_k])],
+    }
+
+
+@server.tool()
+async def ragflow_retrieval(question: str, top_k: int = 3) -> dict:
+    """与 search_knowledge_base 相同，兼容远程服务器的工具名。"""
+    return await search_knowledge_base(question, top_k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 MCP 替身服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    server.run("streamable-http", host=args.host, port=args.port, streamable_http_path="/mcp")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""
+离线压测：在本地启动假模型版的应用和 MCP 替身服务器，用 N 个并发会话跑完整的代理流程。
+
+每个会话都会上传文件（CSV 或 Markdown），经过主代理转交、子代理调用 MCP 工具、文件解析回调和会话库读写。
+结束时报告:
+- 吞吐量 (requests/sec) 和 p50 / p95 / p99 延迟
+- 应用进程的峰值 RSS
+- 会话库文件的增长量，以及上传文件存储 (`artifacts/`) 的大小
+- `/metrics` 中各阶段的平均耗时
+
+用法:
+    python -m benchmarks.load_test --sessions 20 --turns 2
+    python -m benchmarks.load_test --sessions 50 --max-p95-ms 5000 --json result.json
+
+也可以通过 `--url` 压测一个已经在运行的服务（此时不报告 RSS 和会话库增长）；
+`--workers N` 通过 `serve.py` 以 N 个工作进程启动应用，RSS 为所有进程峰值之和。
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_NAME = "multimodal_agent"
+
+_METRIC_LINE_RE = re.compile(
+    r'^cheminsight_phase_duration_seconds_(?P<field>sum|count)\{phase="(?P<phase>[^"]*)",name="(?P<name>[^"]*)"\} (?P<value>\S+)$'
+)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """最近秩法计算分位数。"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(q / 100 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def make_csv(session_index: int, rows: int) -> bytes:
+    lines = ["group,concentration,intensity"]
+    for i in range(rows):
+        lines.append(f"g{i % 4},{(i % 50) / 5:.1f},{1300 + (i * 37 + session_index) % 500}")
+    return "\n".join(lines).encode("utf-8")
+
+
+def make_markdown(session_index: int, paragraphs: int) -> bytes:
+    body = "\n\n".join(
+        f"## 第 {i + 1} 节\n本研究 (样本 {session_index}) 报道了一种比率型荧光探针，用于检测水样中的金属离子。" * 3
+        for i in range(paragraphs)
+    )
+    return f"# 论文 {session_index}\n\n{body}".encode("utf-8")
+
+
+def build_message(session_index: int, turn: int, file_rows: int) -> dict:
+    if (session_index + turn) % 2 == 0:
+        data, mime_type, name, query = make_csv(session_index, file_rows), "text/csv", "data.csv", "请分析这份实验数据"
+    else:
+        data, mime_type, name, query = make_markdown(session_index, file_rows // 10 + 1), "text/markdown", "paper.md", "请分析这篇论文的检测原理"
+    return {
+        "role": "user",
+        "parts": [
+            {"inline_data": {"data": base64.b64encode(data).decode("ascii"), "mime_type": mime_type, "display_name": name}},
+            {"text": query},
+        ],
+    }
+
+
+# --- 本地进程管理 ---
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port: int, process: subprocess.Popen, timeout_s: float = 120.0) -> None:
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"进程提前退出 (exit code {process.returncode})")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"等待端口 {port} 超时")
+
+
+def peak_rss_bytes(pid: int) -> Optional[int]:
+    """读取进程的峰值常驻内存 (Linux 的 VmHWM)。"""
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def process_tree(pid: int) -> list[int]:
+    """进程及其所有子进程的 PID (Linux)。"""
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", "r", encoding="utf-8") as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return pids
+    for child in children:
+        pids.extend(process_tree(child))
+    return pids
+
+
+def db_size_bytes(db_path: str) -> int:
+    return sum(os.path.getsize(path) for path in (db_path, db_path + "-wal", db_path + "-shm") if os.path.exists(path))
+
+
+def dir_size_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def summarize_phases(metrics_text: str) -> dict:
+    totals: dict[tuple[str, str], dict] = {}
+    for line in metrics_text.splitlines():
+        match = _METRIC_LINE_RE.match(line)
+        if match:
+            entry = totals.setdefault((match["phase"], match["name"]), {})
+            entry[match["field"]] = float(match["value"])
+    phases = {}
+    for (phase, name), entry in sorted(totals.items(), key=lambda item: -item[1].get("sum", 0)):
+        count = entry.get("count", 0)
+        phases[f"{phase}:{name}"] = {
+            "count": int(count),
+            "total_s": round(entry.get("sum", 0), 3),
+            "mean_ms": round(entry.get("sum", 0) / count * 1000, 2) if count else 0.0,
+        }
+    return phases
+
+
+# --- 压测 ---
+async def run_session(client: httpx.AsyncClient, session_index: int, turns: int, file_rows: int,
+                      latencies: list[float], errors: list[str]) -> None:
+    user_id = f"load-user-{session_index}"
+    response = await client.post(f"/apps/{APP_NAME}/users/{user_id}/sessions")
+    if response.status_code != 200:
+        errors.append(f"create_session: HTTP {response.status_code}")
+        return
+    session_id = response.json()["id"]
+    for turn in range(turns):
+        payload = {
+            "app_name": APP_NAME,
+            "user_id": user_id,
+            "session_id": session_id,
+            "new_message": build_message(session_index, turn, file_rows),
+        }
+        start = time.perf_counter()
+        try:
+            response = await client.post("/run", json=payload)
+            if response.status_code != 200:
+                errors.append(f"run: HTTP {response.status_code} {response.text[:200]}")
+                continue
+        except httpx.HTTPError as e:
+            errors.append(f"run: {e!r}")
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def drive(base_url: str, sessions: int, turns: int, file_rows: int, timeout_s: float) -> dict:
+    latencies: list[float] = []
+    errors: list[str] = []
+    limits = httpx.Limits(max_connections=sessions + 4, max_keepalive_connections=sessions + 4)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout_s, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(run_session(client, i, turns, file_rows, latencies, errors) for i in range(sessions)))
+        elapsed = time.perf_counter() - start
+        metrics_text = ""
+        try:
+            metrics_response = await client.get("/metrics")
+            if metrics_response.status_code == 200:
+                metrics_text = metrics_response.text
+        except httpx.HTTPError:
+            pass
+
+    return {
+        "sessions": sessions,
+        "turns": turns,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 1),
+            "p95": round(percentile(latencies, 95) * 1000, 1),
+            "p99": round(percentile(latencies, 99) * 1000, 1),
+            "max": round(max(latencies, default=0) * 1000, 1),
+        },
+        "phases": summarize_phases(metrics_text),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="ChemInsight 离线压测")
+    parser.add_argument("--sessions", type=int, default=10, help="并发会话数")
+    parser.add_argument("--turns", type=int, default=1, help="每个会话的对话轮数")
+    parser.add_argument("--file-rows", type=int, default=500, help="每个上传文件的行数 (Markdown 按段落折算)")
+    parser.add_argument("--llm-latency-ms", type=float, default=200, help="假模型每次调用的延迟")
+    parser.add_argument("--fast-llm-latency-ms", type=float, default=80, help="假模型 fast 档每次调用的延迟")
+    parser.add_argument("--mcp-latency-ms", type=float, default=50, help="MCP 替身每次工具调用的延迟")
+    parser.add_argument("--timeout", type=float, default=300, help="单个请求的超时时间（秒）")
+    parser.add_argument("--session-store", choices=("wal", "default"), default="wal",
+                        help="会话库: wal 为 sqlite+wal 调优会话库，default 为 ADK 默认的 sqlite 会话库")
+    parser.add_argument("--workers", type=int, default=0, help="通过 serve.py 以多个工作进程启动应用，0 为单进程 uvicorn")
+    parser.add_argument("--url", help="压测已在运行的服务，而不是在本地启动")
+    parser.add_argument("--json", help="把结果写入该 JSON 文件")
+    parser.add_argument("--max-p95-ms", type=float, help="p95 延迟超过该值时以非零状态码退出")
+    parser.add_argument("--min-rps", type=float, help="吞吐量低于该值时以非零状态码退出")
+    args = parser.parse_args()
+
+    processes: list[subprocess.Popen] = []
+    app_process = None
+    work_dir = tempfile.mkdtemp(prefix="cheminsight-load-")
+    db_path = os.path.join(work_dir, "sessions.db")
+    try:
+        if args.url:
+            base_url = args.url.rstrip("/")
+        else:
+            mcp_port, app_port = _free_port(), _free_port()
+            env = dict(
+                os.environ,
+                CHEMINSIGHT_MODEL="fake-llm",
+                CHEMINSIGHT_FAST_MODEL="fake-llm-fast",
+                FAKE_LLM_LATENCY_MS=str(args.llm_latency_ms),
+                FAKE_LLM_FAST_LATENCY_MS=str(args.fast_llm_latency_ms),
+                FAKE_MCP_LATENCY_MS=str(args.mcp_latency_ms),
+                MCP_SERVER_URL=f"http://127.0.0.1:{mcp_port}/mcp",
+                SESSION_SERVICE_URI=f"{'sqlite+wal' if args.session_store == 'wal' else 'sqlite'}:///{db_path}",
+                EXTRACTION_CACHE_DIR="",
+            )
+            mcp_process = subprocess.Popen(
+                [sys.executable, "-m", "benchmarks.fake_mcp_server", "--port", str(mcp_port)],
+                cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            processes.append(mcp_process)
+            _wait_for_port(mcp_port, mcp_process)
+            if args.workers:
+                command = [sys.executable, os.path.join(REPO_ROOT, "serve.py"), "--app", "benchmarks.bench_app:app",
+                           "--workers", str(args.workers), "--port", str(app_port)]
+            else:
+                command = [sys.executable, "-m", "uvicorn", "benchmarks.bench_app:app",
+                           "--host", "127.0.0.1", "--port", str(app_port), "--log-level", "warning"]
+            app_process = subprocess.Popen(
+                command,
+                cwd=work_dir, env=dict(env, PYTHONPATH=REPO_ROOT), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            processes.append(app_process)
+            _wait_for_port(app_port, app_process)
+            base_url = f"http://127.0.0.1:{app_port}"
+
+        db_before = db_size_bytes(db_path)
+        result = asyncio.run(drive(base_url, args.sessions, args.turns, args.file_rows, args.timeout))
+        if app_process is not None:
+            pids = process_tree(app_process.pid) if args.workers else [app_process.pid]
+            peak_rss = sum(peak_rss_bytes(pid) or 0 for pid in pids)
+            result["peak_rss_mb"] = round(peak_rss / 1024 / 1024, 1)
+            result["session_db_growth_kb"] = round((db_size_bytes(db_path) - db_before) / 1024, 1)
+            result["artifact_store_kb"] = round(dir_size_bytes(os.path.join(work_dir, "artifacts")) / 1024, 1)
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    latency = result["latency_ms"]
+    print(f"{result['requests']} requests ({result['errors']} errors) in {result['elapsed_s']}s: "
+          f"{result['requests_per_s']} req/s, p50 {latency['p50']}ms, p95 {latency['p95']}ms, p99 {latency['p99']}ms")
+    if "peak_rss_mb" in result:
+        print(f"peak RSS {result['peak_rss_mb']} MB, session DB growth {result['session_db_growth_kb']} KB, "
+              f"artifact store {result['artifact_store_kb']} KB")
+    for name, phase in list(result["phases"].items())[:10]:
+        print(f"  {name:<45} n={phase['count']:<6} mean {phase['mean_ms']}ms  total {phase['total_s']}s")
+    for error in result["error_samples"]:
+        print(f"  error: {error}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    failed = bool(result["errors"])
+    if args.max_p95_ms is not None and latency["p95"] > args.max_p95_ms:
+        print(f"FAIL: p95 {latency['p95']}ms 超过上限 {args.max_p95_ms}ms")
+        failed = True
+    if args.min_rps is not None and result["requests_per_s"] < args.min_rps:
+        print(f"FAIL: 吞吐量 {result['requests_per_s']} req/s 低于下限 {args.min_rps}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
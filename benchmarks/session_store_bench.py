@@ -0,0 +1,132 @@
+"""
+会话库基准：对比 ADK 默认的 `sqlite://` 会话库和 `sqlite+wal://` 调优会话库。
+
+1. 单个会话的事件数逐步增长到数万时，追加事件和加载会话的延迟。
+2. 多个会话并发追加事件时的吞吐量。
+
+用法:
+    python -m benchmarks.session_store_bench --max-events 20000 --concurrent-sessions 32
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from google.adk.events.event import Event
+from google.adk.sessions.sqlite_session_service import SqliteSessionService
+from google.genai import types
+
+from session_store import TunedSqliteSessionService
+
+APP_NAME = "bench"
+USER_ID = "bench-user"
+_TEXT = "思考: 需要先检索知识库，再调用分析工具。" * 20
+
+
+def make_event(index: int, invocation_id: str) -> Event:
+    return Event(
+        author="SupervisorAgent" if index % 2 else "user",
+        invocation_id=invocation_id,
+        content=types.Content(role="model" if index % 2 else "user", parts=[types.Part(text=f"{index}: {_TEXT}")]),
+    )
+
+
+def make_service(kind: str, db_path: str):
+    if kind == "default":
+        return SqliteSessionService(db_path)
+    return TunedSqliteSessionService(db_path)
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 2)
+
+
+async def growth_benchmark(kind: str, checkpoints: list[int], sample: int) -> list[dict]:
+    """在一个会话中不断追加事件，在每个检查点测量追加和加载的延迟。"""
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        service = make_service(kind, os.path.join(tmp, "sessions.db"))
+        session = await service.create_session(app_name=APP_NAME, user_id=USER_ID)
+        count = 0
+        for checkpoint in checkpoints:
+            while count < checkpoint - sample:
+                await service.append_event(session, make_event(count, f"inv-{count // 20}"))
+                count += 1
+            append_latencies = []
+            while count < checkpoint:
+                start = time.perf_counter()
+                await service.append_event(session, make_event(count, f"inv-{count // 20}"))
+                append_latencies.append(time.perf_counter() - start)
+                count += 1
+            # 会话对象中的事件只用于追加，不需要随检查点增长占用内存
+            session.events.clear()
+
+            load_latencies = []
+            for _ in range(3):
+                start = time.perf_counter()
+                loaded = await service.get_session(app_name=APP_NAME, user_id=USER_ID, session_id=session.id)
+                load_latencies.append(time.perf_counter() - start)
+            assert loaded is not None and len(loaded.events) == count
+            del loaded
+
+            ordered = sorted(append_latencies)
+            rows.append({
+                "store": kind,
+                "events": count,
+                "append_p50_ms": _ms(statistics.median(ordered)),
+                "append_p95_ms": _ms(ordered[int(len(ordered) * 0.95) - 1]),
+                "load_ms": _ms(statistics.median(load_latencies)),
+            })
+            print(f"  {kind:<8} events={count:<7} append p50 {rows[-1]['append_p50_ms']}ms "
+                  f"p95 {rows[-1]['append_p95_ms']}ms  load {rows[-1]['load_ms']}ms", flush=True)
+        if hasattr(service, "close"):
+            await service.close()
+    return rows
+
+
+async def concurrency_benchmark(kind: str, sessions: int, events_per_session: int) -> dict:
+    """多个会话同时追加事件，模拟并发用户。"""
+    with tempfile.TemporaryDirectory() as tmp:
+        service = make_service(kind, os.path.join(tmp, "sessions.db"))
+        created = [await service.create_session(app_name=APP_NAME, user_id=f"{USER_ID}-{i}") for i in range(sessions)]
+
+        async def writer(session):
+            for i in range(events_per_session):
+                await service.append_event(session, make_event(i, f"inv-{i // 20}"))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(writer(session) for session in created))
+        elapsed = time.perf_counter() - start
+        if hasattr(service, "close"):
+            await service.close()
+    total = sessions * events_per_session
+    return {"store": kind, "events": total, "elapsed_s": round(elapsed, 3), "events_per_s": round(total / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="会话库基准")
+    parser.add_argument("--max-events", type=int, default=20000, help="单个会话的最大事件数")
+    parser.add_argument("--sample", type=int, default=200, help="每个检查点测量的追加次数")
+    parser.add_argument("--concurrent-sessions", type=int, default=32)
+    parser.add_argument("--events-per-session", type=int, default=50)
+    parser.add_argument("--stores", default="default,wal", help="要测试的会话库，逗号分隔 (default, wal)")
+    args = parser.parse_args()
+
+    stores = [store.strip() for store in args.stores.split(",") if store.strip()]
+    checkpoints = [n for n in (1000, 5000, 10000, 20000, 50000, 100000) if n <= args.max_events] or [args.max_events]
+
+    print("事件数增长时的追加 / 加载延迟:")
+    for store in stores:
+        asyncio.run(growth_benchmark(store, checkpoints, min(args.sample, checkpoints[0])))
+
+    print(f"并发追加 ({args.concurrent_sessions} 个会话 x {args.events_per_session} 个事件):")
+    for store in stores:
+        result = asyncio.run(concurrency_benchmark(store, args.concurrent_sessions, args.events_per_session))
+        print(f"  {store:<8} {result['events']} events in {result['elapsed_s']}s: {result['events_per_s']} events/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+冷启动基准：测量导入代理包所需的时间，并检查重量级库没有被提前导入。
+
+每次测量都在一个全新的 Python 子进程中进行，以模拟容器冷启动。
+中位数超过预算，或者延迟导入的库在启动时就被导入时，以非零状态码退出，便于在 CI 中拦截回归。
+
+用法:
+    python -m benchmarks.startup_bench --runs 5 --budget 6.0
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 这些库应当在首次使用时才导入，启动阶段不应出现在 sys.modules 中
+LAZY_MODULES = ("docx", "openpyxl", "pptx", "litellm", "numpy", "pypdf")
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {target}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+
+def measure_once(target: str) -> dict:
+    code = _PROBE.format(target=target, lazy=LAZY_MODULES)
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def top_imports(target: str, limit: int = 15) -> list[tuple[int, str]]:
+    """使用 `-X importtime` 找出累计耗时最长的模块。"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # 格式: "import time:  self [us] | cumulative | imported package"
+        _, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="ChemInsight 冷启动基准")
+    parser.add_argument("--target", default="multimodal_agent", help="要导入的模块")
+    parser.add_argument("--runs", type=int, default=5, help="测量次数")
+    parser.add_argument("--budget", type=float, default=float(os.getenv("STARTUP_BUDGET_S", 6.0)),
+                        help="导入耗时中位数的上限（秒）")
+    parser.add_argument("--profile", action="store_true", help="输出累计耗时最长的模块")
+    args = parser.parse_args()
+
+    samples = [measure_once(args.target) for _ in range(args.runs)]
+    timings = [sample["elapsed"] for sample in samples]
+    loaded = sorted({module for sample in samples for module in sample["loaded"]})
+    median = statistics.median(timings)
+
+    print(f"import {args.target}: median {median:.3f}s, min {min(timings):.3f}s, max {max(timings):.3f}s "
+          f"({args.runs} runs, budget {args.budget:.3f}s)")
+    if args.profile:
+        for cumulative_us, name in top_imports(args.target):
+            print(f"  {cumulative_us / 1e6:8.3f}s  {name}")
+
+    failed = False
+    if median > args.budget:
+        print(f"FAIL: 启动耗时 {median:.3f}s 超过预算 {args.budget:.3f}s")
+        failed = True
+    if loaded:
+        print(f"FAIL: 以下库应当延迟导入，但在启动时已被导入: {', '.join(loaded)}")
+        failed = True
+    if not failed:
+        print("OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
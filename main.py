@@ -1,18 +1,81 @@
 import os
+from contextlib import asynccontextmanager
 
 import uvicorn
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from google.adk.cli.fast_api import get_fast_api_app
 
+from app_config import get_env
+from batch_runner import batch_router
+from session_store import (
+    close_session_stores,
+    register_session_store,
+    session_store_stats,
+    start_background_compaction,
+    warm_up_session_stores,
+)
+from telemetry import telemetry
+from tools.artifact_store import artifact_store, start_background_sweep
+from tools.file_reader_tool import extraction_cache, extraction_pool
+from tools.mcp_client import close_mcp, warm_up_mcp
+from tools.memory_tools import memory_ingest_queue
+from tools.paper_index import paper_index_store
+from tools.response_cache import agent_response_cache
+from tools.tool_result_cache import tool_result_cache
+
 # 获取 main.py 所在的目录
 AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
-# 示例会话服务 URI (例如: SQLite)
-SESSION_SERVICE_URI = "sqlite:///./sessions.db"
+# 会话服务 URI；sqlite+wal 为启用 WAL、连接池和合并写入的 SQLite 会话库 (见 session_store.py)
+SESSION_SERVICE_URI = get_env("SESSION_SERVICE_URI", "sqlite+wal:///./sessions.db")
 # 示例允许的 CORS 来源
 ALLOWED_ORIGINS = ["http://localhost", "http://localhost:8080", "*"]
 # 如果您打算提供 Web 界面，则设置为 True，否则为 False
 SERVE_WEB_INTERFACE = True
 
+
+
+register_session_store()
+# 会话库的每次读写都计入 session_store 阶段
+telemetry.instrument_session_store(SESSION_SERVICE_URI)
+telemetry.register_stats("session_store", session_store_stats)
+telemetry.register_stats("artifact_store", artifact_store.stats)
+telemetry.register_stats("tool_result_cache", tool_result_cache.stats)
+telemetry.register_stats("extraction_cache", extraction_cache.stats)
+telemetry.register_stats("paper_index", paper_index_store.stats)
+telemetry.register_stats("agent_response_cache", agent_response_cache.stats)
+telemetry.register_stats("memory_ingest", memory_ingest_queue.stats)
+telemetry.register_stats("extraction_pool", lambda: {"pending": extraction_pool.pending})
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时预热共享的 MCP 连接，避免首个请求承担握手开销
+    await warm_up_mcp()
+    if get_env("WORKER_WARM_UP", "0") == "1":
+        # 多进程服务 (serve.py) 中每个工作进程在开始接收请求前加载代理并创建模型客户端
+        from multimodal_agent.agent import root_agent
+        from multimodal_agent.model_router import warm_up_models
+
+        warm_up_models(root_agent)
+        await warm_up_session_stores()
+    # 多进程服务中会话库压缩和上传文件清理只由 0 号工作进程执行
+    background_tasks = []
+    if get_env("SERVE_WORKER_INDEX", "0") == "0":
+        background_tasks = [start_background_compaction(), start_background_sweep()]
+    yield
+    for task in background_tasks:
+        if task is not None:
+            task.cancel()
+    # 写入尚在队列中的长期记忆
+    await memory_ingest_queue.close()
+    await close_session_stores()
+    await close_mcp()
+    extraction_pool.shutdown()
+    if telemetry.exporter is not None:
+        telemetry.exporter.close()
+
+
 # 调用函数获取 FastAPI 应用实例
 # 确保 agent 目录名 ('capital_agent') 与您的 agent 文件夹匹配
 app: FastAPI = get_fast_api_app(
@@ -20,8 +83,30 @@ app: FastAPI = get_fast_api_app(
     session_service_uri=SESSION_SERVICE_URI,
     allow_origins=ALLOWED_ORIGINS,
     web=SERVE_WEB_INTERFACE,
+    lifespan=lifespan,
+    # 上传文件在写入会话前卸载到本地文件存储，会话事件中只保留引用；
+    # 随后在后台为上传的论文建立检索索引
+    extra_plugins=["tools.artifact_store.artifact_offload_plugin", "tools.paper_index.paper_index_plugin"],
 )
 
+# 离线批处理任务的提交与查询接口
+app.include_router(batch_router)
+
+
+@app.post("/knowledge-base/invalidate")
+async def invalidate_knowledge_base_cache(tool_name: str | None = None):
+    """知识库重建索引后调用，使 MCP 检索结果缓存和代理回复缓存失效。"""
+    kb_version = tool_result_cache.invalidate(tool_name)
+    agent_response_cache.bump_kb_version()
+    return {"kb_version": kb_version, "stats": tool_result_cache.stats()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 文本格式的性能指标。"""
+    return PlainTextResponse(telemetry.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     # 使用 Cloud Run 提供的 PORT 环境变量，默认为 8080
     uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
\ No newline at end of file
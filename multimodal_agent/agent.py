@@ -1,37 +1,17 @@
-import os
-
-from dotenv import load_dotenv
-from logger_config import logger
-
 # --- ADK Framework Imports ---
 from google.adk.agents import LlmAgent
-from google.adk.models.lite_llm import LiteLlm
-from tools.file_reader_tool import read_files_as_text_callback
-from google.adk.tools.mcp_tool import StreamableHTTPConnectionParams
-from google.adk.tools.mcp_tool.mcp_toolset import McpToolset
+from tools.file_reader_tool import read_files_as_text_callback_async
+from tools.artifact_store import materialize_artifacts_callback_async
+from tools.context_budget import make_context_budget_callback, recall_file
+from tools.tool_result_cache import tool_result_cache
+from tools.step_budget import StepBudget
+from telemetry import telemetry
 from google.adk.planners.plan_re_act_planner import PlanReActPlanner
+from .factory import get_mcp_toolset, get_model
 from .sub_agents.experiment_design.agent import experiment_design_agent
 from .sub_agents.data_analyze.agent import data_analyze_agent
 from .sub_agents.paper_analyze.agent import paper_analyze_agent
-
-# Your ADK agent connects to the remote MCP service via Streamable HTTP
-mcp_toolset = McpToolset(
-    connection_params=StreamableHTTPConnectionParams(
-        url="https://mcp.635262140.xyz/mcp",
-    )
-)
-
-# --- Load Environment Variables ---
-load_dotenv()
-API_KEY = os.getenv("OPENAI_API_KEY")
-ENDPOINT = os.getenv("OPENAI_API_BASE")
-
-model_config = LiteLlm(
-    # 强烈建议使用原生支持多模态的强大模型
-    model="openai/gemini-2.5-pro", 
-    api_base=ENDPOINT,
-    api_key=API_KEY
-)
+from .sub_agents.paper_analyze.parallel import analyze_papers_in_parallel
 
 # --- 【重要】更新后的系统提示 ---
 SYSTEM_PROMPT = (
@@ -48,6 +28,9 @@ SYSTEM_PROMPT = (
     "3. **`PaperAnalyzeAgent` (论文分析专家)**:\n"
     "   - **需要信息**: ① **论文文件** (用于理解论文内容) 和 ② **研究问题**。\n"
     "   - **输出**: 文献分析报告、关键信息和可视化图表。\n"
+    "4. **`analyze_papers_in_parallel` (多论文并行分析工具)**:\n"
+    "   - **需要信息**: 用户上传的**两篇或更多论文文件**和**研究问题**。\n"
+    "   - **输出**: 每篇论文的独立分析报告以及一份综合报告。\n"
     "\n"
     "**核心职责**:\n"
     "1. **需求解析**: 深入分析用户请求，识别任务是单一的还是复合的。\n"
@@ -91,6 +74,13 @@ SYSTEM_PROMPT = (
     "6. **观察**: 收到实验方案。\n"
     "7. **最终报告**: 整合论文分析结果和实验方案，形成报告。\n"
     "\n"
+    "**场景5：分析多篇论文**\n"
+    "用户一次上传了两篇或更多论文文件。\n"
+    "1. **思考**: 用户提供了多篇论文，逐篇转交会非常缓慢，我将调用 `analyze_papers_in_parallel` 工具并行分析。\n"
+    "2. **行动**: 调用analyze_papers_in_parallel，并传入研究问题作为question参数。\n"
+    "3. **观察**: 收到每篇论文的分析报告和综合报告。\n"
+    "4. **最终报告**: 基于综合报告输出文献分析结果；如用户还提供了研究课题，再调用 `ExperimentDesignAgent`。\n"
+    "\n"
     "**重要原则**:\n"
     "- **任务依赖**: 数据分析必须依赖于实验方案。\n"
     "- **检查清单**: 在调用任何子代理前，先在“思考”中确认是否已满足其所有“需要信息”。\n"
@@ -100,16 +90,33 @@ SYSTEM_PROMPT = (
 )
 
 react_planner = PlanReActPlanner()
+step_budget = StepBudget.for_role("supervisor")
 
 supervisor_agent = LlmAgent(
     name="SupervisorAgent",
-    # model=model_config,
-    model="gemini-2.5-pro",
+    model=get_model("supervisor"),
     instruction=SYSTEM_PROMPT,
     planner=react_planner,
-    before_model_callback=read_files_as_text_callback,
+    before_agent_callback=telemetry.before_agent_callback,
+    after_agent_callback=telemetry.after_agent_callback,
+    before_model_callback=[
+        read_files_as_text_callback_async,
+        make_context_budget_callback(),
+        materialize_artifacts_callback_async,
+        step_budget.before_model_callback,
+        telemetry.before_model_callback,
+    ],
+    after_model_callback=telemetry.after_model_callback,
+    on_model_error_callback=telemetry.on_model_error_callback,
+    before_tool_callback=[
+        telemetry.before_tool_callback,
+        step_budget.before_tool_callback,
+        tool_result_cache.before_tool_callback,
+    ],
+    after_tool_callback=[tool_result_cache.after_tool_callback, telemetry.after_tool_callback],
+    on_tool_error_callback=telemetry.on_tool_error_callback,
     sub_agents=[experiment_design_agent, data_analyze_agent, paper_analyze_agent],
-    tools=[mcp_toolset]
+    tools=[get_mcp_toolset(), recall_file, analyze_papers_in_parallel]
 )
 
 # 当 ADK Web 服务器加载这个文件时，它会自动寻找这个 root_agent 实例
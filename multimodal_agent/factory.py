@@ -0,0 +1,43 @@
+"""
+代理共享的模型与工具集工厂。
+
+所有代理都从这里获取模型和 MCP 工具集，而不是在各自的模块中重复创建：
+- `.env` 由 `app_config` 统一加载，整个进程只加载一次。
+- LiteLlm（会导入较重的 litellm 库）只在首次调用 `get_lite_llm()` 时才创建。
+- MCP 工具集在进程内共享同一个实例。
+- 每个代理的模型是一个 `RoutedLlm`：按调用在 fast / pro 两档之间路由，失败时回退到 LiteLlm
+  （见 `model_router.py`）。
+"""
+
+import functools
+
+from app_config import get_env
+from tools.mcp_client import get_mcp_toolset
+from .model_router import RoutedLlm, make_routed_llm
+
+__all__ = ["get_model", "get_lite_llm", "get_mcp_toolset"]
+
+
+def get_model(role: str = "default") -> RoutedLlm:
+    """
+    返回指定角色的代理所使用的模型。
+
+    pro 档模型由 `CHEMINSIGHT_MODEL` 配置，fast 档模型由 `CHEMINSIGHT_FAST_MODEL` 配置。
+
+    Args:
+        role: 代理角色，例如 "supervisor"、"experiment_design"、"data_analyze"、"paper_analyze"。
+    """
+    return make_routed_llm(role)
+
+
+@functools.lru_cache(maxsize=None)
+def get_lite_llm():
+    """返回通过 OpenAI 兼容接口访问的 LiteLlm 模型；首次调用时才导入 litellm。"""
+    from google.adk.models.lite_llm import LiteLlm
+
+    return LiteLlm(
+        # 强烈建议使用原生支持多模态的强大模型
+        model=get_env("LITELLM_MODEL", "openai/gemini-2.5-pro"),
+        api_base=get_env("OPENAI_API_BASE"),
+        api_key=get_env("OPENAI_API_KEY"),
+    )
@@ -0,0 +1,231 @@
+"""
+按调用分档的模型路由。
+
+此前所有代理（包括主要只负责判断转交给哪个子代理的 SupervisorAgent）都固定使用
+`gemini-2.5-pro`。`RoutedLlm` 在每一次模型调用时按下面的规则选择档位：
+
+- `fast` 档（`CHEMINSIGHT_FAST_MODEL`，默认 `gemini-2.5-flash`）：`MODEL_FAST_DISPATCH_ROLES`
+  （默认只有 `supervisor`）中角色的调度步骤，即最近一条真正的用户消息之后还没有工具调用、工具结果
+  或其他代理输出的调用（主代理选择转交给哪个子代理）。子代理交回控制权后，主代理整合结果、撰写最终报告
+  的调用（ADK 把子代理的输出改写成 "For context: ..." 的 user 消息）属于 report 阶段，使用 pro 档。
+- `pro` 档（`CHEMINSIGHT_MODEL`，默认 `gemini-2.5-pro`）：其余所有调用。子代理可能不调用任何工具、
+  在第一步就直接给出最终报告，因此默认全部使用 pro 档；收到工具结果之后的调用、没有任何工具可用的
+  纯生成调用（例如论文综合报告）以及输入超过 `MODEL_ROUTER_FAST_MAX_TOKENS` 的调用也使用 pro 档。
+
+`MODEL_TIER_<ROLE>`（例如 `MODEL_TIER_SUPERVISOR=pro`）可以把某个角色的全部调用固定在一个档位，
+`MODEL_ROUTING=0` 时所有调用都使用 `pro` 档。
+
+档位模型因限流、服务端错误或网络错误失败（且尚未输出任何内容）时，自动改用 `factory.get_lite_llm()`
+配置的 OpenAI 兼容端点重试一次（需要配置 `OPENAI_API_BASE`，`MODEL_FALLBACK=0` 关闭）；
+被限流的档位在 `MODEL_FALLBACK_COOLDOWN_S` 秒内直接走备用端点。
+
+每次调用按档位记录耗时和 token 数（`model_tier` 阶段），用于确认调度步骤变快、报告步骤不受影响。
+"""
+
+import time
+from typing import AsyncGenerator
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.adk.models.registry import LLMRegistry
+from google.genai import errors
+from pydantic import PrivateAttr
+
+from app_config import get_env
+from logger_config import logger
+from telemetry import telemetry
+from tools.context_budget import estimate_request_tokens
+
+FAST = "fast"
+PRO = "pro"
+FALLBACK = "fallback"
+
+DEFAULT_MODEL = "gemini-2.5-pro"
+DEFAULT_FAST_MODEL = "gemini-2.5-flash"
+
+# 输入超过该 token 数的调用总是使用 pro 档
+FAST_MAX_INPUT_TOKENS = int(get_env("MODEL_ROUTER_FAST_MAX_TOKENS", 32_000))
+ROUTING_ENABLED = get_env("MODEL_ROUTING", "1") != "0"
+FALLBACK_ENABLED = get_env("MODEL_FALLBACK", "1") != "0" and bool(get_env("OPENAI_API_BASE"))
+FALLBACK_COOLDOWN_S = float(get_env("MODEL_FALLBACK_COOLDOWN_S", 30))
+# 调度步骤可以使用 fast 档的角色；这些角色的调度步骤只负责转交，不会直接生成报告
+FAST_DISPATCH_ROLES = frozenset(
+    role.strip() for role in get_env("MODEL_FAST_DISPATCH_ROLES", "supervisor").split(",") if role.strip()
+)
+
+# 值得换一个端点重试的 HTTP 状态码：超时、限流和服务端错误
+_RETRYABLE_CODES = {408, 429}
+
+
+def _is_retryable(error: BaseException) -> bool:
+    if isinstance(error, errors.APIError):
+        return error.code in _RETRYABLE_CODES or (error.code or 0) >= 500
+    return isinstance(error, (TimeoutError, ConnectionError))
+
+
+# ADK 把其他代理的事件改写成以该前缀开头的 user 消息再交给当前代理
+_OTHER_AGENT_CONTEXT_PREFIX = "For context:"
+
+
+def _is_other_agent_context(content) -> bool:
+    parts = content.parts or []
+    return content.role == "user" and bool(parts) and (parts[0].text or "").startswith(_OTHER_AGENT_CONTEXT_PREFIX)
+
+
+def _phase(llm_request: LlmRequest) -> str:
+    """
+    判断调用所处的阶段：dispatch（调度 / 规划）、observe（收到工具结果后）、
+    report（子代理交回控制权后整合结果）或 generate（无工具的纯生成）。
+    """
+    if not llm_request.tools_dict:
+        return "generate"
+    contents = llm_request.contents or []
+    last = contents[-1] if contents else None
+    if last and any(part.function_response for part in last.parts or []):
+        return "observe"
+    # 最近一条真正的用户消息之后出现了其他代理的输出或工具调用 / 结果，说明是在整合结果、撰写最终报告
+    for content in reversed(contents):
+        if _is_other_agent_context(content) or any(
+            part.function_call or part.function_response for part in content.parts or []
+        ):
+            return "report"
+        if content.role == "user":
+            break
+    return "dispatch"
+
+
+def choose_tier(role: str, llm_request: LlmRequest) -> tuple[str, str]:
+    """返回 (档位, 阶段)。"""
+    phase = _phase(llm_request)
+    pinned = get_env(f"MODEL_TIER_{role.upper()}")
+    if pinned in (FAST, PRO):
+        return pinned, phase
+    if not ROUTING_ENABLED or phase != "dispatch" or role not in FAST_DISPATCH_ROLES:
+        return PRO, phase
+    if estimate_request_tokens(llm_request) > FAST_MAX_INPUT_TOKENS:
+        return PRO, phase
+    return FAST, phase
+
+
+class RoutedLlm(BaseLlm):
+    """
+    按档位路由、失败时回退到 LiteLlm 的模型包装。
+
+    `model` 字段为 pro 档的模型名，ADK 据此判断模型能力；实际调用的模型在每次请求时确定。
+
+    Args:
+        role: 代理角色，用于档位固定配置和埋点标签。
+        fast_model: fast 档的模型名。
+    """
+
+    role: str = "default"
+    fast_model: str = DEFAULT_FAST_MODEL
+
+    _llms: dict = PrivateAttr(default_factory=dict)
+    _cooldown_until: dict = PrivateAttr(default_factory=dict)
+
+    @property
+    def capabilities(self):
+        return self._resolve(PRO).capabilities
+
+    def _model_name(self, tier: str) -> str:
+        return self.fast_model if tier == FAST else self.model
+
+    def _resolve(self, tier: str) -> BaseLlm:
+        llm = self._llms.get(tier)
+        if llm is None:
+            if tier == FALLBACK:
+                from .factory import get_lite_llm
+
+                llm = get_lite_llm()
+            else:
+                llm = LLMRegistry.new_llm(self._model_name(tier))
+            self._llms[tier] = llm
+        return llm
+
+    async def _generate(
+        self, tier: str, phase: str, llm_request: LlmRequest, stream: bool
+    ) -> AsyncGenerator[LlmResponse, None]:
+        """调用一个档位的模型，并按档位记录耗时和 token 数。"""
+        llm = self._resolve(tier)
+        llm_request.model = llm.model
+        started_at = time.time()
+        # 只累计等待模型的时间，不包括调用方处理每个响应分片的时间
+        elapsed, start = 0.0, time.perf_counter()
+        usage = None
+        try:
+            async for response in llm.generate_content_async(llm_request, stream=stream):
+                elapsed += time.perf_counter() - start
+                if response.usage_metadata:
+                    usage = response.usage_metadata
+                yield response
+                start = time.perf_counter()
+        except BaseException as e:
+            telemetry.record_model_tier(tier, self.role, phase, llm.model, elapsed + time.perf_counter() - start,
+                                        started_at=started_at, error=e)
+            raise
+        telemetry.record_model_tier(
+            tier, self.role, phase, llm.model, elapsed, started_at=started_at,
+            input_tokens=(usage.prompt_token_count or 0) if usage else 0,
+            output_tokens=(usage.candidates_token_count or 0) if usage else 0,
+        )
+
+    def _cooling_down(self, tier: str) -> bool:
+        return FALLBACK_ENABLED and time.monotonic() < self._cooldown_until.get(tier, 0.0)
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        tier, phase = choose_tier(self.role, llm_request)
+        if not self._cooling_down(tier):
+            produced = False
+            try:
+                async for response in self._generate(tier, phase, llm_request, stream):
+                    produced = True
+                    yield response
+                return
+            except Exception as e:
+                # 已经输出了部分内容，或错误与端点无关（例如请求本身不合法）时不重试
+                if produced or not FALLBACK_ENABLED or not _is_retryable(e):
+                    raise
+                if isinstance(e, errors.APIError) and e.code == 429:
+                    self._cooldown_until[tier] = time.monotonic() + FALLBACK_COOLDOWN_S
+                logger.warning(f"{self.role} 的 {tier} 档模型调用失败，改用备用端点: {e}")
+        async for response in self._generate(FALLBACK, phase, llm_request, stream):
+            yield response
+
+    def warm_up(self) -> None:
+        """创建各档位的模型客户端，使首个请求不承担客户端初始化和依赖导入的开销。"""
+        tiers = [PRO, FAST] + ([FALLBACK] if FALLBACK_ENABLED else [])
+        for tier in tiers:
+            try:
+                llm = self._resolve(tier)
+                # Gemini 的客户端在首次访问 api_client 时创建
+                getattr(llm, "api_client", None)
+            except Exception as e:
+                logger.warning(f"预热 {self.role} 的 {tier} 档模型失败: {e}")
+
+    def connect(self, llm_request: LlmRequest):
+        llm = self._resolve(PRO)
+        llm_request.model = llm.model
+        return llm.connect(llm_request)
+
+
+def make_routed_llm(role: str) -> RoutedLlm:
+    return RoutedLlm(
+        model=get_env("CHEMINSIGHT_MODEL", DEFAULT_MODEL),
+        fast_model=get_env("CHEMINSIGHT_FAST_MODEL", DEFAULT_FAST_MODEL),
+        role=role,
+    )
+
+
+def warm_up_models(agent) -> int:
+    """预热代理树中所有按档位路由的模型，返回预热的模型数。"""
+    count = 0
+    if isinstance(getattr(agent, "model", None), RoutedLlm):
+        agent.model.warm_up()
+        count += 1
+    for sub_agent in agent.sub_agents:
+        count += warm_up_models(sub_agent)
+    return count
@@ -1,36 +1,16 @@
-import os
-
-from dotenv import load_dotenv
-from logger_config import logger
-
 # --- ADK Framework Imports ---
 from google.adk.agents import LlmAgent
-from google.adk.models.lite_llm import LiteLlm
 # 我们依然需要原始的加载工具，但在新的智能工具内部使用它
-from tools.file_reader_tool import read_files_as_text_callback
-from google.adk.tools.mcp_tool import StreamableHTTPConnectionParams
-from google.adk.tools.mcp_tool.mcp_toolset import McpToolset
+from tools.file_reader_tool import read_files_as_text_callback_async
+from tools.artifact_store import materialize_artifacts_callback_async
+from tools.paper_index import index_papers_callback_async, search_uploaded_papers
+from tools.context_budget import make_context_budget_callback, recall_file
+from tools.tool_result_cache import tool_result_cache
+from tools.response_cache import agent_response_cache
+from tools.step_budget import StepBudget
+from telemetry import telemetry
 from google.adk.planners.plan_re_act_planner import PlanReActPlanner
-
-
-# Your ADK agent connects to the remote MCP service via Streamable HTTP
-mcp_toolset = McpToolset(
-    connection_params=StreamableHTTPConnectionParams(
-        url="https://mcp.635262140.xyz/mcp",
-    )
-)
-
-# --- Load Environment Variables ---
-load_dotenv()
-API_KEY = os.getenv("OPENAI_API_KEY")
-ENDPOINT = os.getenv("OPENAI_API_BASE")
-
-model_config = LiteLlm(
-    # 强烈建议使用原生支持多模态的强大模型
-    model="openai/gemini-2.5-pro",
-    api_base=ENDPOINT,
-    api_key=API_KEY
-)
+from ...factory import get_mcp_toolset, get_model
 
 # --- 【重要】更新后的系统提示 ---
 SYSTEM_PROMPT = (
@@ -58,18 +38,38 @@ SYSTEM_PROMPT = (
     "**重要提示**:\n"
     "- 在没有足够信息之前，不要直接给出最终答案。\n"
     "- 每次只执行一个行动。\n"
+    "- 用户上传的长文档不会整体出现在对话中，只提供开头部分；需要文中的方法、条件、数据或结论时，调用 `search_uploaded_papers` 工具检索相关段落，引用时注明页码或章节。\n"
     "- 优先使用 MCP 工具进行信息检索，以确保方案的前沿性和准确性。\n\n"
     "现在，开始解决用户的问题"
 )
 
 react_planner = PlanReActPlanner()
+step_budget = StepBudget.for_role("experiment_design")
+response_cache = agent_response_cache.for_prompt(SYSTEM_PROMPT)
 
 experiment_design_agent = LlmAgent(
     name="ExperimentDesignAgent",
-    # model=model_config,
-    model="gemini-2.5-pro",
+    model=get_model("experiment_design"),
     instruction=SYSTEM_PROMPT,
     planner=react_planner,
-    before_model_callback=read_files_as_text_callback,
-    tools=[mcp_toolset]
+    before_agent_callback=[response_cache.before_agent_callback, telemetry.before_agent_callback],
+    after_agent_callback=[response_cache.after_agent_callback, telemetry.after_agent_callback],
+    before_model_callback=[
+        index_papers_callback_async,
+        read_files_as_text_callback_async,
+        make_context_budget_callback(),
+        materialize_artifacts_callback_async,
+        step_budget.before_model_callback,
+        telemetry.before_model_callback,
+    ],
+    after_model_callback=telemetry.after_model_callback,
+    on_model_error_callback=telemetry.on_model_error_callback,
+    before_tool_callback=[
+        telemetry.before_tool_callback,
+        step_budget.before_tool_callback,
+        tool_result_cache.before_tool_callback,
+    ],
+    after_tool_callback=[tool_result_cache.after_tool_callback, telemetry.after_tool_callback],
+    on_tool_error_callback=telemetry.on_tool_error_callback,
+    tools=[search_uploaded_papers, get_mcp_toolset(), recall_file]
 )
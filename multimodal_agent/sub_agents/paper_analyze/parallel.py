@@ -0,0 +1,156 @@
+import asyncio
+from typing import Optional
+
+from app_config import get_env
+from logger_config import logger
+from telemetry import telemetry
+
+# --- ADK Framework Imports ---
+from google.adk.agents import LlmAgent
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.adk.tools import ToolContext
+from google.genai import types
+from ...factory import get_model
+from tools.step_budget import DEADLINE_STATE_KEY
+from .agent import paper_analyze_agent
+
+# 同时分析的论文数上限
+PAPER_FANOUT_CONCURRENCY = int(get_env("PAPER_FANOUT_CONCURRENCY", 4))
+
+SYNTHESIS_PROMPT = (
+    "你是一位顶级的生物学家和文献综述专家。你将收到多篇论文各自独立的分析报告以及用户的研究问题。\n"
+    "你的任务是把这些报告整合为一份完整、连贯的综合文献分析报告：\n"
+    "1. 对比各篇论文的研究目标、方法、关键结果与结论，指出共性与差异。\n"
+    "2. 围绕用户的研究问题，归纳各篇论文提供的证据及其强弱。\n"
+    "3. 指出尚未解决的问题和可能的研究方向。\n"
+    "引用某篇论文的结论时，请注明论文文件名。不得编造报告中没有的信息。\n"
+    "这份报告将提交给项目经理（主代理）进行整合。"
+)
+
+# 每篇论文使用一个独立的 PaperAnalyzeAgent 副本，在各自独立的会话中运行
+paper_worker_agent = paper_analyze_agent.clone(update={"name": "PaperAnalyzeWorker"})
+
+paper_synthesis_agent = LlmAgent(
+    name="PaperSynthesisAgent",
+    model=get_model("paper_synthesis"),
+    instruction=SYNTHESIS_PROMPT,
+    before_agent_callback=telemetry.before_agent_callback,
+    after_agent_callback=telemetry.after_agent_callback,
+    before_model_callback=telemetry.before_model_callback,
+    after_model_callback=telemetry.after_model_callback,
+    on_model_error_callback=telemetry.on_model_error_callback,
+)
+
+_session_service = InMemorySessionService()
+_worker_runner = Runner(app_name="paper_fanout", agent=paper_worker_agent, session_service=_session_service)
+_synthesis_runner = Runner(app_name="paper_synthesis", agent=paper_synthesis_agent, session_service=_session_service)
+
+
+def _is_file_part(part: types.Part) -> bool:
+    return bool((part.inline_data and part.inline_data.data) or part.file_data)
+
+
+def _file_name(part: types.Part, index: int) -> str:
+    blob = part.inline_data or part.file_data
+    return blob.display_name or f"paper_{index + 1}"
+
+
+def _collect_papers(tool_context: ToolContext) -> list[types.Part]:
+    """优先取本轮用户消息中的文件；本轮没有文件时回溯到最近一条带文件的用户消息。"""
+    user_content = tool_context.user_content
+    if user_content and user_content.parts:
+        papers = [part for part in user_content.parts if _is_file_part(part)]
+        if papers:
+            return papers
+    for event in reversed(tool_context.session.events):
+        if event.author != "user" or not event.content or not event.content.parts:
+            continue
+        papers = [part for part in event.content.parts if _is_file_part(part)]
+        if papers:
+            return papers
+    return []
+
+
+def _final_text(event) -> Optional[str]:
+    if not (event.is_final_response() and event.content and event.content.parts):
+        return None
+    text = "".join(part.text for part in event.content.parts if part.text and not part.thought)
+    return text or None
+
+
+async def _run_once(runner: Runner, user_id: str, message: types.Content, deadline: Optional[float] = None) -> str:
+    """在一个临时会话中运行代理，返回其最终回复文本；子会话继承调用方的截止时间。"""
+    session = await runner.session_service.create_session(app_name=runner.app_name, user_id=user_id)
+    state_delta = {DEADLINE_STATE_KEY: deadline} if deadline is not None else None
+    final_text = ""
+    try:
+        async for event in runner.run_async(
+            user_id=user_id, session_id=session.id, new_message=message, state_delta=state_delta
+        ):
+            text = _final_text(event)
+            if text:
+                final_text = text
+    finally:
+        await runner.session_service.delete_session(
+            app_name=runner.app_name, user_id=user_id, session_id=session.id
+        )
+    return final_text
+
+
+async def analyze_papers_in_parallel(question: str, tool_context: ToolContext) -> dict:
+    """
+    并行分析用户上传的多篇论文，并把各篇的分析报告整合为一份综合报告。
+
+    当用户一次上传了两篇或更多论文时，使用此工具代替逐篇转交给 PaperAnalyzeAgent。
+
+    Args:
+        question: 用户的研究问题，以及分析时需要关注的重点。
+
+    Returns:
+        包含每篇论文的分析报告 (per_paper_reports) 和综合报告 (synthesis) 的结果。
+    """
+    papers = _collect_papers(tool_context)
+    if not papers:
+        return {"status": "error", "message": "对话中没有找到用户上传的论文文件。"}
+
+    user_id = tool_context.user_id
+    deadline = tool_context.state.get(DEADLINE_STATE_KEY)
+    semaphore = asyncio.Semaphore(PAPER_FANOUT_CONCURRENCY)
+    logger.info(f"并行分析 {len(papers)} 篇论文 (并发上限 {PAPER_FANOUT_CONCURRENCY})")
+
+    async def analyze(index: int, paper: types.Part) -> dict:
+        name = _file_name(paper, index)
+        message = types.Content(
+            role="user",
+            parts=[
+                paper,
+                types.Part(text=f"研究问题: {question}\n请仅针对这一篇论文 ('{name}') 进行分析，并输出文献分析报告。"),
+            ],
+        )
+        async with semaphore:
+            try:
+                report = await _run_once(_worker_runner, user_id, message, deadline)
+            except Exception as e:
+                logger.error(f"论文 '{name}' 分析失败: {e}")
+                return {"paper": name, "status": "error", "report": f"分析失败: {e}"}
+        return {"paper": name, "status": "success", "report": report}
+
+    reports = await asyncio.gather(*(analyze(i, paper) for i, paper in enumerate(papers)))
+
+    # --- 汇总：把各篇报告交给综合代理 ---
+    sections = "\n\n".join(
+        f"### 论文 {i + 1}: {r['paper']}\n{r['report'] or '(未生成报告)'}" for i, r in enumerate(reports)
+    )
+    synthesis_message = types.Content(
+        role="user",
+        parts=[types.Part(text=f"研究问题: {question}\n\n以下是各篇论文的独立分析报告:\n\n{sections}")],
+    )
+    synthesis = await _run_once(_synthesis_runner, user_id, synthesis_message, deadline)
+
+    return {
+        "status": "success",
+        "paper_count": len(papers),
+        "per_paper_reports": reports,
+        "synthesis": synthesis,
+    }
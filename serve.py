@@ -0,0 +1,405 @@
+"""
+生产环境的多进程服务入口。
+
+`uvicorn main:app --workers N` 不适合本应用：每个进程都有自己的 MCP 连接、结果缓存、
+文件解析进程池和批处理任务表，请求被随机分配到不同进程时，这些进程内状态既不能复用，
+`/knowledge-base/invalidate` 这类操作也只会作用于其中一个进程。
+
+`serve.py` 的结构：
+- 启动时按容器可用的 CPU 数（`sched_getaffinity` 与 cgroup 配额，可用 `WEB_CONCURRENCY` / `--workers` 覆盖）
+  预先启动 N 个工作进程，每个进程运行一个 `main:app`，监听本地 Unix socket。工作进程在启动阶段
+  预热 MCP 连接和各档位的模型客户端（`WORKER_WARM_UP=1`），全部就绪后才开始对外监听。
+- 主进程运行一个轻量的反向代理：同一个会话的请求（URL 中的会话 ID，或 `/run`、`/run_sse` 请求体中的
+  `session_id`）按哈希固定转发到同一个工作进程，以复用该进程内的缓存；其余请求转发到当前处理中请求最少的进程。
+  `/metrics` 汇总所有工作进程的指标，`/knowledge-base/invalidate` 广播到所有工作进程，
+  `/batch/jobs/{job_id}` 依次查询各工作进程。
+- 会话保存在多进程共享的 SQLite（WAL）会话库中，因此任何工作进程都可以处理任何会话；
+  会话库压缩和上传文件清理只在 0 号工作进程中运行。工作进程意外退出时会被自动重启，
+  在此期间其会话转发到下一个工作进程。
+- 收到 SIGTERM / SIGINT 时停止接受新连接，等待处理中的请求完成（最多 `SERVE_GRACEFUL_TIMEOUT_S` 秒），
+  再依次关闭工作进程（工作进程会提交未写入的会话事件、关闭 MCP 连接）。
+
+用法:
+    python serve.py --host 0.0.0.0 --port 8000
+    python serve.py --workers 4 --app benchmarks.bench_app:app
+
+Gemini Live (`/run_live` WebSocket) 不经过代理转发，需要时请使用单进程的 `uvicorn main:app`。
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from app_config import get_env
+from logger_config import logger
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+_SESSION_PATH_RE = re.compile(r"^/apps/[^/]+/users/[^/]+/sessions/([^/]+)")
+# 不解析整个请求体（其中可能有 base64 编码的上传文件），只查找顶层的会话 ID 字段
+_SESSION_BODY_RE = re.compile(rb'"session(?:_id|Id)"\s*:\s*"([^"]+)"')
+_BATCH_JOB_PATH_RE = re.compile(r"^/batch/jobs/[^/]+$")
+# 不转发的逐跳首部
+_HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "upgrade", "te", "trailer",
+                "proxy-authorization", "proxy-authenticate", "host"}
+# 只能使用单进程会话服务的 URI 前缀
+_PROCESS_LOCAL_SESSION_SCHEMES = ("memory", "agentengine")
+
+
+def container_cpus() -> int:
+    """容器可用的 CPU 数：进程的 CPU 亲和性，再受 cgroup CPU 配额限制。"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = None
+    try:
+        with open("/sys/fs/cgroup/cpu.max", "r", encoding="utf-8") as f:
+            value, period = f.read().split()
+        if value != "max":
+            quota = int(value) / int(period)
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "r", encoding="utf-8") as f:
+                value = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us", "r", encoding="utf-8") as f:
+                period = int(f.read())
+            if value > 0:
+                quota = value / period
+        except (OSError, ValueError):
+            pass
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return max(1, cpus)
+
+
+def session_key(path: str, body: bytes) -> Optional[str]:
+    """请求所属的会话 ID；与会话无关的请求返回 None。"""
+    match = _SESSION_PATH_RE.match(path)
+    if match:
+        return match.group(1)
+    if path in ("/run", "/run_sse") and body:
+        match = _SESSION_BODY_RE.search(body)
+        if match:
+            return match.group(1).decode("utf-8", "replace")
+    return None
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def merge_metrics(texts: list[str]) -> str:
+    """把多个工作进程的 Prometheus 文本相加：计数器、直方图和 gauge 的同名序列逐项求和。"""
+    lines: list[str] = []
+    totals: dict[str, float] = {}
+    seen_comments: set[str] = set()
+    for text in texts:
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line.startswith("#"):
+                if line not in seen_comments:
+                    seen_comments.add(line)
+                    lines.append(line)
+                continue
+            series, _, value = line.rpartition(" ")
+            try:
+                number = float(value)
+            except ValueError:
+                continue
+            if series not in totals:
+                totals[series] = 0.0
+                lines.append(series)
+            totals[series] += number
+    return "\n".join(line if line.startswith("#") else f"{line} {_format_value(totals[line])}" for line in lines) + "\n"
+
+
+class Worker:
+    """一个工作进程：子进程句柄、Unix socket 上的 HTTP 客户端和处理中的请求数。"""
+
+    def __init__(self, index: int, socket_path: str):
+        self.index = index
+        self.socket_path = socket_path
+        self.process: Optional[subprocess.Popen] = None
+        self.client: Optional[httpx.AsyncClient] = None
+        self.ready = False
+        self.in_flight = 0
+        self.restarts = 0
+
+    def open_client(self, timeout_s: float) -> None:
+        self.client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(uds=self.socket_path),
+            base_url="http://worker",
+            timeout=httpx.Timeout(timeout_s, connect=5.0),
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=64),
+        )
+
+
+class WorkerPool:
+    """
+    工作进程池与粘性代理。
+
+    Args:
+        app: 工作进程运行的 ASGI 应用，例如 `main:app`。
+        workers: 工作进程数。
+        graceful_timeout_s: 关闭时等待工作进程处理完请求的时间。
+        request_timeout_s: 转发请求的超时时间。
+        log_level: 工作进程的 uvicorn 日志级别。
+    """
+
+    def __init__(self, app: str, workers: int, graceful_timeout_s: float = 60.0,
+                 request_timeout_s: float = 600.0, log_level: str = "warning"):
+        self.app = app
+        self.graceful_timeout_s = graceful_timeout_s
+        self.request_timeout_s = request_timeout_s
+        self.log_level = log_level
+        self.socket_dir = tempfile.mkdtemp(prefix="cheminsight-serve-")
+        self.workers = [Worker(i, os.path.join(self.socket_dir, f"worker-{i}.sock")) for i in range(workers)]
+        self._stopping = False
+        self._monitor_task: Optional[asyncio.Task] = None
+
+    # --- 工作进程管理 ---
+    def _worker_env(self, worker: Worker) -> dict:
+        env = dict(
+            os.environ,
+            SERVE_WORKER_INDEX=str(worker.index),
+            SERVE_WORKER_COUNT=str(len(self.workers)),
+            WORKER_WARM_UP=get_env("WORKER_WARM_UP", "1"),
+            PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")])),
+        )
+        # 各工作进程的文件解析进程池平分 CPU，而不是每个进程都按全部 CPU 创建
+        env.setdefault("EXTRACTION_PROCESS_WORKERS", str(max(1, min(4, container_cpus() // len(self.workers)))))
+        return env
+
+    def _spawn(self, worker: Worker) -> None:
+        if os.path.exists(worker.socket_path):
+            os.unlink(worker.socket_path)
+        worker.ready = False
+        worker.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", self.app, "--uds", worker.socket_path,
+             "--log-level", self.log_level, "--no-access-log",
+             "--timeout-graceful-shutdown", str(int(self.graceful_timeout_s))],
+            env=self._worker_env(worker),
+            # 独立的进程组：终端的 Ctrl-C 只发给主进程，由主进程按顺序关闭工作进程
+            start_new_session=True,
+        )
+
+    async def _wait_ready(self, worker: Worker, timeout_s: float = 300.0) -> None:
+        deadline = time.monotonic() + timeout_s
+        while time.monotonic() < deadline:
+            if worker.process.poll() is not None:
+                raise RuntimeError(f"工作进程 {worker.index} 启动失败 (exit code {worker.process.returncode})")
+            if os.path.exists(worker.socket_path):
+                try:
+                    response = await worker.client.get("/health")
+                    if response.status_code == 200:
+                        worker.ready = True
+                        return
+                except httpx.TransportError:
+                    pass
+            await asyncio.sleep(0.2)
+        raise TimeoutError(f"等待工作进程 {worker.index} 就绪超时")
+
+    async def start(self) -> None:
+        started = time.perf_counter()
+        for worker in self.workers:
+            worker.open_client(self.request_timeout_s)
+            self._spawn(worker)
+        await asyncio.gather(*(self._wait_ready(worker) for worker in self.workers))
+        logger.info(f"{len(self.workers)} 个工作进程已就绪 ({self.app}, {time.perf_counter() - started:.1f}s)")
+        self._monitor_task = asyncio.create_task(self._monitor())
+
+    async def _monitor(self) -> None:
+        """重启意外退出的工作进程。"""
+        while not self._stopping:
+            await asyncio.sleep(1.0)
+            for worker in self.workers:
+                if self._stopping or worker.process.poll() is None:
+                    continue
+                logger.error(f"工作进程 {worker.index} 意外退出 (exit code {worker.process.returncode})，正在重启")
+                worker.restarts += 1
+                self._spawn(worker)
+                try:
+                    await self._wait_ready(worker)
+                except (RuntimeError, TimeoutError) as e:
+                    logger.error(str(e))
+
+    async def stop(self) -> None:
+        """依次关闭工作进程：先发送 SIGTERM 让其处理完请求，超时后强制结束。"""
+        self._stopping = True
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+        for worker in self.workers:
+            worker.ready = False
+            if worker.process is not None and worker.process.poll() is None:
+                worker.process.send_signal(signal.SIGTERM)
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            try:
+                await asyncio.to_thread(worker.process.wait, self.graceful_timeout_s + 5)
+            except subprocess.TimeoutExpired:
+                logger.warning(f"工作进程 {worker.index} 未能按时退出，强制结束")
+                worker.process.kill()
+            if worker.client is not None:
+                await worker.client.aclose()
+        shutil.rmtree(self.socket_dir, ignore_errors=True)
+
+    # --- 路由 ---
+    def _ready_workers(self) -> list[Worker]:
+        return [worker for worker in self.workers if worker.ready]
+
+    def pick(self, key: Optional[str]) -> Worker:
+        ready = self._ready_workers()
+        if not ready:
+            raise RuntimeError("没有可用的工作进程")
+        if key is None:
+            return min(ready, key=lambda worker: worker.in_flight)
+        # 会话固定到哈希对应的工作进程；该进程不可用时顺延到下一个
+        start = zlib.crc32(key.encode("utf-8")) % len(self.workers)
+        for offset in range(len(self.workers)):
+            worker = self.workers[(start + offset) % len(self.workers)]
+            if worker.ready:
+                return worker
+        return ready[0]
+
+    @staticmethod
+    def _forward_headers(headers) -> list[tuple[str, str]]:
+        return [(name, value) for name, value in headers.items() if name.lower() not in _HOP_HEADERS]
+
+    async def _forward(self, worker: Worker, request: Request, body: bytes) -> Response:
+        worker.in_flight += 1
+        try:
+            upstream = await worker.client.send(
+                worker.client.build_request(
+                    request.method, request.url.path, params=request.url.query,
+                    headers=self._forward_headers(request.headers), content=body,
+                ),
+                stream=True,
+            )
+        except BaseException:
+            worker.in_flight -= 1
+            raise
+
+        async def release():
+            worker.in_flight -= 1
+            await upstream.aclose()
+
+        # 流式转发（`/run_sse` 的事件逐个到达客户端）；保留原始编码
+        return StreamingResponse(
+            upstream.aiter_raw(), status_code=upstream.status_code,
+            headers=dict(self._forward_headers(upstream.headers)), background=BackgroundTask(release),
+        )
+
+    async def _gather(self, method: str, path: str, **kwargs) -> list[httpx.Response]:
+        responses = await asyncio.gather(
+            *(worker.client.request(method, path, **kwargs) for worker in self._ready_workers()),
+            return_exceptions=True,
+        )
+        return [response for response in responses if isinstance(response, httpx.Response)]
+
+    async def handle(self, request: Request) -> Response:
+        path = request.url.path
+        if path == "/metrics" and request.method == "GET":
+            responses = await self._gather("GET", "/metrics")
+            texts = [response.text for response in responses if response.status_code == 200]
+            return PlainTextResponse(merge_metrics(texts) + self._own_metrics())
+        if path == "/knowledge-base/invalidate" and request.method == "POST":
+            responses = await self._gather("POST", path, params=request.url.query)
+            return JSONResponse({"workers": [response.json() for response in responses if response.status_code == 200]})
+        if _BATCH_JOB_PATH_RE.match(path) and request.method == "GET":
+            # 批处理任务保存在提交它的工作进程中
+            for worker in self._ready_workers():
+                response = await worker.client.get(path)
+                if response.status_code != 404:
+                    return Response(response.content, response.status_code, media_type=response.headers.get("content-type"))
+            return JSONResponse({"detail": "任务不存在"}, status_code=404)
+        body = await request.body()
+        try:
+            worker = self.pick(session_key(path, body))
+            return await self._forward(worker, request, body)
+        except (RuntimeError, httpx.TransportError) as e:
+            logger.error(f"转发 {request.method} {path} 失败: {e}")
+            # 工作进程已退出时立即停止向它转发，不必等监控任务发现
+            for worker in self.workers:
+                if worker.process is not None and worker.process.poll() is not None:
+                    worker.ready = False
+            return JSONResponse({"detail": "服务暂不可用"}, status_code=503)
+
+    def _own_metrics(self) -> str:
+        lines = []
+        for name, value in (
+            ("workers", len(self.workers)),
+            ("workers_ready", len(self._ready_workers())),
+            ("worker_restarts", sum(worker.restarts for worker in self.workers)),
+            ("in_flight", sum(worker.in_flight for worker in self.workers)),
+        ):
+            lines.append(f"# TYPE cheminsight_serve_{name} gauge")
+            lines.append(f"cheminsight_serve_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    # --- ASGI ---
+    @asynccontextmanager
+    async def lifespan(self, app: Starlette):
+        await self.start()
+        try:
+            yield
+        finally:
+            await self.stop()
+
+    def asgi_app(self) -> Starlette:
+        """主进程的代理应用；WebSocket 请求没有匹配的路由，会被直接关闭。"""
+        methods = ["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
+        return Starlette(routes=[Route("/{path:path}", self.handle, methods=methods)], lifespan=self.lifespan)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="ChemInsight 多进程服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(get_env("PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=int(get_env("WEB_CONCURRENCY", 0)),
+                        help="工作进程数，默认为容器可用的 CPU 数")
+    parser.add_argument("--app", default="main:app", help="工作进程运行的 ASGI 应用")
+    parser.add_argument("--graceful-timeout", type=float, default=float(get_env("SERVE_GRACEFUL_TIMEOUT_S", 60)),
+                        help="关闭时等待处理中请求完成的秒数")
+    parser.add_argument("--log-level", default="warning", help="工作进程的 uvicorn 日志级别")
+    args = parser.parse_args()
+
+    workers = args.workers or container_cpus()
+    session_uri = get_env("SESSION_SERVICE_URI", "sqlite+wal:///./sessions.db")
+    if workers > 1 and session_uri.startswith(_PROCESS_LOCAL_SESSION_SCHEMES):
+        logger.error(f"会话服务 {session_uri} 不能在多个进程之间共享，请使用 sqlite+wal:// 或数据库会话库")
+        return 1
+
+    pool = WorkerPool(args.app, workers, graceful_timeout_s=args.graceful_timeout,
+                      request_timeout_s=float(get_env("SERVE_REQUEST_TIMEOUT_S", 600)), log_level=args.log_level)
+    config = uvicorn.Config(
+        pool.asgi_app(), host=args.host, port=args.port, lifespan="on", log_level=args.log_level,
+        timeout_graceful_shutdown=int(args.graceful_timeout), timeout_keep_alive=30,
+    )
+    uvicorn.Server(config).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
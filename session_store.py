@@ -0,0 +1,522 @@
+"""
+面向高并发的 SQLite 会话库。
+
+ADK 默认的 `SqliteSessionService` 每次读写都新建一个连接，使用回滚日志模式，
+每追加一个事件就单独提交一次；并发会话多时写锁竞争严重。会话库也会无限增长，
+因为每个事件都保存了完整的上传文件字节和冗长的 ReAct 记录。
+
+`TunedSqliteSessionService` 在保持表结构不变（与默认服务的数据库互相兼容）的前提下：
+- 使用 WAL 日志模式和 `synchronous=NORMAL`，读写互不阻塞。
+- 复用一个有上限的连接池，而不是每次操作都重新连接。
+- 合并事件写入（group commit）：并发到达的 `append_event` 由一个写入协程
+  在同一个事务中批量写入、只提交一次；每个事件使用独立的 SAVEPOINT，单个事件失败不影响同批的其他事件。
+- 多个进程共用一个会话库时（`serve.py`），写事务（包括压缩任务的每一批）先获取数据库旁的文件锁再开始：SQLite 的忙等待按退避间隔轮询，
+  并发写入的进程可能连续数秒拿不到写锁，而文件锁释放时等待者会被立即唤醒。
+- 为 ADK 的查询补充索引（按会话读取事件、按应用列出会话、按时间清理事件）。
+- 后台压缩任务：把超过 `SESSION_STRIP_FILES_AFTER_S` 的事件中的文件字节替换为简短说明，
+  并删除超过保留期 `SESSION_EVENT_RETENTION_S` 的事件（每个会话始终保留最近
+  `SESSION_KEEP_RECENT_EVENTS` 个事件），随后回收空闲页并截断 WAL 文件。
+
+使用方式：把会话库 URI 的协议写成 `sqlite+wal`，例如 `sqlite+wal:///./sessions.db`。
+"""
+
+import asyncio
+import json
+import re
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Optional
+
+import aiosqlite
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有文件锁，只依赖 SQLite 自身的忙等待
+    fcntl = None
+from google.adk.cli.service_registry import get_service_registry
+from google.adk.errors._stale_session_error import StaleSessionError
+from google.adk.errors.session_not_found_error import SessionNotFoundError
+from google.adk.events.event import Event
+from google.adk.sessions import _session_util
+from google.adk.sessions.session import Session
+from google.adk.sessions.sqlite_session_service import CREATE_SCHEMA_SQL, PRAGMA_FOREIGN_KEYS, SqliteSessionService
+
+from app_config import get_env
+from logger_config import logger
+
+SESSION_STORE_SCHEME = "sqlite+wal"
+
+_CONNECTION_PRAGMAS = (
+    PRAGMA_FOREIGN_KEYS,
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+)
+
+INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_events_session_time ON events (app_name, user_id, session_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_events_time ON events (timestamp);
+CREATE INDEX IF NOT EXISTS idx_sessions_app_update ON sessions (app_name, update_time);
+"""
+
+# 压缩任务每个事务处理的行数，避免长时间占用写锁
+_COMPACTION_CHUNK = 200
+
+# 事件中指向上传文件存储的引用，格式与 tools/artifact_store.py 一致
+_ARTIFACT_REF_RE = re.compile(r"cas://sha256/([0-9a-f]{64})")
+
+# 按时间清理事件时，先在写锁之外逐个会话找出可删除的行（走 idx_events_session_time），
+# 再在写锁内按 rowid 分批删除，避免每一批都对整张表做窗口排序
+_PRUNE_SESSIONS_SQL = "SELECT DISTINCT app_name, user_id, session_id FROM events WHERE timestamp < ?"
+_KEPT_BOUNDARY_SQL = """
+SELECT timestamp FROM events WHERE app_name=? AND user_id=? AND session_id=?
+ORDER BY timestamp DESC LIMIT 1 OFFSET ?
+"""
+_PRUNE_CANDIDATES_SQL = """
+SELECT rowid FROM events WHERE app_name=? AND user_id=? AND session_id=? AND timestamp < ?
+"""
+
+
+class _ConnectionPool:
+    """有上限的 aiosqlite 连接池，绑定在一个事件循环上。"""
+
+    def __init__(self, open_connection, size: int):
+        self._open_connection = open_connection
+        self._size = size
+        self._created = 0
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._connections: list[aiosqlite.Connection] = []
+
+    async def acquire(self) -> aiosqlite.Connection:
+        if self._idle.empty() and self._created < self._size:
+            self._created += 1
+            try:
+                connection = await self._open_connection()
+            except BaseException:
+                self._created -= 1
+                raise
+            self._connections.append(connection)
+            return connection
+        return await self._idle.get()
+
+    def release(self, connection: aiosqlite.Connection) -> None:
+        self._idle.put_nowait(connection)
+
+    async def close(self) -> None:
+        for connection in self._connections:
+            await connection.close()
+        self._connections.clear()
+
+
+def _strip_inline_data(event_data: str) -> str:
+    """把事件 JSON 中的 inline_data 替换为一段说明文字。"""
+    event = json.loads(event_data)
+    for part in (event.get("content") or {}).get("parts") or []:
+        blob = part.get("inline_data")
+        if not blob:
+            continue
+        name = blob.get("display_name") or "uploaded_file"
+        mime_type = blob.get("mime_type") or "未知类型"
+        size_kb = len(blob.get("data") or "") * 3 // 4 // 1024
+        part.pop("inline_data")
+        part["text"] = f"[文件内容已从会话历史中移除] '{name}' ({mime_type}, 约 {size_kb} KB)"
+    return json.dumps(event, ensure_ascii=False)
+
+
+class TunedSqliteSessionService(SqliteSessionService):
+    """
+    使用 WAL、连接池和合并提交的 SQLite 会话服务。
+
+    Args:
+        db_path: 数据库文件路径。
+        pool_size: 每个事件循环的最大连接数。
+        max_batch: 一次事务最多合并的事件数。
+        busy_timeout_ms: 等待其他连接释放写锁的时间。
+    """
+
+    def __init__(self, db_path: str, pool_size: int = 16, max_batch: int = 64, busy_timeout_ms: int = 5000):
+        super().__init__(db_path)
+        self.pool_size = pool_size
+        self.max_batch = max_batch
+        self.busy_timeout_ms = busy_timeout_ms
+        self._pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _ConnectionPool]" = weakref.WeakKeyDictionary()
+        self._write_queues: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Queue]" = weakref.WeakKeyDictionary()
+        self._writers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Task]" = weakref.WeakKeyDictionary()
+        self._schema_lock: Optional[asyncio.Lock] = None
+        self._write_lock_file = None
+        # 同一进程内的写入者共用一个文件锁句柄，flock 无法区分它们，需要先在进程内排队
+        self._local_write_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = weakref.WeakKeyDictionary()
+        self._counters = {"appended": 0, "batches": 0, "compactions": 0, "stripped_events": 0, "pruned_events": 0}
+
+    @classmethod
+    def from_uri(cls, uri: str) -> "TunedSqliteSessionService":
+        """由 `sqlite+wal:///path/to.db` 形式的 URI 创建；路径规则与 ADK 的 `sqlite://` 相同。"""
+        db_path = uri.split("://", 1)[1]
+        if db_path.startswith("/"):
+            db_path = db_path[1:]
+        return cls(
+            db_path,
+            pool_size=int(get_env("SESSION_DB_POOL_SIZE", 16)),
+            max_batch=int(get_env("SESSION_DB_MAX_BATCH", 64)),
+            busy_timeout_ms=int(get_env("SESSION_DB_BUSY_TIMEOUT_MS", 5000)),
+        )
+
+    # --- 连接管理 ---
+    async def _open_connection(self) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(self._db_connect_path, uri=self._db_connect_uri)
+        db.row_factory = aiosqlite.Row
+        await db.execute(f"PRAGMA busy_timeout = {self.busy_timeout_ms}")
+        for pragma in _CONNECTION_PRAGMAS:
+            await db.execute(pragma)
+        if not self._schema_ready:
+            if self._schema_lock is None:
+                self._schema_lock = asyncio.Lock()
+            async with self._schema_lock:
+                if not self._schema_ready:
+                    # auto_vacuum 只对新建的空数据库生效，已有数据库保持原样
+                    await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                    await db.execute("PRAGMA journal_mode = WAL")
+                    await db.executescript(CREATE_SCHEMA_SQL + INDEX_SQL)
+                    self._schema_ready = True
+        return db
+
+    def _pool(self) -> _ConnectionPool:
+        loop = asyncio.get_running_loop()
+        pool = self._pools.get(loop)
+        if pool is None:
+            pool = _ConnectionPool(self._open_connection, self.pool_size)
+            self._pools[loop] = pool
+        return pool
+
+    @asynccontextmanager
+    async def _get_db_connection(self) -> AsyncIterator[aiosqlite.Connection]:
+        pool = self._pool()
+        db = await pool.acquire()
+        try:
+            yield db
+        except BaseException:
+            # 不把未结束的事务带回连接池
+            if db.in_transaction:
+                await db.rollback()
+            raise
+        finally:
+            pool.release(db)
+
+    async def close(self) -> None:
+        """停止写入协程并关闭当前事件循环的连接池。"""
+        loop = asyncio.get_running_loop()
+        writer = self._writers.pop(loop, None)
+        if writer is not None:
+            writer.cancel()
+        pool = self._pools.pop(loop, None)
+        if pool is not None:
+            await pool.close()
+        if self._write_lock_file is not None:
+            self._write_lock_file.close()
+            self._write_lock_file = None
+        self._local_write_locks.pop(loop, None)
+
+    # --- 合并写入 ---
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if event.partial:
+            return event
+
+        self._apply_temp_state(session, event)
+        event = self._trim_temp_delta_state(event)
+
+        loop = asyncio.get_running_loop()
+        queue = self._write_queues.get(loop)
+        if queue is None:
+            queue = asyncio.Queue()
+            self._write_queues[loop] = queue
+        writer = self._writers.get(loop)
+        if writer is None or writer.done():
+            self._writers[loop] = loop.create_task(self._write_loop(queue))
+
+        future = loop.create_future()
+        queue.put_nowait((session, event, future))
+        await future
+
+        session.last_update_time = event.timestamp
+        return self._commit_event_to_session(session, event)
+
+    async def _write_loop(self, queue: asyncio.Queue) -> None:
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                outcomes = await self._write_batch(batch)
+            except Exception as e:
+                logger.error(f"会话事件批量写入失败 ({len(batch)} 个事件): {e}")
+                outcomes = [e] * len(batch)
+            for (_, _, future), outcome in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if outcome is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(outcome)
+
+    @asynccontextmanager
+    async def _process_write_lock(self) -> AsyncIterator[None]:
+        """在多个进程之间排队获取写锁；内存数据库或不支持文件锁的平台上不做任何事。"""
+        if fcntl is None or self._db_path == ":memory:" or self._db_path.startswith("file:"):
+            yield
+            return
+        loop = asyncio.get_running_loop()
+        local_lock = self._local_write_locks.get(loop)
+        if local_lock is None:
+            local_lock = self._local_write_locks[loop] = asyncio.Lock()
+        async with local_lock:
+            if self._write_lock_file is None:
+                self._write_lock_file = open(self._db_path + ".write-lock", "a")
+            await asyncio.to_thread(fcntl.flock, self._write_lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._write_lock_file, fcntl.LOCK_UN)
+
+    async def _write_batch(self, batch: list) -> list[Optional[Exception]]:
+        outcomes: list[Optional[Exception]] = []
+        async with self._process_write_lock(), self._get_db_connection() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            for index, (session, event, _) in enumerate(batch):
+                savepoint = f"event_{index}"
+                await db.execute(f"SAVEPOINT {savepoint}")
+                try:
+                    await self._write_event(db, session, event)
+                    await db.execute(f"RELEASE {savepoint}")
+                    outcomes.append(None)
+                except Exception as e:
+                    await db.execute(f"ROLLBACK TO {savepoint}")
+                    await db.execute(f"RELEASE {savepoint}")
+                    outcomes.append(e)
+            await db.commit()
+        self._counters["batches"] += 1
+        self._counters["appended"] += outcomes.count(None)
+        return outcomes
+
+    async def _write_event(self, db: aiosqlite.Connection, session: Session, event: Event) -> None:
+        """与 `SqliteSessionService.append_event` 的数据库部分一致，但不单独提交。"""
+        event_timestamp = event.timestamp
+        async with db.execute(
+            "SELECT update_time FROM sessions WHERE app_name=? AND user_id=? AND id=?",
+            (session.app_name, session.user_id, session.id),
+        ) as cursor:
+            row = await cursor.fetchone()
+            if row is None:
+                raise SessionNotFoundError(f"Session {session.id} not found.")
+            if row["update_time"] > session.last_update_time:
+                raise StaleSessionError(
+                    "The last_update_time provided in the session object is"
+                    " earlier than the update_time in storage."
+                    " Please check if it is a stale session."
+                )
+
+        has_session_state_delta = False
+        if event.actions.state_delta:
+            state_deltas = _session_util.extract_json_safe_state_delta(event.actions.state_delta)
+            if state_deltas["app"]:
+                await self._upsert_app_state(db, session.app_name, state_deltas["app"], event_timestamp)
+            if state_deltas["user"]:
+                await self._upsert_user_state(
+                    db, session.app_name, session.user_id, state_deltas["user"], event_timestamp
+                )
+            if state_deltas["session"]:
+                await self._update_session_state_in_db(
+                    db, session.app_name, session.user_id, session.id, state_deltas["session"], event_timestamp
+                )
+                has_session_state_delta = True
+
+        await db.execute(
+            "INSERT INTO events (id, app_name, user_id, session_id, invocation_id, timestamp, event_data)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                event.id,
+                session.app_name,
+                session.user_id,
+                session.id,
+                event.invocation_id,
+                event.timestamp,
+                event.model_dump_json(exclude_none=True),
+            ),
+        )
+        if not has_session_state_delta:
+            await db.execute(
+                "UPDATE sessions SET update_time=? WHERE app_name=? AND user_id=? AND id=?",
+                (event_timestamp, session.app_name, session.user_id, session.id),
+            )
+
+    # --- 压缩 ---
+    async def compact(
+        self,
+        strip_files_after_s: float,
+        retention_s: float,
+        keep_recent_events: int,
+    ) -> dict:
+        """
+        压缩会话库，分小批次提交，不会长时间阻塞正常写入。
+
+        Args:
+            strip_files_after_s: 早于该时长的事件中的文件字节会被替换为说明文字。
+            retention_s: 早于该时长的事件会被删除。
+            keep_recent_events: 无论多旧，每个会话都保留最近的这么多个事件。
+
+        Returns:
+            本次移除文件字节的事件数和删除的事件数。
+        """
+        now = time.time()
+        stripped = pruned = 0
+        async with self._get_db_connection() as db:
+            last_rowid = 0
+            while True:
+                rows = await db.execute_fetchall(
+                    "SELECT rowid, event_data FROM events WHERE rowid > ? AND timestamp < ?"
+                    " AND event_data LIKE '%\"inline_data\"%' ORDER BY rowid LIMIT ?",
+                    (last_rowid, now - strip_files_after_s, _COMPACTION_CHUNK),
+                )
+                if not rows:
+                    break
+                last_rowid = rows[-1]["rowid"]
+                updates = [(_strip_inline_data(row["event_data"]), row["rowid"]) for row in rows]
+                # 与追加事件使用同一个跨进程写锁，每批单独获取，不长时间阻塞正常写入
+                async with self._process_write_lock():
+                    await db.execute("BEGIN IMMEDIATE")
+                    await db.executemany("UPDATE events SET event_data=? WHERE rowid=?", updates)
+                    await db.commit()
+                stripped += len(rows)
+                await asyncio.sleep(0)
+
+            cutoff = now - retention_s
+            candidates: list[int] = []
+            for app_name, user_id, session_id in await db.execute_fetchall(_PRUNE_SESSIONS_SQL, (cutoff,)):
+                before = cutoff
+                if keep_recent_events > 0:
+                    # 每个会话最近的 keep_recent_events 个事件中最旧的那个；事件更少的会话不清理
+                    boundary = await db.execute_fetchall(
+                        _KEPT_BOUNDARY_SQL, (app_name, user_id, session_id, keep_recent_events - 1)
+                    )
+                    if not boundary:
+                        continue
+                    before = min(cutoff, boundary[0]["timestamp"])
+                rows = await db.execute_fetchall(_PRUNE_CANDIDATES_SQL, (app_name, user_id, session_id, before))
+                candidates.extend(row["rowid"] for row in rows)
+            for start in range(0, len(candidates), _COMPACTION_CHUNK):
+                chunk = candidates[start:start + _COMPACTION_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                async with self._process_write_lock():
+                    await db.execute("BEGIN IMMEDIATE")
+                    # timestamp 条件防止删除在此期间复用了 rowid 的新事件
+                    cursor = await db.execute(
+                        f"DELETE FROM events WHERE rowid IN ({placeholders}) AND timestamp < ?", (*chunk, cutoff)
+                    )
+                    deleted = cursor.rowcount
+                    await cursor.close()
+                    await db.commit()
+                pruned += max(deleted, 0)
+                await asyncio.sleep(0)
+
+            if stripped or pruned:
+                # 这两个 PRAGMA 会返回结果行，需要读完，否则语句一直处于活动状态
+                async with self._process_write_lock():
+                    await db.execute_fetchall("PRAGMA incremental_vacuum")
+                    await db.execute_fetchall("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        self._counters["compactions"] += 1
+        self._counters["stripped_events"] += stripped
+        self._counters["pruned_events"] += pruned
+        if stripped or pruned:
+            logger.info(f"会话库压缩完成: 移除 {stripped} 个事件中的文件字节，删除 {pruned} 个过期事件")
+        return {"stripped_events": stripped, "pruned_events": pruned}
+
+    async def referenced_artifacts(self) -> set[str]:
+        """会话库中仍保留的事件所引用的上传文件摘要，供上传文件存储的清理任务跳过。"""
+        digests: set[str] = set()
+        async with self._get_db_connection() as db:
+            last_rowid = 0
+            while True:
+                rows = await db.execute_fetchall(
+                    "SELECT rowid, event_data FROM events WHERE rowid > ?"
+                    " AND event_data LIKE '%cas://sha256/%' ORDER BY rowid LIMIT ?",
+                    (last_rowid, _COMPACTION_CHUNK),
+                )
+                if not rows:
+                    break
+                last_rowid = rows[-1]["rowid"]
+                for row in rows:
+                    digests.update(_ARTIFACT_REF_RE.findall(row["event_data"]))
+                await asyncio.sleep(0)
+        return digests
+
+    def stats(self) -> dict:
+        return dict(self._counters)
+
+
+# 由服务注册表创建的实例，供后台压缩任务和 /metrics 使用
+_services: "weakref.WeakSet[TunedSqliteSessionService]" = weakref.WeakSet()
+
+
+def _tuned_session_factory(uri: str, **kwargs: Any) -> TunedSqliteSessionService:
+    service = TunedSqliteSessionService.from_uri(uri)
+    _services.add(service)
+    return service
+
+
+def register_session_store() -> None:
+    """在 ADK 的服务注册表中注册 `sqlite+wal://` 协议。"""
+    get_service_registry().register_session_service(SESSION_STORE_SCHEME, _tuned_session_factory)
+
+
+def session_store_stats() -> dict:
+    totals: dict[str, int] = {}
+    for service in list(_services):
+        for key, value in service.stats().items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+async def referenced_artifacts() -> Optional[set[str]]:
+    """所有 `sqlite+wal` 会话库中被引用的上传文件摘要；没有使用该会话库时返回 None（无法判断）。"""
+    services = list(_services)
+    if not services:
+        return None
+    digests: set[str] = set()
+    for service in services:
+        digests |= await service.referenced_artifacts()
+    return digests
+
+
+async def _compaction_loop(interval_s: float) -> None:
+    strip_files_after_s = float(get_env("SESSION_STRIP_FILES_AFTER_S", 3600))
+    retention_s = float(get_env("SESSION_EVENT_RETENTION_S", 30 * 24 * 3600))
+    keep_recent_events = int(get_env("SESSION_KEEP_RECENT_EVENTS", 200))
+    while True:
+        await asyncio.sleep(interval_s)
+        for service in list(_services):
+            try:
+                await service.compact(strip_files_after_s, retention_s, keep_recent_events)
+            except Exception as e:
+                logger.error(f"会话库压缩失败: {e}")
+
+
+def start_background_compaction() -> Optional[asyncio.Task]:
+    """启动后台压缩任务；`SESSION_COMPACTION_INTERVAL_S` 为 0 或没有使用 `sqlite+wal` 会话库时不启动。"""
+    interval_s = float(get_env("SESSION_COMPACTION_INTERVAL_S", 600))
+    if interval_s <= 0 or not _services:
+        return None
+    return asyncio.get_running_loop().create_task(_compaction_loop(interval_s))
+
+
+async def warm_up_session_stores() -> None:
+    """为当前事件循环打开一个连接，完成建表和 WAL 设置，使首个请求不承担这部分开销。"""
+    for service in list(_services):
+        async with service._get_db_connection():
+            pass
+
+
+async def close_session_stores() -> None:
+    for service in list(_services):
+        await service.close()
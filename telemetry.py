@@ -0,0 +1,440 @@
+"""
+请求级别的性能埋点：每个阶段的耗时直方图、token 计数，以及可选的本地 trace 导出。
+
+覆盖的阶段 (phase):
+- `agent`: 每个代理（包括子代理转交后）从开始到结束的耗时。
+- `model`: 每次模型调用的耗时及输入 / 输出 token 数。
+- `model_tier`: 模型路由（`multimodal_agent/model_router.py`）每次调用的档位（fast / pro / fallback）、耗时和 token 数。
+- `tool`: 每次工具调用（包括 MCP 工具和 `transfer_to_agent`）的耗时。
+- `extraction`: `read_files_as_text_callback` 的每次文件解析，按文件类型和大小分档。
+- `session_store`: 会话库的每次读写（创建 / 读取会话、追加事件等），在会话服务外包一层计时。
+
+指标通过 `render_prometheus()` 以 Prometheus 文本格式输出（`main.py` 挂载在 `/metrics`）。
+设置 `TRACE_EXPORT_PATH` 后，每个 span 会以 JSONL 形式追加到该文件，并带上会话 ID 和调用 ID。
+会话 ID 和调用 ID 只出现在 trace 中，不作为指标标签，避免指标基数无限增长。
+"""
+
+import json
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Optional
+
+from google.adk.sessions.base_session_service import BaseSessionService
+
+from app_config import get_env
+from logger_config import logger
+
+METRIC_PREFIX = "cheminsight"
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# 文件大小分档（字节），用于 extraction 阶段的标签
+_SIZE_CLASSES = ((100 * 1024, "lt_100kb"), (1024 * 1024, "lt_1mb"), (10 * 1024 * 1024, "lt_10mb"))
+
+# 超过该数量的未结束 span 时，清理存活过久的条目（例如工具异常后没有收到结束回调）
+_MAX_OPEN_SPANS = 4096
+_STALE_SPAN_S = 3600.0
+
+
+def size_class(num_bytes: int) -> str:
+    for limit, label in _SIZE_CLASSES:
+        if num_bytes < limit:
+            return label
+    return "ge_10mb"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """按标签分组的单调递增计数器。"""
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """按标签分组的累积直方图，桶边界固定。"""
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...], buckets: tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # 每组标签: [各桶计数..., +Inf 计数], 总和
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.setdefault(label_values, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    labels = _format_labels(self.labels, label_values, f'le="{bound:g}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                cumulative += counts[-1]
+                labels = _format_labels(self.labels, label_values, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                plain = _format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{plain} {total[0]:.6f}")
+                lines.append(f"{self.name}_count{plain} {cumulative}")
+        return lines
+
+
+class TraceExporter:
+    """把 span 以 JSONL 追加写入本地文件。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def export(self, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class Telemetry:
+    """
+    埋点注册表以及接入 ADK 代理的回调。
+
+    回调的挂载方式与 `tool_result_cache` 相同：
+    - `before_agent_callback` / `after_agent_callback`
+    - `before_model_callback`（排在文件读取和上下文折叠回调之后，只统计真正的模型耗时）
+    - `after_model_callback` / `on_model_error_callback`
+    - `before_tool_callback`（排在结果缓存之前，缓存命中同样会被计时）
+    - `after_tool_callback` / `on_tool_error_callback`
+
+    Args:
+        trace_path: trace 导出文件路径；为空时不导出。
+    """
+
+    def __init__(self, trace_path: Optional[str] = None):
+        self.phase_duration = Histogram(
+            f"{METRIC_PREFIX}_phase_duration_seconds",
+            "Duration of each request phase.",
+            ("phase", "name"),
+            DURATION_BUCKETS,
+        )
+        self.extraction_duration = Histogram(
+            f"{METRIC_PREFIX}_extraction_duration_seconds",
+            "Duration of document extraction by file kind and size class.",
+            ("kind", "size_class"),
+            DURATION_BUCKETS,
+        )
+        self.model_tokens = Counter(
+            f"{METRIC_PREFIX}_model_tokens_total",
+            "Model tokens by agent and direction.",
+            ("agent", "direction"),
+        )
+        self.tier_tokens = Counter(
+            f"{METRIC_PREFIX}_model_tier_tokens_total",
+            "Model tokens by routing tier and direction.",
+            ("tier", "direction"),
+        )
+        self.budget_triggers = Counter(
+            f"{METRIC_PREFIX}_budget_triggers_total",
+            "Step / tool-call / deadline budgets exhausted, by agent.",
+            ("agent", "budget"),
+        )
+        self.errors = Counter(
+            f"{METRIC_PREFIX}_phase_errors_total",
+            "Failed phases.",
+            ("phase", "name"),
+        )
+        self._stats_sources: dict[str, Callable[[], dict]] = {}
+        self._open_spans: dict[tuple, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+        self.exporter = TraceExporter(trace_path) if trace_path else None
+
+    @classmethod
+    def from_env(cls) -> "Telemetry":
+        return cls(trace_path=get_env("TRACE_EXPORT_PATH") or None)
+
+    # --- 通用 API ---
+    def record(
+        self,
+        phase: str,
+        name: str,
+        duration_s: float,
+        session_id: Optional[str] = None,
+        invocation_id: Optional[str] = None,
+        error: Optional[BaseException] = None,
+        started_at: Optional[float] = None,
+        **attrs: Any,
+    ) -> None:
+        """记录一个已结束的 span。"""
+        self.phase_duration.observe(duration_s, phase, name)
+        if error is not None:
+            self.errors.inc(phase, name)
+        if self.exporter is None:
+            return
+        try:
+            self.exporter.export({
+                "ts": started_at if started_at is not None else time.time() - duration_s,
+                "phase": phase,
+                "name": name,
+                "duration_ms": round(duration_s * 1000, 3),
+                "session_id": session_id,
+                "invocation_id": invocation_id,
+                "error": repr(error) if error is not None else None,
+                "attrs": attrs,
+            })
+        except Exception as e:
+            logger.warning(f"trace 导出失败: {e}")
+
+    def record_extraction(self, kind: str, num_bytes: int, duration_s: float,
+                          session_id: Optional[str] = None, invocation_id: Optional[str] = None,
+                          error: Optional[BaseException] = None) -> None:
+        size = size_class(num_bytes)
+        self.extraction_duration.observe(duration_s, kind, size)
+        self.record("extraction", kind, duration_s, session_id, invocation_id,
+                    error=error, size_class=size, bytes=num_bytes)
+
+    def record_model_tier(self, tier: str, role: str, phase: str, model: str, duration_s: float,
+                          started_at: Optional[float] = None, error: Optional[BaseException] = None,
+                          input_tokens: int = 0, output_tokens: int = 0) -> None:
+        self.tier_tokens.inc(tier, "input", amount=input_tokens)
+        self.tier_tokens.inc(tier, "output", amount=output_tokens)
+        self.record("model_tier", tier, duration_s, error=error, started_at=started_at, role=role,
+                    step=phase, model=model, input_tokens=input_tokens, output_tokens=output_tokens)
+
+    def record_budget_trigger(self, agent_name: str, budget: str) -> None:
+        self.budget_triggers.inc(agent_name, budget)
+
+    def register_stats(self, name: str, source: Callable[[], dict]) -> None:
+        """把一个返回数值字典的 `stats()` 函数以 gauge 的形式暴露在 /metrics 中。"""
+        self._stats_sources[name] = source
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in (self.phase_duration, self.extraction_duration, self.model_tokens, self.tier_tokens,
+                       self.budget_triggers, self.errors):
+            lines.extend(metric.render())
+        for source_name, source in self._stats_sources.items():
+            try:
+                stats = source()
+            except Exception as e:
+                logger.warning(f"读取 {source_name} 统计失败: {e}")
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                metric_name = f"{METRIC_PREFIX}_{source_name}_{key}"
+                lines.append(f"# TYPE {metric_name} gauge")
+                lines.append(f"{metric_name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    # --- 未结束 span 的登记 ---
+    def _start(self, key: tuple) -> None:
+        with self._lock:
+            if len(self._open_spans) >= _MAX_OPEN_SPANS:
+                cutoff = time.perf_counter() - _STALE_SPAN_S
+                for stale in [k for k, (start, _) in self._open_spans.items() if start < cutoff]:
+                    del self._open_spans[stale]
+            self._open_spans[key] = (time.perf_counter(), time.time())
+
+    def _finish(self, key: tuple) -> Optional[tuple[float, float]]:
+        with self._lock:
+            entry = self._open_spans.pop(key, None)
+        if entry is None:
+            return None
+        start, started_at = entry
+        return time.perf_counter() - start, started_at
+
+    @staticmethod
+    def _ids(context) -> tuple[Optional[str], Optional[str]]:
+        try:
+            return context.session.id, context.invocation_id
+        except Exception:
+            return None, None
+
+    # --- ADK 回调 ---
+    def before_agent_callback(self, callback_context):
+        _, invocation_id = self._ids(callback_context)
+        self._start(("agent", invocation_id, callback_context.agent_name))
+        return None
+
+    def after_agent_callback(self, callback_context):
+        session_id, invocation_id = self._ids(callback_context)
+        finished = self._finish(("agent", invocation_id, callback_context.agent_name))
+        if finished:
+            duration_s, started_at = finished
+            self.record("agent", callback_context.agent_name, duration_s, session_id, invocation_id,
+                        started_at=started_at)
+        return None
+
+    def before_model_callback(self, callback_context, llm_request):
+        _, invocation_id = self._ids(callback_context)
+        self._start(("model", invocation_id, callback_context.agent_name))
+        return None
+
+    def after_model_callback(self, callback_context, llm_response):
+        # 流式输出时每个分片都会触发回调，只在完整响应上结束计时
+        if getattr(llm_response, "partial", False):
+            return None
+        session_id, invocation_id = self._ids(callback_context)
+        agent_name = callback_context.agent_name
+        finished = self._finish(("model", invocation_id, agent_name))
+        if finished is None:
+            return None
+        duration_s, started_at = finished
+        usage = llm_response.usage_metadata
+        input_tokens = (usage.prompt_token_count or 0) if usage else 0
+        output_tokens = (usage.candidates_token_count or 0) if usage else 0
+        self.model_tokens.inc(agent_name, "input", amount=input_tokens)
+        self.model_tokens.inc(agent_name, "output", amount=output_tokens)
+        self.record("model", agent_name, duration_s, session_id, invocation_id, started_at=started_at,
+                    model=llm_response.model_version, input_tokens=input_tokens, output_tokens=output_tokens)
+        return None
+
+    def on_model_error_callback(self, callback_context, llm_request, error):
+        session_id, invocation_id = self._ids(callback_context)
+        finished = self._finish(("model", invocation_id, callback_context.agent_name))
+        if finished:
+            duration_s, started_at = finished
+            self.record("model", callback_context.agent_name, duration_s, session_id, invocation_id,
+                        error=error, started_at=started_at)
+        return None
+
+    def before_tool_callback(self, tool, args, tool_context):
+        self._start(("tool", tool_context.function_call_id, tool.name))
+        return None
+
+    def after_tool_callback(self, tool, args, tool_context, tool_response):
+        session_id, invocation_id = self._ids(tool_context)
+        finished = self._finish(("tool", tool_context.function_call_id, tool.name))
+        if finished:
+            duration_s, started_at = finished
+            attrs = {"agent": tool_context.agent_name}
+            if tool.name == "transfer_to_agent":
+                attrs["target"] = (args or {}).get("agent_name")
+            self.record("tool", tool.name, duration_s, session_id, invocation_id, started_at=started_at, **attrs)
+        return None
+
+    def on_tool_error_callback(self, tool, args, tool_context, error):
+        session_id, invocation_id = self._ids(tool_context)
+        finished = self._finish(("tool", tool_context.function_call_id, tool.name))
+        if finished:
+            duration_s, started_at = finished
+            self.record("tool", tool.name, duration_s, session_id, invocation_id, error=error,
+                        started_at=started_at, agent=tool_context.agent_name)
+        return None
+
+    # --- 会话库 ---
+    def instrument_session_store(self, session_service_uri: str) -> None:
+        """
+        让 `get_fast_api_app` 按该 URI 创建的会话服务在每次读写时计时。
+
+        ADK 通过服务注册表按 URI 协议创建会话服务，这里把对应协议的工厂替换为带计时包装的版本。
+        """
+        from google.adk.cli.service_registry import get_service_registry
+
+        scheme = session_service_uri.split("://", 1)[0]
+        registry = get_service_registry()
+        factory = registry._session_factories.get(scheme)
+        if factory is None or getattr(factory, "_cheminsight_timed", False):
+            return
+
+        def timed_factory(uri: str, **kwargs):
+            return TimedSessionService(factory(uri, **kwargs), self)
+
+        timed_factory._cheminsight_timed = True
+        registry.register_session_service(scheme, timed_factory)
+
+
+class TimedSessionService(BaseSessionService):
+    """包装一个会话服务，把每次读写计入 session_store 阶段；其余属性透传给被包装的服务。"""
+
+    def __init__(self, inner: BaseSessionService, recorder: Telemetry):
+        self._inner = inner
+        self._recorder = recorder
+
+    def __getattr__(self, name: str):
+        return getattr(self._inner, name)
+
+    async def _timed(self, operation: str, session_id: Optional[str], invocation_id: Optional[str], call):
+        start = time.perf_counter()
+        try:
+            result = await call
+        except Exception as e:
+            self._recorder.record("session_store", operation, time.perf_counter() - start,
+                                  session_id, invocation_id, error=e)
+            raise
+        self._recorder.record("session_store", operation, time.perf_counter() - start, session_id, invocation_id)
+        return result
+
+    async def create_session(self, *, app_name, user_id, state=None, session_id=None):
+        return await self._timed("create_session", session_id, None, self._inner.create_session(
+            app_name=app_name, user_id=user_id, state=state, session_id=session_id))
+
+    async def get_session(self, *, app_name, user_id, session_id, config=None):
+        return await self._timed("get_session", session_id, None, self._inner.get_session(
+            app_name=app_name, user_id=user_id, session_id=session_id, config=config))
+
+    async def list_sessions(self, *, app_name, user_id=None):
+        return await self._timed("list_sessions", None, None, self._inner.list_sessions(
+            app_name=app_name, user_id=user_id))
+
+    async def delete_session(self, *, app_name, user_id, session_id):
+        return await self._timed("delete_session", session_id, None, self._inner.delete_session(
+            app_name=app_name, user_id=user_id, session_id=session_id))
+
+    async def get_user_state(self, *, app_name, user_id):
+        return await self._timed("get_user_state", None, None, self._inner.get_user_state(
+            app_name=app_name, user_id=user_id))
+
+    async def append_event(self, session, event):
+        # partial 事件不落库，不计时
+        if event.partial:
+            return await self._inner.append_event(session, event)
+        return await self._timed("append_event", session.id, event.invocation_id,
+                                 self._inner.append_event(session, event))
+
+    async def flush(self) -> None:
+        await self._inner.flush()
+
+
+telemetry = Telemetry.from_env()
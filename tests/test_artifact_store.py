@@ -0,0 +1,51 @@
+import asyncio
+import os
+import time
+
+from google.adk.events.event import Event
+from google.genai import types
+
+from session_store import TunedSqliteSessionService
+from tools.artifact_store import ArtifactStore, make_ref
+
+
+def _age(path: str, days: float) -> None:
+    old = time.time() - days * 24 * 3600
+    os.utime(path, (old, old))
+
+
+def test_sweep_keeps_referenced_files_and_their_index(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    kept, dropped = store.put(b"kept paper"), store.put(b"dropped paper")
+    index_dir = tmp_path / "index"
+    index_dir.mkdir()
+    index_file = index_dir / f"{kept}.c1200.v1.json"
+    index_file.write_text("{}", encoding="utf-8")
+    for path in (store.path(kept), store.path(dropped), str(index_file)):
+        _age(path, 60)
+
+    assert store.sweep(30 * 24 * 3600, referenced={kept}) == 1
+    assert store.exists(kept)
+    assert not store.exists(dropped)
+    assert index_file.exists()
+
+
+def test_session_store_lists_referenced_artifacts(tmp_path):
+    async def scenario():
+        service = TunedSqliteSessionService(str(tmp_path / "sessions.db"))
+        session = await service.create_session(app_name="app", user_id="u1")
+        digest = "ab" * 32
+        await service.append_event(session, Event(
+            author="user", invocation_id="inv",
+            content=types.Content(role="user", parts=[
+                types.Part(text="见附件"),
+                types.Part(file_data=types.FileData(file_uri=make_ref(digest), mime_type="application/pdf")),
+            ]),
+        ))
+        try:
+            return digest, await service.referenced_artifacts()
+        finally:
+            await service.close()
+
+    digest, referenced = asyncio.run(scenario())
+    assert referenced == {digest}
@@ -0,0 +1,92 @@
+import json
+import os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import batch_runner
+from batch_runner import ManifestError, resolve_under_root
+
+
+@pytest.fixture
+def batch_root(tmp_path, monkeypatch):
+    root = tmp_path / "batch"
+    root.mkdir()
+    (root / "a.md").write_text("# paper", encoding="utf-8")
+    (tmp_path / "secret.txt").write_text("secret", encoding="utf-8")
+    monkeypatch.setenv("BATCH_ROOT", str(root))
+    # 任务本身不需要运行，只检查提交时的校验
+    monkeypatch.setattr(batch_runner.BatchRunner, "run", lambda self, items: _noop())
+    return root
+
+
+async def _noop():
+    return {}
+
+
+def _client() -> TestClient:
+    app = FastAPI()
+    app.include_router(batch_runner.batch_router)
+    return TestClient(app)
+
+
+def _write_manifest(root, name, records):
+    (root / name).write_text("\n".join(json.dumps(r) for r in records), encoding="utf-8")
+
+
+@pytest.mark.parametrize("path", ["/etc/passwd", "../secret.txt", "sub/../../secret.txt", ""])
+def test_resolve_under_root_rejects_escapes(batch_root, path):
+    with pytest.raises(ManifestError):
+        resolve_under_root(path, str(batch_root))
+
+
+def test_resolve_under_root_rejects_symlink_escape(batch_root):
+    os.symlink(batch_root.parent / "secret.txt", batch_root / "link.txt")
+    with pytest.raises(ManifestError):
+        resolve_under_root("link.txt", str(batch_root))
+
+
+def test_submit_accepts_paths_under_root(batch_root):
+    _write_manifest(batch_root, "m.jsonl", [{"id": "1", "query": "q", "files": ["a.md"]}])
+    response = _client().post("/batch/jobs", json={"manifest_path": "m.jsonl"})
+    assert response.status_code == 200
+    assert response.json()["output_path"] == "m.results.jsonl"
+
+
+@pytest.mark.parametrize("body", [
+    {"manifest_path": "/etc/passwd"},
+    {"manifest_path": "missing.jsonl"},
+    {"manifest_path": "m.jsonl", "output_path": "../out.jsonl"},
+])
+def test_submit_rejects_bad_paths(batch_root, body):
+    _write_manifest(batch_root, "m.jsonl", [{"query": "q", "files": ["a.md"]}])
+    assert _client().post("/batch/jobs", json=body).status_code == 400
+
+
+@pytest.mark.parametrize("records", [
+    [{"query": "q", "files": ["../secret.txt"]}],
+    [{"query": "q", "files": ["/etc/passwd"]}],
+    [{"query": "q", "files": ["nope.md"]}],
+    [{"files": ["a.md"]}],
+])
+def test_submit_rejects_bad_manifest(batch_root, records):
+    _write_manifest(batch_root, "m.jsonl", records)
+    assert _client().post("/batch/jobs", json={"manifest_path": "m.jsonl"}).status_code == 400
+
+
+def test_submit_rejects_malformed_json(batch_root):
+    (batch_root / "m.jsonl").write_text("{not json", encoding="utf-8")
+    assert _client().post("/batch/jobs", json={"manifest_path": "m.jsonl"}).status_code == 400
+
+
+@pytest.mark.parametrize("limits", [
+    {"concurrency": 10000},
+    {"concurrency": 0},
+    {"max_retries": -1},
+    {"max_retries": 1000},
+])
+def test_submit_rejects_unbounded_limits(batch_root, limits):
+    _write_manifest(batch_root, "m.jsonl", [{"id": "1", "query": "q", "files": ["a.md"]}])
+    response = _client().post("/batch/jobs", json={"manifest_path": "m.jsonl", **limits})
+    assert response.status_code == 422
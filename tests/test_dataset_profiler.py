@@ -0,0 +1,34 @@
+from functools import partial
+
+from tools.dataset_profiler import open_table, profile_table
+
+# 第一块全是数字（np.loadtxt 解析），第二块含空值（退回 csv 模块）
+CSV = b"""level,signal
+1,10.0
+2,20.0
+1,11.0
+1,
+2,21.0
+1.0,12.0
+"""
+
+
+def _profile(data: bytes, **kwargs) -> dict:
+    return profile_table(partial(open_table, data, "csv", chunk_rows=3), **kwargs)
+
+
+def test_group_keys_do_not_depend_on_chunk_parser():
+    groups = _profile(CSV, group_by="level")["group_summary"]["groups"]
+    assert [(group["group"], group["rows"]) for group in groups] == [("1", 4), ("2", 2)]
+    assert groups[0]["stats"]["signal"]["count"] == 3
+
+
+def test_outlier_rows_are_data_row_numbers():
+    lines = ["x,y"] + [f"{i},{1.0 + (i % 3) * 0.01}" for i in range(1, 40)]
+    # 空行不计入行号
+    lines.insert(10, "")
+    lines.append("40,100.0")
+    result = _profile("\n".join(lines).encode())
+    y = next(column for column in result["columns"] if column["name"] == "y")
+    assert y["outliers"] == 1
+    assert y["outlier_rows"] == [40]
@@ -0,0 +1,21 @@
+from tools.document_extractors import ExtractionBudget, extract_text
+
+
+def _csv(rows: int) -> bytes:
+    lines = ["id,value"] + [f"{i},{i * 3}" for i in range(1, rows)]
+    return "\n".join(lines).encode("utf-8")
+
+
+def test_csv_at_row_limit_keeps_every_row_in_order():
+    budget = ExtractionBudget(max_table_rows=200)
+    text = extract_text(_csv(200), "csv", budget)
+    lines = text.splitlines()
+    assert "[截断说明]" not in text
+    assert lines == _csv(200).decode("utf-8").splitlines()
+
+
+def test_csv_over_row_limit_is_truncated_with_note():
+    budget = ExtractionBudget(max_table_rows=200)
+    text = extract_text(_csv(1000), "csv", budget)
+    assert text.startswith("[截断说明]")
+    assert "999,2997" in text
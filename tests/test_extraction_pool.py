@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+import pytest
+
+from tools.extraction_pool import ExtractionPool, ExtractionTimeout
+
+
+def _sleep(seconds: float) -> str:
+    time.sleep(seconds)
+    return "done"
+
+
+def test_timed_out_thread_task_counts_until_it_finishes():
+    async def scenario():
+        pool = ExtractionPool(process_workers=0, thread_workers=1, timeout_s=0.05)
+        with pytest.raises(ExtractionTimeout):
+            await pool.submit(10, "txt", _sleep, 0.3)
+        still_running = pool.pending
+        await asyncio.sleep(0.5)
+        pool.shutdown()
+        return still_running, pool.pending
+
+    assert asyncio.run(scenario()) == (1, 0)
+
+
+def test_process_pool_is_recycled_after_timeout():
+    async def scenario():
+        pool = ExtractionPool(process_workers=1, small_file_bytes=0, timeout_s=1.0)
+        # 第一次提交包含启动工作进程的时间
+        assert await pool.submit(10, "pdf", _sleep, 0) == "done"
+        stuck_pool = pool._process_pool
+        pool.timeout_s = 0.2
+        with pytest.raises(ExtractionTimeout):
+            await pool.submit(10, "pdf", _sleep, 30)
+        pool.timeout_s = 10
+        assert pool._process_pool is None
+        # 新任务交给新的进程池，而不是排在卡住的任务后面
+        result = await pool.submit(10, "pdf", _sleep, 0)
+        for _ in range(50):
+            if pool.pending == 0:
+                break
+            await asyncio.sleep(0.1)
+        recycled = pool._process_pool is not stuck_pool
+        pool.shutdown()
+        return result, recycled, pool.pending
+
+    assert asyncio.run(scenario()) == ("done", True, 0)
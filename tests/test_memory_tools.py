@@ -0,0 +1,232 @@
+import asyncio
+
+from google.adk.events.event import Event
+from google.adk.memory.base_memory_service import BaseMemoryService
+from google.adk.sessions.session import Session
+from google.genai import types
+
+from tools.memory_tools import DONE, ERROR, MemoryIngestQueue
+
+
+class FakeMemoryService(BaseMemoryService):
+    """记录每次增量写入的事件；可以让前几次写入失败或变慢。"""
+
+    def __init__(self, failures: int = 0, delay: float = 0.0):
+        self.failures = failures
+        self.delay = delay
+        self.calls = 0
+        self.written: list[str] = []
+
+    async def add_events_to_memory(self, *, app_name, user_id, events, session_id=None, custom_metadata=None):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("memory backend unavailable")
+        self.written.extend(event.content.parts[0].text for event in events)
+
+    async def add_session_to_memory(self, session):
+        raise AssertionError("增量写入可用时不应整体写入会话")
+
+    async def search_memory(self, *, app_name, user_id, query):
+        raise NotImplementedError
+
+
+class SessionOnlyMemoryService(BaseMemoryService):
+    """只支持整体写入会话的记忆服务。"""
+
+    def __init__(self):
+        self.sessions = 0
+
+    async def add_session_to_memory(self, session):
+        self.sessions += 1
+
+    async def search_memory(self, *, app_name, user_id, query):
+        raise NotImplementedError
+
+
+def _session(session_id: str = "s1") -> Session:
+    return Session(id=session_id, app_name="app", user_id="u1")
+
+
+def _say(session: Session, text: str, author: str = "user") -> None:
+    session.events.append(Event(
+        author=author, invocation_id="inv",
+        content=types.Content(role="user", parts=[types.Part(text=text)]),
+        timestamp=len(session.events) + 1.0,
+    ))
+
+
+def _queue() -> MemoryIngestQueue:
+    # 只在测试中显式 flush
+    return MemoryIngestQueue(batch_size=1000, flush_interval_s=60)
+
+
+def test_only_new_events_are_written():
+    async def scenario():
+        queue, service, session = _queue(), FakeMemoryService(), _session()
+        _say(session, "a")
+        _say(session, "b")
+        assert queue.enqueue(service, session)[1] == 2
+        await queue.flush()
+        _say(session, "c")
+        assert queue.enqueue(service, session)[1] == 1
+        await queue.flush()
+        assert queue.enqueue(service, session)[1] == 0
+        await queue.close()
+        return service, queue.stats()
+
+    service, stats = asyncio.run(scenario())
+    assert service.written == ["a", "b", "c"]
+    assert stats["written"] == 3
+    assert stats["pending"] == 0
+
+
+def test_in_flight_events_are_not_queued_twice():
+    async def scenario():
+        queue, service, session = _queue(), FakeMemoryService(), _session()
+        _say(session, "a")
+        queue.enqueue(service, session)
+        _say(session, "b")
+        queue.enqueue(service, session)
+        await queue.flush()
+        await queue.close()
+        return service
+
+    assert asyncio.run(scenario()).written == ["a", "b"]
+
+
+def test_same_content_is_written_once_per_user():
+    async def scenario():
+        queue, service = _queue(), FakeMemoryService()
+        first, second = _session("s1"), _session("s2")
+        _say(first, "配体是 PPh3")
+        _say(second, "配体是 PPh3")
+        _say(second, "产率 85%")
+        queue.enqueue(service, first)
+        ticket, count = queue.enqueue(service, second)
+        await queue.close()
+        return service, queue.stats(), count
+
+    service, stats, count = asyncio.run(scenario())
+    assert count == 1
+    assert service.written == ["配体是 PPh3", "产率 85%"]
+    assert stats["duplicates"] == 1
+
+
+def test_retries_then_succeeds():
+    async def scenario():
+        queue, service, session = _queue(), FakeMemoryService(failures=2), _session()
+        _say(session, "a")
+        ticket, _ = queue.enqueue(service, session)
+        for _ in range(3):
+            await queue.flush()
+        return service, queue, ticket
+
+    service, queue, ticket = asyncio.run(scenario())
+    assert service.written == ["a"]
+    assert queue.ticket_status(ticket) == DONE
+    assert queue.stats()["errors"] == 2
+
+
+def test_events_are_resubmitted_after_giving_up():
+    async def scenario():
+        queue, service, session = _queue(), FakeMemoryService(failures=3), _session()
+        _say(session, "a")
+        _say(session, "b")
+        ticket, _ = queue.enqueue(service, session)
+        for _ in range(3):
+            await queue.flush()
+        status = queue.ticket_status(ticket)
+        # 服务恢复后再次保存同一会话，之前放弃的事件重新提交
+        _, count = queue.enqueue(service, session)
+        await queue.flush()
+        return service, status, count
+
+    service, status, count = asyncio.run(scenario())
+    assert status == ERROR
+    assert count == 2
+    assert service.written == ["a", "b"]
+
+
+def test_events_queued_during_failed_write_keep_earlier_events_retryable():
+    async def scenario():
+        queue, service, session = _queue(), FakeMemoryService(failures=3, delay=0.01), _session()
+        _say(session, "a")
+        queue.enqueue(service, session)
+        for _ in range(2):
+            await queue.flush()
+        flushing = asyncio.create_task(queue.flush())
+        await asyncio.sleep(0)
+        # 第三次写入进行中时追加新事件，随后 "a" 被放弃
+        _say(session, "b")
+        queue.enqueue(service, session)
+        await flushing
+        await queue.flush()
+        _, count = queue.enqueue(service, session)
+        await queue.flush()
+        return service, count
+
+    service, count = asyncio.run(scenario())
+    assert count == 1
+    assert sorted(service.written) == ["a", "b"]
+
+
+def test_close_waits_for_in_flight_flush():
+    async def scenario():
+        queue, service, session = MemoryIngestQueue(batch_size=1, flush_interval_s=60), \
+            FakeMemoryService(delay=0.05), _session()
+        _say(session, "a")
+        queue.enqueue(service, session)
+        # 让后台任务开始写入 "a"
+        await asyncio.sleep(0.01)
+        _say(session, "b")
+        queue.enqueue(service, session)
+        await queue.close()
+        return service, queue.stats()
+
+    service, stats = asyncio.run(scenario())
+    assert service.written == ["a", "b"]
+    assert stats["pending"] == 0
+
+
+def test_cancelled_flush_puts_events_back():
+    async def scenario():
+        queue, service, session = _queue(), FakeMemoryService(delay=0.05), _session()
+        _say(session, "a")
+        queue.enqueue(service, session)
+        flushing = asyncio.create_task(queue.flush())
+        await asyncio.sleep(0.01)
+        flushing.cancel()
+        try:
+            await flushing
+        except asyncio.CancelledError:
+            pass
+        pending = queue.stats()["pending"]
+        service.delay = 0
+        await queue.close()
+        return service, pending
+
+    service, pending = asyncio.run(scenario())
+    assert pending == 1
+    assert service.written == ["a"]
+
+
+def test_session_only_service_counts_full_sessions():
+    async def scenario():
+        queue, service, session = _queue(), SessionOnlyMemoryService(), _session()
+        _say(session, "a")
+        _say(session, "b")
+        queue.enqueue(service, session)
+        await queue.flush()
+        _say(session, "c")
+        queue.enqueue(service, session)
+        await queue.close()
+        return service, queue.stats()
+
+    service, stats = asyncio.run(scenario())
+    assert service.sessions == 2
+    assert stats["full_sessions"] == 2
+    assert stats["written"] == 0
+    assert stats["errors"] == 0
@@ -0,0 +1,77 @@
+import pytest
+from google.adk.models.llm_request import LlmRequest
+from google.adk.tools import FunctionTool
+from google.genai import types
+
+from multimodal_agent import model_router
+from multimodal_agent.model_router import FAST, PRO, choose_tier
+
+
+def transfer_to_agent(agent_name: str) -> None:
+    """转交给子代理。"""
+
+
+def _request(*parts: types.Part, tools: bool = True) -> LlmRequest:
+    request = LlmRequest(contents=[types.Content(role="user", parts=list(parts))])
+    if tools:
+        request.tools_dict["transfer_to_agent"] = FunctionTool(transfer_to_agent)
+    return request
+
+
+@pytest.fixture(autouse=True)
+def _routing(monkeypatch):
+    monkeypatch.setattr(model_router, "ROUTING_ENABLED", True)
+    for role in ("SUPERVISOR", "PAPER_ANALYZE", "EXPERIMENT_DESIGN", "DATA_ANALYZE"):
+        monkeypatch.delenv(f"MODEL_TIER_{role}", raising=False)
+
+
+def test_supervisor_dispatch_uses_fast_tier():
+    assert choose_tier("supervisor", _request(types.Part(text="设计一个 Suzuki 偶联实验"))) == (FAST, "dispatch")
+
+
+@pytest.mark.parametrize("role", ["paper_analyze", "experiment_design", "data_analyze"])
+def test_sub_agent_first_step_uses_pro_tier(role):
+    # 子代理可能不调用工具、直接给出最终报告
+    assert choose_tier(role, _request(types.Part(text="总结这篇论文"))) == (PRO, "dispatch")
+
+
+def test_after_tool_result_and_pure_generation_use_pro_tier():
+    result = types.Part(function_response=types.FunctionResponse(name="transfer_to_agent", response={}))
+    assert choose_tier("supervisor", _request(result)) == (PRO, "observe")
+    assert choose_tier("supervisor", _request(types.Part(text="hi"), tools=False)) == (PRO, "generate")
+
+
+def test_role_pin_overrides_default(monkeypatch):
+    monkeypatch.setenv("MODEL_TIER_DATA_ANALYZE", FAST)
+    assert choose_tier("data_analyze", _request(types.Part(text="画图")))[0] == FAST
+    monkeypatch.setenv("MODEL_TIER_SUPERVISOR", PRO)
+    assert choose_tier("supervisor", _request(types.Part(text="hi")))[0] == PRO
+
+
+def test_supervisor_integrating_sub_agent_results_uses_pro_tier():
+    from google.adk.events.event import Event
+    from google.adk.flows.llm_flows.contents import _present_other_agent_message
+
+    # 子代理交回控制权后，ADK 把它的输出改写成 "For context: ..." 的 user 消息交给主代理
+    sub_agent_reply = _present_other_agent_message(Event(
+        author="PaperAnalyzeAgent", invocation_id="inv",
+        content=types.Content(role="model", parts=[types.Part(text="论文的关键结论是……")]),
+    )).content
+    request = _request(types.Part(text="分析这篇论文并设计后续实验"))
+    request.contents += [
+        types.Content(role="model", parts=[types.Part(function_call=types.FunctionCall(
+            name="transfer_to_agent", args={"agent_name": "PaperAnalyzeAgent"}))]),
+        types.Content(role="user", parts=[types.Part(function_response=types.FunctionResponse(
+            name="transfer_to_agent", response={}))]),
+        sub_agent_reply,
+    ]
+    assert sub_agent_reply.role == "user"
+    assert choose_tier("supervisor", request) == (PRO, "report")
+
+    # 只有其他代理的输出、没有转交记录时同样属于整合结果
+    request.contents = [request.contents[0], sub_agent_reply]
+    assert choose_tier("supervisor", request) == (PRO, "report")
+
+    # 用户的下一轮新问题重新回到调度阶段
+    request.contents.append(types.Content(role="user", parts=[types.Part(text="再换一种配体")]))
+    assert choose_tier("supervisor", request) == (FAST, "dispatch")
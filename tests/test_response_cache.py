@@ -0,0 +1,40 @@
+import pytest
+
+from tools.response_cache import AgentResponseCache, normalize_query
+
+SCOPE = "ExperimentDesignAgent|prompt|-|kb:0"
+QUERY = "请设计一个基于金纳米颗粒的电化学 DNA 传感器，检测血清中的 microRNA-21，要求检测限低于 1 fM，并给出实验步骤"
+
+
+@pytest.fixture
+def near_cache(tmp_path):
+    cache = AgentResponseCache(str(tmp_path / "responses.db"), enabled=True, similarity_threshold=0.9)
+    cache.store(SCOPE, normalize_query(QUERY), "1 fM 的设计方案")
+    return cache
+
+
+def test_near_duplicate_wording_hits(near_cache):
+    found = near_cache.lookup(SCOPE, normalize_query(QUERY.replace("请设计", "设计")))
+    assert found is not None and found[0] == "1 fM 的设计方案"
+
+
+@pytest.mark.parametrize("changed", [
+    QUERY.replace("1 fM", "1 pM"),
+    QUERY.replace("1 fM", "10 fM"),
+    QUERY.replace("microRNA-21", "microRNA-155"),
+])
+def test_near_match_requires_same_numbers_units_and_ids(near_cache, changed):
+    assert near_cache.lookup(SCOPE, normalize_query(changed)) is None
+
+
+def test_normalization_keeps_decimals_and_case():
+    assert normalize_query("1.5 nM") != normalize_query("15 nM")
+    assert normalize_query("Co 催化剂") != normalize_query("CO 催化剂")
+    assert normalize_query("  Co，催化剂。") == normalize_query("Co 催化剂")
+
+
+def test_exact_match_only_by_default(tmp_path):
+    cache = AgentResponseCache(str(tmp_path / "responses.db"), enabled=True)
+    cache.store(SCOPE, normalize_query(QUERY), "报告")
+    assert cache.lookup(SCOPE, normalize_query(QUERY + "。")) == ("报告", 1.0)
+    assert cache.lookup(SCOPE, normalize_query(QUERY.replace("请设计", "设计"))) is None
@@ -0,0 +1,61 @@
+import asyncio
+import fcntl
+
+from google.adk.events.event import Event
+from google.genai import types
+
+from session_store import TunedSqliteSessionService
+
+
+def test_compaction_waits_for_cross_process_write_lock(tmp_path):
+    db_path = str(tmp_path / "sessions.db")
+
+    async def scenario():
+        service = TunedSqliteSessionService(db_path)
+        session = await service.create_session(app_name="app", user_id="u1")
+        await service.append_event(session, Event(
+            author="user", invocation_id="inv", timestamp=1.0,
+            content=types.Content(role="user", parts=[
+                types.Part(inline_data=types.Blob(data=b"x" * 1024, mime_type="image/png", display_name="a.png")),
+            ]),
+        ))
+        # 单独打开的文件锁句柄相当于另一个进程正在写入
+        with open(db_path + ".write-lock", "a") as other_process:
+            fcntl.flock(other_process, fcntl.LOCK_EX)
+            compaction = asyncio.create_task(service.compact(0, 365 * 24 * 3600, 200))
+            await asyncio.sleep(0.3)
+            blocked = not compaction.done()
+            fcntl.flock(other_process, fcntl.LOCK_UN)
+        result = await asyncio.wait_for(compaction, timeout=5)
+        await service.close()
+        return blocked, result
+
+    blocked, result = asyncio.run(scenario())
+    assert blocked
+    assert result == {"stripped_events": 1, "pruned_events": 0}
+
+
+def test_prune_keeps_recent_events_per_session(tmp_path):
+    async def scenario():
+        service = TunedSqliteSessionService(str(tmp_path / "sessions.db"))
+        counts = {"long": 450, "short": 3}
+        for session_id, count in counts.items():
+            session = await service.create_session(app_name="app", user_id="u1", session_id=session_id)
+            for index in range(count):
+                await service.append_event(session, Event(
+                    author="user", invocation_id="inv", timestamp=1.0 + index,
+                    content=types.Content(role="user", parts=[types.Part(text=f"{session_id} {index}")]),
+                ))
+        result = await service.compact(365 * 24 * 3600, 3600, 5)
+        remaining = {}
+        for session_id in counts:
+            session = await service.get_session(app_name="app", user_id="u1", session_id=session_id)
+            remaining[session_id] = [event.content.parts[0].text for event in session.events]
+        await service.close()
+        return result, remaining
+
+    result, remaining = asyncio.run(scenario())
+    # 跨越多个删除批次，较短的会话不受影响
+    assert result["pruned_events"] == 445
+    assert remaining["long"] == [f"long {index}" for index in range(445, 450)]
+    assert remaining["short"] == ["short 0", "short 1", "short 2"]
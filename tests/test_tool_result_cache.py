@@ -0,0 +1,11 @@
+from tools.tool_result_cache import ToolResultCache
+
+
+def test_key_keeps_case_and_collapses_whitespace():
+    cache = ToolResultCache(["ragflow_retrieval"])
+    cobalt = cache.make_key("ragflow_retrieval", {"question": "Co 催化剂"})
+    carbon_monoxide = cache.make_key("ragflow_retrieval", {"question": "CO 催化剂"})
+    assert cobalt != carbon_monoxide
+    assert cache.make_key("ragflow_retrieval", {"dataset_ids": ["kb-AbC"]}) != \
+        cache.make_key("ragflow_retrieval", {"dataset_ids": ["kb-abc"]})
+    assert cache.make_key("ragflow_retrieval", {"question": "  Co \n 催化剂 "}) == cobalt
@@ -0,0 +1,323 @@
+"""
+上传文件的内容寻址存储。
+
+用户上传的 PDF、图片和 Office 文件原本以 `inline_data` 的形式保存在会话事件中：
+它们随事件写入会话库，并在每一轮对话加载会话时全部读回内存。
+
+本模块在用户消息写入会话之前（`ArtifactOffloadPlugin.on_user_message_callback`）
+把文件字节写入本地磁盘，按 SHA-256 去重，事件中只保留形如 `cas://sha256/<hex>` 的
+`file_data` 引用。文件字节只在真正需要它们的模型调用中才被读取：
+- 需要提取文本的文件由 `read_files_as_text_callback` 通过内存映射直接从磁盘解析；
+- 原生交给模型的文件（图片、视频、PDF）由 `materialize_artifacts_callback_async`
+  在模型调用前临时还原为 `inline_data`，不会写回会话。
+
+存储目录在多个工作进程之间共享，写入通过临时文件 + 原子替换完成。
+长期未被访问的文件由后台任务按保留期清理；仍被会话库中保留的事件引用的文件
+（以及它们的检索索引）不会被清理，无法读取会话库时本轮不清理。
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import threading
+import time
+from typing import Collection, Iterator, Optional
+
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.plugins.base_plugin import BasePlugin
+from google.genai import types
+
+from app_config import get_env
+from logger_config import logger
+from session_store import referenced_artifacts
+
+REF_PREFIX = "cas://sha256/"
+_REF_RE = re.compile(r"^cas://sha256/(?P<digest>[0-9a-f]{64})$")
+
+
+def make_ref(digest: str) -> str:
+    return f"{REF_PREFIX}{digest}"
+
+
+def parse_ref(part: types.Part) -> Optional[str]:
+    """如果 part 是指向本存储的引用，返回其 SHA-256 摘要，否则返回 None。"""
+    if not (part.file_data and part.file_data.file_uri):
+        return None
+    match = _REF_RE.match(part.file_data.file_uri)
+    return match.group("digest") if match else None
+
+
+def iter_uploaded_files(context) -> Iterator[tuple[types.Part, Optional[str]]]:
+    """
+    按从新到旧的顺序遍历本轮用户消息和会话历史中的上传文件，生成 (part, 摘要)。
+
+    已卸载到存储的文件摘要取自引用，仍以 `inline_data` 保存的小文件摘要为 None。
+    同一个文件在多条消息中出现时只返回最近的一次。
+    """
+    contents = [context.user_content] if context.user_content else []
+    contents += [
+        event.content for event in reversed(context.session.events)
+        if event.author == "user" and event.content
+    ]
+    seen = set()
+    for content in contents:
+        for part in content.parts or []:
+            digest = parse_ref(part)
+            if digest:
+                key = digest
+            elif part.inline_data and part.inline_data.data:
+                key = (part.inline_data.display_name, len(part.inline_data.data))
+            else:
+                continue
+            if key not in seen:
+                seen.add(key)
+                yield part, digest
+
+
+class ArtifactNotFound(FileNotFoundError):
+    """引用的文件已被清理或不在本机的存储目录中。"""
+
+
+class ArtifactStore:
+    """
+    以 SHA-256 摘要为键、存放在磁盘上的不可变文件存储。
+
+    Args:
+        root_dir: 存储目录。
+        min_bytes: 小于该字节数的上传文件保留在消息中，不写入存储。
+    """
+
+    def __init__(self, root_dir: str, min_bytes: int = 4096):
+        self.root_dir = root_dir
+        self.min_bytes = min_bytes
+        self._lock = threading.Lock()
+        self._counters = {
+            "stored": 0,
+            "deduplicated": 0,
+            "bytes_written": 0,
+            "materialized": 0,
+            "bytes_materialized": 0,
+            "missing": 0,
+            "swept": 0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "ArtifactStore":
+        return cls(
+            root_dir=get_env("ARTIFACT_STORE_DIR", "./artifacts"),
+            min_bytes=int(get_env("ARTIFACT_OFFLOAD_MIN_BYTES", 4096)),
+        )
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root_dir, digest[:2], digest)
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def size(self, digest: str) -> int:
+        """文件大小（字节）；文件不存在时返回 0。"""
+        try:
+            return os.path.getsize(self.path(digest))
+        except OSError:
+            return 0
+
+    def put(self, data: bytes) -> str:
+        """写入文件字节并返回其摘要；内容相同的文件只保存一份。"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            # 刷新修改时间，避免仍在使用的文件被清理
+            os.utime(path)
+            self._count("deduplicated")
+            return digest
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            # 原子替换，避免其他进程读到写了一半的文件
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._count("stored")
+        self._count("bytes_written", len(data))
+        return digest
+
+    def read(self, digest: str) -> bytes:
+        """读取完整的文件字节，只应在需要把文件原样交给模型时使用。"""
+        try:
+            with open(self.path(digest), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self._count("missing")
+            raise ArtifactNotFound(f"文件 {digest[:16]} 已不在存储中（可能已过期被清理）") from None
+        self._count("materialized")
+        self._count("bytes_materialized", len(data))
+        return data
+
+    def offload(self, part: types.Part) -> Optional[types.Part]:
+        """把一个 inline_data part 写入存储，返回替代它的引用 part；不需要卸载时返回 None。"""
+        blob = part.inline_data
+        if not (blob and blob.data) or len(blob.data) < self.min_bytes:
+            return None
+        digest = self.put(blob.data)
+        return types.Part(file_data=types.FileData(
+            file_uri=make_ref(digest), mime_type=blob.mime_type, display_name=blob.display_name,
+        ))
+
+    def sweep(self, retention_s: float, referenced: Collection[str] = ()) -> int:
+        """
+        删除超过保留期未被写入或读取的文件，返回删除的文件数。
+
+        Args:
+            retention_s: 保留期（秒）。
+            referenced: 仍被会话引用的摘要；这些文件和以摘要命名的索引文件无论多旧都保留。
+        """
+        cutoff = time.time() - retention_s
+        removed = 0
+        if not os.path.isdir(self.root_dir):
+            return 0
+        for shard in os.scandir(self.root_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name[:64] in referenced:
+                    continue
+                try:
+                    stat = entry.stat()
+                    if max(stat.st_mtime, stat.st_atime) < cutoff:
+                        os.remove(entry.path)
+                        removed += 1
+                except OSError:
+                    continue
+        if removed:
+            self._count("swept", removed)
+            logger.info(f"已清理 {removed} 个过期的上传文件")
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counters)
+
+
+artifact_store = ArtifactStore.from_env()
+
+
+class ArtifactOffloadPlugin(BasePlugin):
+    """在用户消息写入会话之前，把其中的上传文件卸载到 `artifact_store`，只保留引用。"""
+
+    def __init__(self, name: str = "artifact_offload", store: Optional[ArtifactStore] = None):
+        super().__init__(name)
+        self.store = store or artifact_store
+
+    async def on_user_message_callback(
+        self, *, invocation_context: InvocationContext, user_message: types.Content
+    ) -> Optional[types.Content]:
+        if not user_message.parts or not any(part.inline_data for part in user_message.parts):
+            return None
+        new_parts = []
+        modified = False
+        for part in user_message.parts:
+            try:
+                ref = await asyncio.to_thread(self.store.offload, part)
+            except OSError as e:
+                # 写入失败时保留原始字节，保证请求仍然可以处理
+                logger.warning(f"上传文件写入存储失败，保留在消息中: {e}")
+                ref = None
+            if ref is None:
+                new_parts.append(part)
+            else:
+                new_parts.append(ref)
+                modified = True
+        if not modified:
+            return None
+        return types.Content(role=user_message.role, parts=new_parts)
+
+
+artifact_offload_plugin = ArtifactOffloadPlugin()
+
+
+async def materialize_artifacts_callback_async(callback_context, llm_request):
+    """
+    一个“模型调用前”回调：把仍然以引用形式出现在请求中的文件（图片、视频、PDF 等
+    由模型原生处理的类型）临时还原为 `inline_data`。
+
+    需要排在 `read_files_as_text_callback_async` 和上下文预算回调之后，
+    这样已被提取为文本或已被折叠的历史文件不会再被读取。
+    """
+    if not llm_request.contents:
+        return
+    digests = {
+        digest
+        for content in llm_request.contents
+        for part in content.parts or []
+        if (digest := parse_ref(part))
+    }
+    if not digests:
+        return
+
+    async def _load(digest: str):
+        try:
+            return await asyncio.to_thread(artifact_store.read, digest)
+        except ArtifactNotFound as e:
+            return e
+
+    keys = list(digests)
+    loaded = dict(zip(keys, await asyncio.gather(*(_load(digest) for digest in keys))))
+
+    for content in llm_request.contents:
+        new_parts = []
+        for part in content.parts or []:
+            digest = parse_ref(part)
+            if digest is None:
+                new_parts.append(part)
+                continue
+            data = loaded[digest]
+            name = part.file_data.display_name or "uploaded_file"
+            if isinstance(data, BaseException):
+                new_parts.append(types.Part(
+                    text=f"[文件 '{name}' 的内容已不可用: {data}。请告知用户需要重新上传该文件。]"
+                ))
+                continue
+            new_parts.append(types.Part(inline_data=types.Blob(
+                data=data, mime_type=part.file_data.mime_type, display_name=part.file_data.display_name,
+            )))
+        content.parts = new_parts
+
+
+async def _sweep_loop(interval_s: float, retention_s: float) -> None:
+    while True:
+        await asyncio.sleep(interval_s)
+        try:
+            # 先收集引用再清理：之后新写入的引用对应的文件修改时间已被刷新，不会过期
+            referenced = await referenced_artifacts()
+            if referenced is None:
+                logger.warning("没有使用 sqlite+wal 会话库，无法判断上传文件是否仍被引用，跳过清理")
+                continue
+            await asyncio.to_thread(artifact_store.sweep, retention_s, frozenset(referenced))
+        except Exception as e:
+            logger.warning(f"清理上传文件存储失败: {e}")
+
+
+def start_background_sweep() -> Optional[asyncio.Task]:
+    """
+    启动定期清理过期上传文件的后台任务。
+
+    间隔由 `ARTIFACT_SWEEP_INTERVAL_S`（默认 3600，0 表示不清理）控制，
+    保留期由 `ARTIFACT_RETENTION_S`（默认 30 天，与会话事件的保留期一致）控制。
+    只有使用 `sqlite+wal` 会话库时才能判断哪些文件仍被会话引用，否则不清理。
+    """
+    interval_s = float(get_env("ARTIFACT_SWEEP_INTERVAL_S", 3600))
+    if interval_s <= 0:
+        return None
+    retention_s = float(get_env("ARTIFACT_RETENTION_S", 30 * 24 * 3600))
+    return asyncio.create_task(_sweep_loop(interval_s, retention_s))
@@ -0,0 +1,191 @@
+"""
+上下文窗口预算管理：在模型调用前折叠历史中已消费过的文件内容。
+
+每一轮对话都会把完整的历史发送给模型，其中包括 `read_files_as_text_callback` 注入的
+“--- 文件开始 --- ... --- 文件结束 ---” 文本块以及原生传递的 PDF / 图片 part（或指向上传文件存储的引用）。
+在长会话中，这些内容占据了绝大部分输入 token。
+
+本模块提供一个 `before_model_callback`（需排在文件读取回调之后）：
+- 按代理估算每次请求的 token 数，超过预算时从最旧的文件开始，
+  把“已消费”的文件（不属于当前这一轮用户消息的文件）替换为简短的占位说明
+  （文件名、哈希、简要摘要）。
+- 模型可以调用 `recall_file` 工具取回某个文件的全文，被取回的文件在本次调用期间不再折叠。
+- 每次请求都会记录折叠前后的 token 估算值。
+"""
+
+import hashlib
+import re
+from typing import Optional
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models.llm_request import LlmRequest
+from google.adk.tools.tool_context import ToolContext
+from google.genai import types
+
+from app_config import get_env
+from logger_config import logger
+from tools.artifact_store import artifact_store, parse_ref
+from tools.document_extractors import estimate_tokens
+
+# 被模型通过 recall_file 取回、在本次调用中不再折叠的文件哈希
+RECALLED_STATE_KEY = "temp:context_budget_recalled"
+
+FILE_BLOCK_START = "--- 文件开始 ---"
+_FILE_BLOCK_RE = re.compile(r"^用户上传了文件 '(?P<name>.*?)' \(MIME类型: '(?P<mime>.*?)'\)")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# 原生 part 的粗略 token 估算：图片按固定值，其余按字节数折算
+IMAGE_TOKENS = 258
+INLINE_BYTES_PER_TOKEN = 400
+HASH_PREFIX_LEN = 16
+SUMMARY_CHARS = 200
+
+# 最近一次请求的折叠统计，便于排查
+last_report: dict[str, dict] = {}
+
+
+def _part_tokens(part: types.Part) -> int:
+    if part.text:
+        return estimate_tokens(part.text)
+    if part.inline_data and part.inline_data.data:
+        mime_type = part.inline_data.mime_type or ""
+        if mime_type.startswith("image"):
+            return IMAGE_TOKENS
+        return IMAGE_TOKENS + len(part.inline_data.data) // INLINE_BYTES_PER_TOKEN
+    digest = parse_ref(part)
+    if digest:
+        # 尚未还原的文件引用，按还原后的大小估算
+        if (part.file_data.mime_type or "").startswith("image"):
+            return IMAGE_TOKENS
+        return IMAGE_TOKENS + artifact_store.size(digest) // INLINE_BYTES_PER_TOKEN
+    if part.function_call or part.function_response:
+        payload = part.function_call or part.function_response
+        return estimate_tokens(str(payload.model_dump(exclude_none=True)))
+    return 0
+
+
+def estimate_request_tokens(llm_request: LlmRequest) -> int:
+    """估算一次模型请求中 contents 的 token 数（不含系统指令和工具声明）。"""
+    return sum(
+        _part_tokens(part)
+        for content in llm_request.contents or []
+        for part in content.parts or []
+    )
+
+
+def _is_file_payload(part: types.Part) -> bool:
+    if part.inline_data and part.inline_data.data:
+        return True
+    if parse_ref(part):
+        return True
+    return bool(part.text and FILE_BLOCK_START in part.text and _FILE_BLOCK_RE.match(part.text))
+
+
+def payload_hash(part: types.Part) -> str:
+    # 文件存储的摘要与原始字节的 SHA-256 相同，卸载前后哈希一致
+    digest = parse_ref(part)
+    if digest:
+        return digest[:HASH_PREFIX_LEN]
+    data = part.inline_data.data if part.inline_data and part.inline_data.data else part.text.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()[:HASH_PREFIX_LEN]
+
+
+def _make_stub(part: types.Part, digest: str) -> types.Part:
+    if part.inline_data and part.inline_data.data:
+        name = part.inline_data.display_name or "uploaded_file"
+        summary = f"{part.inline_data.mime_type or '未知类型'} 文件，约 {len(part.inline_data.data) // 1024} KB"
+    elif part.file_data:
+        name = part.file_data.display_name or "uploaded_file"
+        summary = f"{part.file_data.mime_type or '未知类型'} 文件，约 {artifact_store.size(parse_ref(part)) // 1024} KB"
+    else:
+        match = _FILE_BLOCK_RE.match(part.text)
+        name = match.group("name")
+        body = part.text.split(FILE_BLOCK_START, 1)[1]
+        summary = _WHITESPACE_RE.sub(" ", body[:SUMMARY_CHARS * 2]).strip()[:SUMMARY_CHARS]
+    return types.Part(
+        text=(
+            f"[已折叠的历史文件] '{name}' (哈希: {digest})。摘要: {summary} ……\n"
+            f"该文件已在之前的对话中处理过。如需查看全文，请调用 `recall_file` 工具并传入 file_hash=\"{digest}\"。"
+        )
+    )
+
+
+def _current_turn_index(contents: list[types.Content], user_content: Optional[types.Content]) -> int:
+    """返回当前这一轮用户消息所在的下标；在它之前出现的文件视为已消费。"""
+    # 优先按本次调用的用户消息文本定位（其他代理的发言也会以 user 角色出现在历史中）
+    texts = [part.text for part in (user_content.parts or []) if part.text] if user_content else []
+    if texts:
+        for index in range(len(contents) - 1, -1, -1):
+            if any(part.text == texts[0] for part in contents[index].parts or []):
+                return index
+    for index in range(len(contents) - 1, -1, -1):
+        content = contents[index]
+        parts = content.parts or []
+        if content.role == "user" and parts and not any(part.function_response for part in parts):
+            return index
+    return len(contents)
+
+
+def make_context_budget_callback(budget_tokens: Optional[int] = None):
+    """
+    创建一个带 token 预算的 `before_model_callback`。
+
+    Args:
+        budget_tokens: 该代理每次请求允许的 contents token 上限；默认读取 `CONTEXT_TOKEN_BUDGET`。
+    """
+    budget = budget_tokens or int(get_env("CONTEXT_TOKEN_BUDGET", 64_000))
+
+    def compact_context_callback(callback_context: CallbackContext, llm_request: LlmRequest):
+        contents = llm_request.contents or []
+        before = estimate_request_tokens(llm_request)
+        after = before
+        collapsed = 0
+
+        if before > budget:
+            recalled = set(callback_context.state.get(RECALLED_STATE_KEY) or [])
+            current = _current_turn_index(contents, callback_context.user_content)
+            for content in contents[:current]:
+                if after <= budget:
+                    break
+                new_parts = []
+                for part in content.parts or []:
+                    if after > budget and _is_file_payload(part):
+                        digest = payload_hash(part)
+                        if digest not in recalled:
+                            stub = _make_stub(part, digest)
+                            after -= _part_tokens(part) - _part_tokens(stub)
+                            collapsed += 1
+                            new_parts.append(stub)
+                            continue
+                    new_parts.append(part)
+                content.parts = new_parts
+
+        report = {"budget": budget, "tokens_before": before, "tokens_after": after, "collapsed_files": collapsed}
+        last_report[callback_context.agent_name] = report
+        if collapsed:
+            logger.info(f"[{callback_context.agent_name}] 上下文折叠: {before} -> {after} tokens (预算 {budget}, 折叠 {collapsed} 个文件)")
+        else:
+            logger.debug(f"[{callback_context.agent_name}] 上下文 token 估算: {before} (预算 {budget})")
+        return None
+
+    return compact_context_callback
+
+
+def recall_file(file_hash: str, tool_context: ToolContext) -> dict:
+    """
+    取回一个已被折叠的历史文件的全文。
+
+    当上下文中出现“[已折叠的历史文件]”占位说明、且你需要该文件的完整内容时调用。
+
+    Args:
+        file_hash: 占位说明中给出的文件哈希。
+
+    Returns:
+        操作结果；文件全文会在下一步的上下文中重新出现。
+    """
+    recalled = list(tool_context.state.get(RECALLED_STATE_KEY) or [])
+    digest = file_hash.strip().strip('"')[:HASH_PREFIX_LEN]
+    if digest not in recalled:
+        recalled.append(digest)
+        tool_context.state[RECALLED_STATE_KEY] = recalled
+    return {"status": "success", "message": f"文件 {digest} 的全文将在下一步的上下文中重新提供。"}
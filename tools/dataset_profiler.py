@@ -0,0 +1,553 @@
+"""
+基于 NumPy 的分块数据集统计。
+
+仪器导出的数据（荧光光谱、SWV / CV 曲线等）常有数万到数百万行。本模块按块流式读取
+CSV / XLSX 表格，对每一块做向量化计算，并把各块的结果合并为一份紧凑的统计摘要：
+
+- 每列的类型、缺失数和描述统计（均值、标准差、极值、分位数）
+- 按指定列分组的汇总
+- 数值列之间的相关系数（只列出强相关的列对）
+- 基于 IQR 的异常值计数和示例行号（需要第二遍扫描）；行号是数据行的序号（从 1 开始，
+  不计表头和被跳过的空行），不一定等于文件中的行号
+- 以第一列为横坐标时各列的峰值位置（例如发射峰波长、峰电位）
+
+内存占用只与块大小和列数有关，与文件行数无关；分位数基于固定大小的均匀抽样估算。
+NumPy 导入较慢，本模块只在第一次调用 `profile_dataset` 工具时才被导入。
+"""
+
+import csv
+import io
+import math
+from contextlib import contextmanager
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Optional, Sequence, Union
+
+import numpy as np
+
+from app_config import get_env
+
+CHUNK_ROWS = int(get_env("DATASET_PROFILE_CHUNK_ROWS", 50_000))
+# 每列用于估算分位数和异常值阈值的均匀抽样大小
+SAMPLE_SIZE = 20_000
+MAX_GROUPS = 20
+MAX_GROUP_COLUMNS = 8
+MAX_CATEGORIES = 1_000
+TOP_CATEGORIES = 5
+MAX_CORRELATION_COLUMNS = 30
+CORRELATION_THRESHOLD = 0.5
+MAX_CORRELATION_PAIRS = 10
+OUTLIER_EXAMPLES = 5
+# 非数值内容不超过该比例的列仍视为数值列
+NUMERIC_TOLERANCE = 0.05
+
+_MISSING_TOKENS = np.array(["", "na", "n/a", "nan", "null", "none", "-", "--", "#n/a"])
+_OTHER_GROUP = "(其他)"
+_MISSING_GROUP = "(缺失)"
+
+
+def _round(value) -> Optional[float]:
+    if value is None or not math.isfinite(value):
+        return None
+    return float(f"{value:.6g}")
+
+
+def _column_names(header: Sequence) -> list[str]:
+    names, seen = [], set()
+    for i, value in enumerate(header):
+        name = str(value).strip() if value is not None else ""
+        name = name or f"列{i + 1}"
+        while name in seen:
+            name = f"{name}_{i + 1}"
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+@contextmanager
+def open_table(source: Union[str, bytes], kind: str, sheet_name: str = "", chunk_rows: int = CHUNK_ROWS):
+    """
+    打开一个 CSV / XLSX 表格，产出 (列名, 数据块迭代器, 工作表名)。
+
+    每个数据块是 (行数, 列数) 的数组；空行被跳过，列数不一致的行被补齐或截断。
+
+    Args:
+        source: 文件路径或原始字节。
+        kind: "csv" 或 "xlsx"。
+        sheet_name: XLSX 的工作表名，默认第一个工作表。
+        chunk_rows: 每块的行数。
+    """
+    if kind == "xlsx":
+        try:
+            import openpyxl
+        except ImportError:
+            raise ImportError("请运行 'pip install openpyxl' 来安装处理 .xlsx 文件的库。") from None
+        workbook = openpyxl.load_workbook(
+            source if isinstance(source, str) else io.BytesIO(source), read_only=True, data_only=True
+        )
+        try:
+            if sheet_name and sheet_name not in workbook.sheetnames:
+                raise ValueError(f"工作表 '{sheet_name}' 不存在，可用的工作表: {workbook.sheetnames}")
+            worksheet = workbook[sheet_name] if sheet_name else workbook.worksheets[0]
+            rows = worksheet.iter_rows(values_only=True)
+            names = _column_names(next(rows, None) or ())
+            rows = (["" if v is None else v for v in row] for row in rows)
+            yield names, _iter_chunks(rows, len(names), chunk_rows), worksheet.title
+        finally:
+            workbook.close()
+        return
+
+    if isinstance(source, str):
+        stream = open(source, "r", encoding="utf-8-sig", errors="replace", newline="")
+    else:
+        stream = io.TextIOWrapper(io.BytesIO(source), encoding="utf-8-sig", errors="replace", newline="")
+    with stream:
+        sample = stream.read(8192)
+        stream.seek(0)
+        try:
+            delimiter = csv.Sniffer().sniff(sample, delimiters=",\t;|").delimiter
+        except csv.Error:
+            delimiter = ","
+        names = _column_names(next(csv.reader(stream, delimiter=delimiter), []))
+        yield names, _iter_csv_chunks(stream, delimiter, len(names), chunk_rows), None
+
+
+def _iter_csv_chunks(stream, delimiter: str, width: int, chunk_rows: int) -> Iterator[np.ndarray]:
+    """
+    按块读取 CSV 数据行。
+
+    纯数值的块直接交给 NumPy 的 C 解析器（`np.loadtxt`），比 csv 模块逐行解析快数倍；
+    含有文本、空值或列数不一致的块再退回 csv 模块。
+    """
+    while True:
+        lines = list(islice(stream, chunk_rows))
+        if not lines:
+            return
+        try:
+            array = np.loadtxt(lines, delimiter=delimiter, dtype=np.float64, ndmin=2, comments=None)
+        except ValueError:
+            array = None
+        if array is not None and array.shape[1] == width:
+            if len(array):
+                yield array
+            continue
+        yield from _iter_chunks(csv.reader(lines, delimiter=delimiter), width, len(lines))
+
+
+def _iter_chunks(rows: Iterable[Sequence], width: int, chunk_rows: int) -> Iterator[np.ndarray]:
+    """把数据行按块组装为 (行数, 列数) 的对象数组；跳过空行，按列数补齐或截断。"""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_rows))
+        if not chunk:
+            return
+        if set(map(len, chunk)) != {width}:
+            chunk = [list(row[:width]) + [""] * (width - len(row)) for row in chunk if row]
+        array = np.array(chunk, dtype=object).reshape(len(chunk), width)
+        blank = (array == "").all(axis=1)
+        if blank.any():
+            array = array[~blank]
+        if len(array):
+            yield array
+
+
+def _group_keys(raw: np.ndarray) -> np.ndarray:
+    """
+    分组列的取值。数值写成统一的形式（1、1.0、1.00 都是 "1"），与数据块由 `np.loadtxt`
+    还是 csv 模块解析无关，否则同一个分组会在不同的块中被拆成 "1.0" 和 "1"。
+    """
+    text = np.char.strip(raw.astype(str))
+    uniques, inverse = np.unique(text, return_inverse=True)
+    keys = []
+    for value in uniques.tolist():
+        number = _parse_float(value)
+        keys.append(f"{number:.15g}" if math.isfinite(number) else value)
+    return np.array(keys, dtype=object)[inverse]
+
+
+def _parse_float(text: str) -> float:
+    try:
+        return float(text)
+    except ValueError:
+        return math.nan
+
+
+class _ColumnProfile:
+    """一列的流式统计量：数值部分用 Chan 合并公式更新均值和方差，非数值部分统计取值频次。"""
+
+    def __init__(self, name: str, rng: np.random.Generator):
+        self.name = name
+        self.rng = rng
+        self.count = 0
+        self.missing = 0
+        self.non_numeric = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.x_at_min: Optional[float] = None
+        self.x_at_max: Optional[float] = None
+        self.sample = np.empty(0)
+        self._sample_keys = np.empty(0)
+        self.categories: Optional[dict[str, int]] = {}
+        self.text_only = False
+        self.fences: Optional[tuple[float, float]] = None
+        self.outliers = 0
+        self.outlier_rows: list[int] = []
+
+    def parse(self, raw: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        """
+        返回 (数值, 缺失掩码, 非数值掩码, 去除空白后的文本)；非数值和缺失位置的数值为 NaN。
+
+        整块都能直接转换为数值时走快速路径，不生成文本数组（此时返回的文本为 None）。
+        """
+        if not self.text_only:
+            try:
+                values = raw.astype(np.float64)
+            except (TypeError, ValueError):
+                pass
+            else:
+                no_values = np.zeros(len(raw), dtype=bool)
+                return values, np.isnan(values), no_values, None
+        text = np.char.strip(raw.astype(str))
+        missing = np.isin(np.char.lower(text), _MISSING_TOKENS)
+        if self.text_only:
+            return np.full(len(raw), np.nan), missing, ~missing, text
+        candidates = np.where(missing, "nan", text)
+        try:
+            values = candidates.astype(np.float64)
+        except ValueError:
+            values = np.fromiter((_parse_float(v) for v in candidates), dtype=np.float64, count=len(candidates))
+        bad = np.isnan(values) & ~missing
+        return values, missing, bad, text
+
+    def update(self, values: np.ndarray, missing: np.ndarray, bad: np.ndarray, text: Optional[np.ndarray],
+               x: Optional[np.ndarray]) -> None:
+        self.missing += int(missing.sum())
+        self.non_numeric += int(bad.sum())
+        valid = ~np.isnan(values)
+        numbers = values[valid]
+        n = len(numbers)
+        if n:
+            chunk_mean = float(numbers.mean())
+            chunk_m2 = float(((numbers - chunk_mean) ** 2).sum())
+            total = self.count + n
+            delta = chunk_mean - self.mean
+            self.mean += delta * n / total
+            self.m2 += chunk_m2 + delta * delta * self.count * n / total
+            self.count = total
+
+            chunk_min_index, chunk_max_index = int(numbers.argmin()), int(numbers.argmax())
+            xs = x[valid] if x is not None else None
+            if numbers[chunk_min_index] < self.min:
+                self.min = float(numbers[chunk_min_index])
+                self.x_at_min = float(xs[chunk_min_index]) if xs is not None else None
+            if numbers[chunk_max_index] > self.max:
+                self.max = float(numbers[chunk_max_index])
+                self.x_at_max = float(xs[chunk_max_index]) if xs is not None else None
+            self._update_sample(numbers)
+
+        if self.categories is not None and bad.any():
+            uniques, counts = np.unique(text[bad], return_counts=True)
+            for value, count in zip(uniques.tolist(), counts.tolist()):
+                self.categories[value] = self.categories.get(value, 0) + count
+            if len(self.categories) > MAX_CATEGORIES:
+                self.categories = None
+        # 累计超过一半的内容都不是数字时，后续块不再尝试解析数值
+        non_missing = self.count + self.non_numeric
+        if not self.text_only and non_missing and self.non_numeric > 0.5 * non_missing:
+            self.text_only = True
+
+    def _update_sample(self, numbers: np.ndarray) -> None:
+        # 为每个值分配随机优先级，保留优先级最小的 SAMPLE_SIZE 个值，即为均匀抽样
+        keys = self.rng.random(len(numbers))
+        sample = np.concatenate([self.sample, numbers])
+        sample_keys = np.concatenate([self._sample_keys, keys])
+        if len(sample) > SAMPLE_SIZE:
+            keep = np.argpartition(sample_keys, SAMPLE_SIZE)[:SAMPLE_SIZE]
+            sample, sample_keys = sample[keep], sample_keys[keep]
+        self.sample, self._sample_keys = sample, sample_keys
+
+    @property
+    def kind(self) -> str:
+        non_missing = self.count + self.non_numeric
+        if not non_missing:
+            return "empty"
+        if self.count and self.non_numeric <= NUMERIC_TOLERANCE * non_missing:
+            return "numeric"
+        return "categorical"
+
+    def prepare_outlier_fences(self) -> None:
+        if self.kind != "numeric" or len(self.sample) < 4:
+            return
+        q1, q3 = np.quantile(self.sample, [0.25, 0.75])
+        iqr = q3 - q1
+        if iqr > 0:
+            self.fences = (float(q1 - 1.5 * iqr), float(q3 + 1.5 * iqr))
+
+    def count_outliers(self, values: np.ndarray, first_row: int) -> None:
+        low, high = self.fences
+        flagged = np.flatnonzero((values < low) | (values > high))
+        self.outliers += len(flagged)
+        if len(self.outlier_rows) < OUTLIER_EXAMPLES:
+            needed = OUTLIER_EXAMPLES - len(self.outlier_rows)
+            self.outlier_rows.extend(int(i) + first_row for i in flagged[:needed])
+
+    def summary(self) -> dict:
+        kind = self.kind
+        result = {"name": self.name, "type": kind, "missing": self.missing}
+        if kind == "numeric":
+            std = math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+            p25, median, p75 = np.quantile(self.sample, [0.25, 0.5, 0.75])
+            result.update({
+                "count": self.count,
+                "mean": _round(self.mean),
+                "std": _round(std),
+                "min": _round(self.min),
+                "p25": _round(p25),
+                "median": _round(median),
+                "p75": _round(p75),
+                "max": _round(self.max),
+            })
+            if self.non_numeric:
+                result["non_numeric"] = self.non_numeric
+            if self.fences is not None:
+                result["outliers"] = self.outliers
+                if self.outlier_rows:
+                    result["outlier_rows"] = self.outlier_rows
+        elif kind == "categorical":
+            result["count"] = self.count + self.non_numeric
+            if self.categories is None:
+                result["distinct"] = f">{MAX_CATEGORIES}"
+            else:
+                result["distinct"] = len(self.categories)
+                top = sorted(self.categories.items(), key=lambda item: -item[1])[:TOP_CATEGORIES]
+                result["top"] = [{"value": value[:50], "count": count} for value, count in top]
+        return result
+
+
+class _GroupAccumulator:
+    """按分组列累积各数值列的计数、和、平方和与极值。"""
+
+    def __init__(self, width: int):
+        slots = MAX_GROUPS + 1
+        self.ids: dict[str, int] = {}
+        self.rows = np.zeros(slots)
+        self.count = np.zeros((slots, width))
+        self.total = np.zeros((slots, width))
+        self.total_sq = np.zeros((slots, width))
+        self.min = np.full((slots, width), np.inf)
+        self.max = np.full((slots, width), -np.inf)
+
+    def _group_id(self, key: str) -> int:
+        group_id = self.ids.get(key)
+        if group_id is None:
+            if len(self.ids) >= MAX_GROUPS:
+                return MAX_GROUPS
+            group_id = self.ids[key] = len(self.ids)
+        return group_id
+
+    def update(self, keys: np.ndarray, numeric: np.ndarray, shift: np.ndarray) -> None:
+        keys = np.where(keys == "", _MISSING_GROUP, keys)
+        uniques, inverse = np.unique(keys, return_inverse=True)
+        group_ids = np.array([self._group_id(key) for key in uniques.tolist()])[inverse]
+        slots = len(self.rows)
+        self.rows += np.bincount(group_ids, minlength=slots)
+        for j in range(numeric.shape[1]):
+            column = numeric[:, j]
+            valid = ~np.isnan(column)
+            if not valid.any():
+                continue
+            ids, values = group_ids[valid], column[valid]
+            shifted = values - shift[j]
+            self.count[:, j] += np.bincount(ids, minlength=slots)
+            self.total[:, j] += np.bincount(ids, weights=shifted, minlength=slots)
+            self.total_sq[:, j] += np.bincount(ids, weights=shifted * shifted, minlength=slots)
+            np.minimum.at(self.min[:, j], ids, values)
+            np.maximum.at(self.max[:, j], ids, values)
+
+    def summary(self, by: str, columns: list[tuple[int, str]], shift: np.ndarray) -> dict:
+        labels = sorted(self.ids.items(), key=lambda item: item[1])
+        if self.rows[MAX_GROUPS]:
+            labels.append((_OTHER_GROUP, MAX_GROUPS))
+        groups = []
+        for label, group_id in labels:
+            stats = {}
+            for j, name in columns:
+                n = self.count[group_id, j]
+                if not n:
+                    continue
+                mean = self.total[group_id, j] / n
+                variance = max(self.total_sq[group_id, j] / n - mean * mean, 0.0) * n / (n - 1) if n > 1 else 0.0
+                stats[name] = {
+                    "count": int(n),
+                    "mean": _round(mean + shift[j]),
+                    "std": _round(math.sqrt(variance)),
+                    "min": _round(self.min[group_id, j]),
+                    "max": _round(self.max[group_id, j]),
+                }
+            groups.append({"group": label[:50], "rows": int(self.rows[group_id]), "stats": stats})
+        result = {"by": by, "groups": groups}
+        if self.rows[MAX_GROUPS]:
+            result["note"] = f"分组数超过 {MAX_GROUPS}，其余分组合并为 '{_OTHER_GROUP}'"
+        return result
+
+
+class _TableProfiler:
+    def __init__(self, names: list[str], group_by: str = ""):
+        if group_by and group_by not in names:
+            raise ValueError(f"分组列 '{group_by}' 不存在，可用的列: {names}")
+        rng = np.random.default_rng(0)
+        self.names = names
+        self.columns = [_ColumnProfile(name, rng) for name in names]
+        self.group_index = names.index(group_by) if group_by else None
+        self.groups = _GroupAccumulator(len(names)) if group_by else None
+        self.rows = 0
+        self.shift: Optional[np.ndarray] = None
+        width = min(len(names), MAX_CORRELATION_COLUMNS)
+        self.pair_count = np.zeros((width, width))
+        self.pair_sum = np.zeros((width, width))
+        self.pair_sum_sq = np.zeros((width, width))
+        self.pair_cross = np.zeros((width, width))
+        # 第一列（横坐标）是否单调；CV 曲线的往返扫描不是单调的
+        self.x_monotonic = True
+        self._x_direction = 0.0
+        self._last_x: Optional[float] = None
+
+    def _parse_chunk(self, chunk: np.ndarray) -> tuple[np.ndarray, Optional[np.ndarray]]:
+        """解析一块数据并更新各列的统计量，返回 (数值矩阵, 分组列文本)。"""
+        numeric = np.empty(chunk.shape, dtype=np.float64)
+        group_keys = None
+        for j, column in enumerate(self.columns):
+            values, missing, bad, text = column.parse(chunk[:, j])
+            numeric[:, j] = values
+            column.update(values, missing, bad, text, numeric[:, 0] if j else None)
+            if j == self.group_index:
+                group_keys = _group_keys(chunk[:, j])
+        return numeric, group_keys
+
+    def _track_x(self, x: np.ndarray) -> None:
+        x = x[~np.isnan(x)]
+        if self._last_x is not None:
+            x = np.concatenate([[self._last_x], x])
+        if not len(x):
+            return
+        self._last_x = float(x[-1])
+        signs = np.sign(np.diff(x))
+        signs = signs[signs != 0]
+        if not len(signs) or not self.x_monotonic:
+            return
+        if (signs != signs[0]).any() or (self._x_direction and signs[0] != self._x_direction):
+            self.x_monotonic = False
+        else:
+            self._x_direction = float(signs[0])
+
+    def update(self, chunk: np.ndarray) -> None:
+        numeric, group_keys = self._parse_chunk(chunk)
+        self.rows += len(chunk)
+        if self.shift is None:
+            # 以第一块的列均值为平移量，减少平方和累加时的精度损失
+            counts = (~np.isnan(numeric)).sum(axis=0)
+            sums = np.nansum(numeric, axis=0)
+            self.shift = np.where(counts > 0, sums / np.maximum(counts, 1), 0.0)
+        self._track_x(numeric[:, 0])
+
+        width = self.pair_count.shape[0]
+        block = numeric[:, :width] - self.shift[:width]
+        valid = (~np.isnan(block)).astype(np.float64)
+        filled = np.where(valid > 0, block, 0.0)
+        # 两两完整观测的计数、和、平方和与交叉积，都以矩阵乘法一次算出
+        self.pair_count += valid.T @ valid
+        self.pair_sum += filled.T @ valid
+        self.pair_sum_sq += (filled * filled).T @ valid
+        self.pair_cross += filled.T @ filled
+
+        if self.groups is not None:
+            self.groups.update(group_keys, numeric, self.shift)
+
+    def prepare_outlier_pass(self) -> bool:
+        for column in self.columns:
+            column.prepare_outlier_fences()
+        return any(column.fences is not None for column in self.columns)
+
+    def count_outliers(self, chunk: np.ndarray, first_row: int) -> None:
+        for j, column in enumerate(self.columns):
+            if column.fences is not None:
+                values, _, _, _ = column.parse(chunk[:, j])
+                column.count_outliers(values, first_row)
+
+    def _correlations(self) -> list[dict]:
+        numeric = [j for j in range(self.pair_count.shape[0]) if self.columns[j].kind == "numeric"]
+        pairs = []
+        for a_index, a in enumerate(numeric):
+            for b in numeric[a_index + 1:]:
+                n = self.pair_count[a, b]
+                if n < 3:
+                    continue
+                sum_a, sum_b = self.pair_sum[a, b], self.pair_sum[b, a]
+                var_a = n * self.pair_sum_sq[a, b] - sum_a * sum_a
+                var_b = n * self.pair_sum_sq[b, a] - sum_b * sum_b
+                if var_a <= 0 or var_b <= 0:
+                    continue
+                r = (n * self.pair_cross[a, b] - sum_a * sum_b) / math.sqrt(var_a * var_b)
+                if abs(r) >= CORRELATION_THRESHOLD:
+                    pairs.append({"columns": [self.names[a], self.names[b]], "r": round(float(r), 4), "n": int(n)})
+        pairs.sort(key=lambda pair: -abs(pair["r"]))
+        return pairs[:MAX_CORRELATION_PAIRS]
+
+    def _peaks(self) -> Optional[dict]:
+        if not self.columns or self.columns[0].kind != "numeric":
+            return None
+        peaks = {
+            column.name: {
+                "max": _round(column.max), "x_at_max": _round(column.x_at_max),
+                "min": _round(column.min), "x_at_min": _round(column.x_at_min),
+            }
+            for column in self.columns[1:]
+            if column.kind == "numeric"
+        }
+        if not peaks:
+            return None
+        return {"x_column": self.names[0], "x_monotonic": bool(self.x_monotonic), "columns": peaks}
+
+    def summary(self) -> dict:
+        columns = [column.summary() for column in self.columns]
+        result = {"rows": self.rows, "column_count": len(self.columns), "columns": columns}
+        if any(column.count > SAMPLE_SIZE for column in self.columns):
+            result["note"] = f"分位数和异常值阈值基于每列 {SAMPLE_SIZE} 个值的均匀抽样估算；其余统计量为精确值。"
+        correlations = self._correlations()
+        if correlations:
+            result["strong_correlations"] = correlations
+        peaks = self._peaks()
+        if peaks:
+            result["peaks"] = peaks
+        if self.groups is not None:
+            numeric = [(j, self.names[j]) for j, column in enumerate(self.columns)
+                       if column.kind == "numeric" and j != self.group_index][:MAX_GROUP_COLUMNS]
+            result["group_summary"] = self.groups.summary(self.names[self.group_index], numeric, self.shift)
+        return result
+
+
+def profile_table(open_source: Callable, group_by: str = "") -> dict:
+    """
+    分块统计一个表格。
+
+    Args:
+        open_source: 无参调用后返回 `open_table(...)` 上下文管理器；异常值统计需要第二遍扫描，会调用两次。
+        group_by: 分组列名，为空时不做分组汇总。
+    """
+    with open_source() as (names, chunks, sheet):
+        profiler = _TableProfiler(names, group_by)
+        for chunk in chunks:
+            profiler.update(chunk)
+
+    if profiler.rows and profiler.prepare_outlier_pass():
+        with open_source() as (_, chunks, _):
+            first_row = 1
+            for chunk in chunks:
+                profiler.count_outliers(chunk, first_row)
+                first_row += len(chunk)
+
+    result = profiler.summary()
+    if sheet:
+        result["sheet"] = sheet
+    return result
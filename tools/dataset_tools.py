@@ -0,0 +1,84 @@
+"""
+DataAnalyzeAgent 的本地数据统计工具。
+
+此前每一次数据分析都要经过远程 MCP 的 `analyze_csv_file`，原始 CSV 文本还会被整体放进提示词。
+`profile_dataset` 在本地按块读取上传的表格（见 `tools/dataset_profiler.py`），只把紧凑的统计摘要交给模型。
+"""
+
+import asyncio
+import os
+from typing import Optional
+
+from google.adk.tools import ToolContext
+
+from tools.artifact_store import artifact_store, iter_uploaded_files
+
+_TABLE_EXTENSIONS = {".csv": "csv", ".tsv": "csv", ".xlsx": "xlsx"}
+_TABLE_MIME_TYPES = {
+    "text/csv": "csv",
+    "text/tab-separated-values": "csv",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": "xlsx",
+}
+
+
+def _table_kind(mime_type: str, file_name: str) -> Optional[str]:
+    return _TABLE_MIME_TYPES.get(mime_type) or _TABLE_EXTENSIONS.get(os.path.splitext(file_name)[1].lower())
+
+
+def _find_table(tool_context: ToolContext, file_name: str) -> Optional[tuple[str, str, object]]:
+    """
+    在本轮用户消息和会话历史中查找上传的表格文件，返回 (文件名, 类型, 文件路径或字节)。
+
+    未指定文件名时返回最近上传的一个 CSV / XLSX 文件。
+    """
+    wanted = os.path.basename(file_name.strip()).lower()
+    for part, digest in iter_uploaded_files(tool_context):
+        if digest:
+            blob, source = part.file_data, artifact_store.path(digest)
+        else:
+            blob, source = part.inline_data, part.inline_data.data
+        name = blob.display_name or "uploaded_file"
+        kind = _table_kind(blob.mime_type or "", name)
+        if kind and (not wanted or name.lower() == wanted):
+            return name, kind, source
+    return None
+
+
+async def profile_dataset(
+    file_name: str, tool_context: ToolContext, group_by: str = "", sheet_name: str = ""
+) -> dict:
+    """
+    在本地对用户上传的 CSV / XLSX 数据文件做统计概览，返回紧凑的统计摘要，而不是原始数据。
+
+    结果包括：每列的类型、缺失值数量、描述统计（均值、标准差、最小值、四分位数、最大值）、
+    基于 IQR 的异常值数量和示例行号、强相关的列对、按分组列的分组汇总，以及以第一列为横坐标时
+    各数值列的峰值位置（适用于荧光光谱、SWV / CV 曲线等仪器导出数据）。
+    文件按块流式处理，行数很多的文件也可以分析。异常值示例行号（outlier_rows）是数据行的序号，
+    从 1 开始，不计表头和空行。
+
+    Args:
+        file_name: 上传的文件名，例如 "data.csv"；留空时分析最近上传的数据文件。
+        group_by: 可选，用于分组汇总的列名，例如 "group"。
+        sheet_name: 可选，XLSX 文件的工作表名，默认第一个工作表。
+
+    Returns:
+        包含 rows、columns、strong_correlations、peaks、group_summary 等字段的统计摘要。
+    """
+    found = _find_table(tool_context, file_name)
+    if found is None:
+        target = f"名为 '{file_name}' 的" if file_name else ""
+        return {"status": "error", "message": f"对话中没有找到{target} CSV / XLSX 数据文件。"}
+    name, kind, source = found
+
+    # NumPy 只在第一次调用时导入，避免拖慢服务启动
+    from tools.dataset_profiler import open_table, profile_table
+
+    try:
+        summary = await asyncio.to_thread(
+            profile_table, lambda: open_table(source, kind, sheet_name), group_by
+        )
+    except FileNotFoundError:
+        return {"status": "error", "message": f"文件 '{name}' 已不在存储中，请让用户重新上传。"}
+    except (ValueError, ImportError) as e:
+        return {"status": "error", "message": str(e)}
+    return {"status": "success", "file_name": name, **summary}
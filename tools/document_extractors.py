@@ -0,0 +1,427 @@
+"""
+有界、流式的文档文本提取器。
+
+所有提取器都以生成器的方式逐行 / 逐段 / 逐页读取文档，并通过 `_UnitSampler`
+在固定预算内保留头部、尾部以及中间均匀抽样的内容。无论上传文件多大，
+提取过程的内存峰值和输出长度都是有界的；超出预算时会在结果中附上一段截断说明。
+"""
+
+import importlib
+import io
+import mmap
+import os
+import re
+from collections import deque
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional, Union
+
+from app_config import get_env
+
+# --- 文件处理库在首次使用时才导入 (如果库未安装，会给出明确错误提示) ---
+# python-docx / openpyxl / python-pptx 导入较慢，延迟导入可以缩短服务冷启动时间
+_OPTIONAL_LIBRARIES = {
+    "docx": ("python-docx", ".docx"),
+    "openpyxl": ("openpyxl", ".xlsx"),
+    "pptx": ("python-pptx", ".pptx"),
+    "pypdf": ("pypdf", ".pdf"),
+}
+
+
+def _require(module_name: str):
+    try:
+        return importlib.import_module(module_name)
+    except ImportError:
+        package, ext = _OPTIONAL_LIBRARIES[module_name]
+        raise ImportError(f"请运行 'pip install {package}' 来安装处理 {ext} 文件的库。") from None
+
+
+CSV_MIME_TYPES = ("text/csv", "text/tab-separated-values")
+PDF_MIME_TYPE = "application/pdf"
+DOCX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+XLSX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+PPTX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+
+# 预算在头部 / 中间抽样 / 尾部之间的分配比例
+HEAD_SHARE = 0.6
+MIDDLE_SHARE = 0.2
+TAIL_SHARE = 0.2
+
+_NON_CJK_RE = re.compile(r"[^\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]+")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的 token 数：中日韩字符按 1 字 1 token，其余按 4 字符 1 token。"""
+    if not text:
+        return 0
+    non_cjk = sum(len(m) for m in _NON_CJK_RE.findall(text))
+    cjk = len(text) - non_cjk
+    return cjk + (non_cjk + 3) // 4
+
+
+@dataclass(frozen=True)
+class ExtractionBudget:
+    """
+    单个文件的提取预算。
+
+    Attributes:
+        max_chars: 提取结果允许的最大字符数。
+        max_tokens: 提取结果允许的最大估算 token 数。
+        max_rows_per_sheet: 每个工作表最多保留的行数。
+        max_table_rows: CSV / TSV 文件最多保留的行数；完整的统计量由 `profile_dataset` 工具在本地计算。
+    """
+
+    max_chars: int = 200_000
+    max_tokens: int = 80_000
+    max_rows_per_sheet: int = 2_000
+    max_table_rows: int = 200
+
+    @classmethod
+    def from_env(cls) -> "ExtractionBudget":
+        return cls(
+            max_chars=int(get_env("EXTRACTION_MAX_CHARS", cls.max_chars)),
+            max_tokens=int(get_env("EXTRACTION_MAX_TOKENS", cls.max_tokens)),
+            max_rows_per_sheet=int(get_env("EXTRACTION_MAX_ROWS", cls.max_rows_per_sheet)),
+            max_table_rows=int(get_env("EXTRACTION_MAX_TABLE_ROWS", cls.max_table_rows)),
+        )
+
+    def signature(self) -> str:
+        """用于缓存键的预算签名；预算变化后旧的缓存条目不会被误用。"""
+        return f"c{self.max_chars}-t{self.max_tokens}-r{self.max_rows_per_sheet}-tr{self.max_table_rows}"
+
+    def cost(self, text: str) -> int:
+        """把一段文本折算为“字符单位”的开销，同时考虑字符预算和 token 预算。"""
+        token_cost = estimate_tokens(text) * self.max_chars // max(self.max_tokens, 1)
+        return max(len(text), token_cost)
+
+
+class _UnitSampler:
+    """
+    在固定预算内流式采样文本单元（行 / 段落 / 幻灯片）。
+
+    - 头部：按顺序保留，直到达到头部预算。
+    - 尾部：使用有界队列保留最近的单元，被挤出的单元进入中间抽样区。
+    - 中间：按步长做系统抽样，超出预算时丢弃一半样本并把步长翻倍。
+
+    内存占用只与预算有关，与输入长度无关。
+    """
+
+    def __init__(self, budget: ExtractionBudget, max_chars: int, max_units: Optional[int] = None):
+        self.budget = budget
+        self.head_chars = int(max_chars * HEAD_SHARE)
+        self.tail_chars = int(max_chars * TAIL_SHARE)
+        self.middle_chars = int(max_chars * MIDDLE_SHARE)
+        # 单个单元（例如一整行超长文本）最多占用尾部预算，保证总能保留下来
+        self.max_unit_chars = max(self.tail_chars, 200)
+        if max_units is None:
+            self.head_units = self.tail_units = self.middle_units = None
+        else:
+            self.head_units = max(1, int(max_units * HEAD_SHARE))
+            self.tail_units = max(1, int(max_units * TAIL_SHARE))
+            self.middle_units = max(1, int(max_units * MIDDLE_SHARE))
+
+        self.head: list[str] = []
+        self._head_cost = 0
+        self._head_closed = False
+        self.tail: deque = deque()
+        self._tail_cost = 0
+        self.middle: list[tuple[int, str, int]] = []
+        self._middle_cost = 0
+        self._stride = 1
+        self._middle_seen = 0
+        self.total_units = 0
+
+    def add(self, unit: str) -> None:
+        self.total_units += 1
+        if len(unit) > self.max_unit_chars:
+            unit = unit[: self.max_unit_chars] + " …[本单元过长，已截断]"
+        cost = self.budget.cost(unit)
+
+        if not self._head_closed:
+            fits_chars = self._head_cost + cost <= self.head_chars
+            fits_units = self.head_units is None or len(self.head) < self.head_units
+            if fits_chars and fits_units:
+                self.head.append(unit)
+                self._head_cost += cost
+                return
+            self._head_closed = True
+
+        self.tail.append((self.total_units, unit, cost))
+        self._tail_cost += cost
+        while self.tail and (
+            self._tail_cost > self.tail_chars
+            or (self.tail_units is not None and len(self.tail) > self.tail_units)
+        ):
+            evicted = self.tail.popleft()
+            self._tail_cost -= evicted[2]
+            self._add_middle(evicted)
+
+    def _add_middle(self, item: tuple[int, str, int]) -> None:
+        self._middle_seen += 1
+        if (self._middle_seen - 1) % self._stride:
+            return
+        self.middle.append(item)
+        self._middle_cost += item[2]
+        while self.middle and (
+            self._middle_cost > self.middle_chars
+            or (self.middle_units is not None and len(self.middle) > self.middle_units)
+        ):
+            # 样本过多：保留每隔一个的样本，并把步长翻倍
+            self.middle = self.middle[::2]
+            self._middle_cost = sum(cost for _, _, cost in self.middle)
+            self._stride *= 2
+            if len(self.middle) == 1 and self._middle_cost > self.middle_chars:
+                self.middle = []
+                self._middle_cost = 0
+
+    @property
+    def kept_units(self) -> int:
+        return len(self.head) + len(self.middle) + len(self.tail)
+
+    @property
+    def truncated(self) -> bool:
+        return self.kept_units < self.total_units
+
+    def render(self, separator: str = "\n") -> str:
+        if not self.truncated:
+            # 没有丢弃任何单元时，从尾部挤出的单元仍在中间区，三段按原顺序拼接
+            return separator.join(self.head + [unit for _, unit, _ in self.middle] + [unit for _, unit, _ in self.tail])
+        pieces = list(self.head)
+        if self.middle:
+            pieces.append(f"[... 以下为中间部分的均匀抽样 (每 {self._stride} 个取 1 个) ...]")
+            pieces.extend(f"[#{index}] {unit}" for index, unit, _ in self.middle)
+        omitted = self.total_units - self.kept_units
+        pieces.append(f"[... 共省略 {omitted} 个单元，以下为末尾部分 ...]")
+        pieces.extend(unit for _, unit, _ in self.tail)
+        return separator.join(pieces)
+
+    def note(self, label: str, unit_name: str) -> Optional[str]:
+        if not self.truncated:
+            return None
+        return (
+            f"[截断说明] {label} 共 {self.total_units} {unit_name}，超出提取预算；"
+            f"仅保留前 {len(self.head)} {unit_name}、末尾 {len(self.tail)} {unit_name}"
+            f"以及中间均匀抽样的 {len(self.middle)} {unit_name}。"
+        )
+
+
+def detect_kind(mime_type: str, file_name: str) -> str:
+    """结合MIME类型和文件名后缀判断提取方式：docx / xlsx / pptx / csv / text。"""
+    file_ext = os.path.splitext(file_name)[1].lower()
+    if mime_type == DOCX_MIME_TYPE or file_ext == ".docx":
+        return "docx"
+    if mime_type == XLSX_MIME_TYPE or file_ext == ".xlsx":
+        return "xlsx"
+    if mime_type == PPTX_MIME_TYPE or file_ext == ".pptx":
+        return "pptx"
+    if mime_type in CSV_MIME_TYPES or file_ext in (".csv", ".tsv"):
+        return "csv"
+    return "text"
+
+
+def _sample_units(units: Iterable[str], budget: ExtractionBudget, label: str, unit_name: str,
+                  max_chars: Optional[int] = None, max_units: Optional[int] = None,
+                  separator: str = "\n") -> str:
+    sampler = _UnitSampler(budget, max_chars or budget.max_chars, max_units)
+    for unit in units:
+        sampler.add(unit)
+    text = sampler.render(separator)
+    note = sampler.note(label, unit_name)
+    return f"{note}\n{text}" if note else text
+
+
+# 提取器的输入：原始字节，或者 mmap / memoryview 等只读缓冲区
+Source = Union[bytes, mmap.mmap, memoryview]
+
+
+class _BufferReader(io.RawIOBase):
+    """在 mmap / memoryview 之上提供可定位的只读二进制流，按需复制，不把整个缓冲区读入内存。"""
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._size = len(buffer)
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = max(min(len(b), self._size - self._pos), 0)
+        b[:n] = self._buffer[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+
+def _binary_stream(data: Source):
+    if isinstance(data, bytes):
+        return io.BytesIO(data)
+    return io.BufferedReader(_BufferReader(data))
+
+
+# --- 各类文档的流式读取 ---
+def _iter_docx_paragraphs(data: Source) -> Iterator[str]:
+    document = _require("docx").Document(_binary_stream(data))
+    for paragraph in document.paragraphs:
+        yield paragraph.text
+
+
+def _iter_pptx_slides(data: Source) -> Iterator[str]:
+    presentation = _require("pptx").Presentation(_binary_stream(data))
+    for i, slide in enumerate(presentation.slides):
+        yield f"--- 幻灯片 {i+1} ---\n" + "\n".join(
+            shape.text_frame.text for shape in slide.shapes if hasattr(shape, "text_frame") and shape.text_frame
+        )
+
+
+def _iter_sheet_rows(worksheet) -> Iterator[str]:
+    for row in worksheet.iter_rows(values_only=True):
+        cells = ["" if value is None else str(value) for value in row]
+        while cells and not cells[-1]:
+            cells.pop()
+        if cells:
+            yield "\t".join(cells)
+
+
+def _iter_text_lines(data: Source) -> Iterator[str]:
+    # 逐行增量解码，避免一次性 decode 整个文件
+    with io.TextIOWrapper(_binary_stream(data), encoding="utf-8", newline=None) as stream:
+        for line in stream:
+            yield line.rstrip("\n")
+
+
+def _extract_xlsx(data: Source, budget: ExtractionBudget) -> str:
+    # 只读 + 仅取值模式：逐行流式读取，不在内存中构建完整的单元格对象树
+    workbook = _require("openpyxl").load_workbook(_binary_stream(data), read_only=True, data_only=True)
+    try:
+        sheet_names = workbook.sheetnames
+        per_sheet_chars = max(budget.max_chars // max(len(sheet_names), 1), 1_000)
+        full_text = []
+        for name in sheet_names:
+            body = _sample_units(
+                _iter_sheet_rows(workbook[name]), budget, f"工作表 '{name}'", "行",
+                max_chars=per_sheet_chars, max_units=budget.max_rows_per_sheet,
+            )
+            full_text.append(f"--- 工作表: {name} ---\n{body}")
+        return "\n\n".join(full_text)
+    finally:
+        workbook.close()
+
+
+def extract_text(data: Source, kind: str, budget: Optional[ExtractionBudget] = None) -> str:
+    """按文件类型从原始字节（或只读缓冲区）中流式提取文本，结果受 `budget` 约束。"""
+    budget = budget or ExtractionBudget.from_env()
+    # 1. 处理 Word (.docx)
+    if kind == "docx":
+        return _sample_units(_iter_docx_paragraphs(data), budget, "文档", "段")
+    # 2. 处理 Excel (.xlsx)
+    if kind == "xlsx":
+        return _extract_xlsx(data, budget)
+    # 3. 处理 PowerPoint (.pptx)
+    if kind == "pptx":
+        return _sample_units(_iter_pptx_slides(data), budget, "演示文稿", "页", separator="\n\n")
+    # 4. 处理 CSV / TSV：只保留少量样本行，统计量交给 profile_dataset 工具
+    if kind == "csv":
+        return _sample_units(_iter_text_lines(data), budget, "表格", "行", max_units=budget.max_table_rows)
+    # 5. 如果不是Office文档，则一律尝试作为文本文件解码
+    return _sample_units(_iter_text_lines(data), budget, "文件", "行")
+
+
+def extract_text_from_file(path: str, kind: str, budget: Optional[ExtractionBudget] = None) -> str:
+    """从磁盘文件中提取文本；文件通过内存映射读取，不会整体载入进程内存。"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return extract_text(b"", kind, budget)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return extract_text(mapped, kind, budget)
+
+
+# --- 按页 / 按节读取，供论文检索索引 (`tools/paper_index.py`) 使用 ---
+_MARKDOWN_HEADING_RE = re.compile(r"^\s{0,3}#{1,6}\s+(?P<title>.+?)\s*#*\s*$")
+_DOCX_HEADING_STYLES = ("heading", "title", "标题")
+# 没有标题的纯文本按固定行数分节
+TEXT_SECTION_LINES = 60
+
+
+def _iter_pdf_pages(data: Source) -> Iterator[tuple[str, str]]:
+    reader = _require("pypdf").PdfReader(_binary_stream(data))
+    for i, page in enumerate(reader.pages):
+        yield f"第 {i+1} 页", page.extract_text() or ""
+
+
+def _iter_docx_sections(data: Source) -> Iterator[tuple[str, str]]:
+    document = _require("docx").Document(_binary_stream(data))
+    title, lines = "开头", []
+    for paragraph in document.paragraphs:
+        style = (paragraph.style.name if paragraph.style is not None else "").lower()
+        if style.startswith(_DOCX_HEADING_STYLES) and paragraph.text.strip():
+            if lines:
+                yield title, "\n".join(lines)
+            title, lines = paragraph.text.strip()[:80], []
+        lines.append(paragraph.text)
+    if lines:
+        yield title, "\n".join(lines)
+
+
+def _iter_text_sections(data: Source) -> Iterator[tuple[str, str]]:
+    def label(title: Optional[str], start: int) -> str:
+        return f"{title} · 第 {start} 行起" if title else f"第 {start} 行起"
+
+    title, start, lines = None, 1, []
+    for number, line in enumerate(_iter_text_lines(data), start=1):
+        match = _MARKDOWN_HEADING_RE.match(line)
+        if match or len(lines) >= TEXT_SECTION_LINES:
+            if lines:
+                yield label(title, start), "\n".join(lines)
+            if match:
+                title = match.group("title")[:80]
+            start, lines = number, []
+        lines.append(line)
+    if lines:
+        yield label(title, start), "\n".join(lines)
+
+
+def iter_sections(data: Source, kind: str) -> Iterator[tuple[str, str]]:
+    """
+    按页（PDF、幻灯片）或按节（Word 标题、Markdown 标题，无标题时按固定行数）逐段读取文档，
+    生成 (位置, 文本)。与 `extract_text` 不同，这里不做预算采样，调用方负责限制总长度。
+    """
+    if kind == "pdf":
+        yield from _iter_pdf_pages(data)
+    elif kind == "docx":
+        yield from _iter_docx_sections(data)
+    elif kind == "pptx":
+        for i, slide in enumerate(_iter_pptx_slides(data)):
+            yield f"幻灯片 {i+1}", slide.split("\n", 1)[-1]
+    elif kind == "text":
+        yield from _iter_text_sections(data)
+    else:
+        raise ValueError(f"不支持按节读取 {kind} 文件")
+
+
+def read_sections_from_file(path: str, kind: str, max_chars: int) -> list[tuple[str, str]]:
+    """通过内存映射读取磁盘文件的各页 / 各节，累计文本超过 `max_chars` 后停止。"""
+    sections, total = [], 0
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return sections
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for location, text in iter_sections(mapped, kind):
+                if total >= max_chars:
+                    break
+                text = text[: max_chars - total]
+                sections.append((location, text))
+                total += len(text)
+    return sections
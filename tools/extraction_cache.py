@@ -0,0 +1,250 @@
+"""
+基于内容寻址的文件文本提取缓存。
+
+`read_files_as_text_callback` 作为所有代理的 `before_model_callback`，会在每一次模型调用时
+遍历完整的对话历史。没有缓存时，同一个上传文件会在每个 ReAct 步骤中被反复解析。
+
+本模块提供:
+- 内存 LRU 层：按字节预算淘汰最久未使用的条目。
+- 可选的磁盘层：以键的哈希作为文件名持久化，进程重启后依然有效。
+- 单飞 (single-flight) 去重：并发请求同一个键时只有一个调用者（线程或协程）真正执行解析，其余调用者等待结果。
+- 命中/未命中计数器，用于确认每步的提取开销是否降到接近零。
+"""
+
+import asyncio
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from logger_config import logger
+
+
+def make_cache_key(data: bytes, kind: str, version: str) -> str:
+    """根据文件字节、提取类型和提取器版本生成缓存键。"""
+    return make_digest_cache_key(hashlib.sha256(data).hexdigest(), kind, version)
+
+
+def make_digest_cache_key(digest: str, kind: str, version: str) -> str:
+    """根据文件字节的 SHA-256 摘要生成缓存键，与 `make_cache_key` 对同一文件的结果相同。"""
+    return f"{version}:{kind}:{digest}"
+
+
+class _Flight:
+    """一次正在进行中的提取，供并发的等待者共享结果。"""
+
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+
+class ExtractionCache:
+    """
+    带字节预算的两级（内存 + 可选磁盘）提取结果缓存。
+
+    Args:
+        max_bytes: 内存层允许占用的最大字节数（按 `sys.getsizeof` 估算）。
+        disk_dir: 磁盘层目录；为 None 时不启用磁盘层。
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, disk_dir: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._sizes: dict[str, int] = {}
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+        self._flights: dict[str, _Flight] = {}
+        self._async_flights: dict[str, asyncio.Future] = {}
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "evictions": 0,
+        }
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    # --- 内存层 ---
+    def _memory_get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self._counters["memory_hits"] += 1
+            return value
+
+    def _memory_put(self, key: str, value: str) -> None:
+        size = sys.getsizeof(value)
+        if size > self.max_bytes:
+            # 单个条目超过整个预算时不进入内存层，只依赖磁盘层
+            return
+        with self._lock:
+            if key in self._entries:
+                self._current_bytes -= self._sizes.pop(key)
+                del self._entries[key]
+            self._entries[key] = value
+            self._sizes[key] = size
+            self._current_bytes += size
+            while self._current_bytes > self.max_bytes and self._entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self._current_bytes -= self._sizes.pop(old_key)
+                self._counters["evictions"] += 1
+
+    # --- 磁盘层 ---
+    def _disk_path(self, key: str) -> str:
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, name[:2], f"{name}.txt")
+
+    def _disk_get(self, key: str) -> Optional[str]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"读取提取缓存文件 {path} 失败: {e}")
+            return None
+        with self._lock:
+            self._counters["disk_hits"] += 1
+        return value
+
+    def _disk_put(self, key: str, value: str) -> None:
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(value)
+            # 原子替换，避免其他进程读到写了一半的文件
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入提取缓存文件 {path} 失败: {e}")
+
+    # --- 公共接口 ---
+    def get(self, key: str) -> Optional[str]:
+        """依次查找内存层和磁盘层；磁盘命中会回填内存层。"""
+        value = self._memory_get(key)
+        if value is not None:
+            return value
+        value = self._disk_get(key)
+        if value is not None:
+            self._memory_put(key, value)
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        self._memory_put(key, value)
+        self._disk_put(key, value)
+
+    def get_or_compute(self, key: str, compute: Callable[[], str]) -> str:
+        """
+        返回缓存值；未命中时执行 `compute` 并写入缓存。
+
+        并发请求同一个键时只有第一个调用者执行 `compute`，其余调用者等待并共享其结果（或异常）。
+        异常不会被缓存。
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = _Flight()
+                self._flights[key] = flight
+                self._counters["misses"] += 1
+            else:
+                self._counters["coalesced"] += 1
+
+        if not is_leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            value = compute()
+            self.put(key, value)
+            flight.value = value
+            return value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    async def get_or_compute_async(self, key: str, compute: Callable[[], Awaitable[str]]) -> str:
+        """
+        `get_or_compute` 的异步版本，供事件循环中的调用者使用。
+
+        单飞语义相同：同一事件循环中并发请求同一个键时只执行一次 `compute`。
+        若执行者被取消（例如客户端断开），等待者会重新竞争执行。
+        """
+        while True:
+            value = self.get(key)
+            if value is not None:
+                return value
+
+            flight = self._async_flights.get(key)
+            if flight is not None:
+                with self._lock:
+                    self._counters["coalesced"] += 1
+                try:
+                    return await asyncio.shield(flight)
+                except asyncio.CancelledError:
+                    if flight.cancelled():
+                        # 执行者被取消而非自身被取消：重新尝试
+                        continue
+                    raise
+
+            flight = asyncio.get_running_loop().create_future()
+            self._async_flights[key] = flight
+            with self._lock:
+                self._counters["misses"] += 1
+            try:
+                value = await compute()
+                self.put(key, value)
+                flight.set_result(value)
+                return value
+            except asyncio.CancelledError:
+                flight.cancel()
+                raise
+            except BaseException as e:
+                flight.set_exception(e)
+                # 标记异常已被读取，避免无人等待时产生告警
+                flight.exception()
+                raise
+            finally:
+                self._async_flights.pop(key, None)
+
+    def clear(self) -> None:
+        """清空内存层（磁盘层保留）。"""
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._current_bytes = 0
+
+    def stats(self) -> dict:
+        """返回命中/未命中计数以及内存层占用情况。"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._current_bytes
+            stats["max_bytes"] = self.max_bytes
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"] + stats["coalesced"]
+        stats["hit_ratio"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,178 @@
+"""
+把 CPU 密集的文档解析从事件循环中卸载到有界的工作池。
+
+- 小文件使用线程池（避免进程间拷贝的开销），大文件使用进程池（绕开 GIL）。
+- 每个文件都有独立的超时时间。超时的任务仍计入排队深度，直到它真正结束；
+  进程池中的任务超时后换用新的进程池，旧进程池的其他任务完成后终止其工作进程。
+- 调用方协程被取消时（例如客户端断开连接），尚未开始执行的解析任务会被一并取消。
+- 排队深度超过上限时直接拒绝新任务，让过载以可预期的方式降级，而不是拖慢所有会话。
+"""
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from app_config import get_env
+from logger_config import logger
+from tools.document_extractors import ExtractionBudget, extract_text, extract_text_from_file
+
+
+class ExtractionOverloaded(RuntimeError):
+    """排队中的解析任务过多，新任务被拒绝。"""
+
+
+class ExtractionTimeout(TimeoutError):
+    """单个文件的解析超过了允许的时间。"""
+
+
+class ExtractionPool:
+    """
+    文档解析工作池。
+
+    Args:
+        process_workers: 进程池大小。
+        thread_workers: 线程池大小。
+        small_file_bytes: 小于该字节数的文件交给线程池处理。
+        timeout_s: 单个文件的解析超时时间（秒）。
+        max_queue_depth: 同时排队或执行中的解析任务上限。
+    """
+
+    def __init__(
+        self,
+        process_workers: int = 2,
+        thread_workers: int = 4,
+        small_file_bytes: int = 1024 * 1024,
+        timeout_s: float = 60.0,
+        max_queue_depth: int = 32,
+    ):
+        self.process_workers = process_workers
+        self.thread_workers = thread_workers
+        self.small_file_bytes = small_file_bytes
+        self.timeout_s = timeout_s
+        self.max_queue_depth = max_queue_depth
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        # 当前进程池中未完成的任务；已停用的进程池及其仍需等待的任务
+        self._process_futures: set[Future] = set()
+        self._retired: list[tuple[ProcessPoolExecutor, set[Future]]] = []
+
+    @classmethod
+    def from_env(cls) -> "ExtractionPool":
+        return cls(
+            process_workers=int(get_env("EXTRACTION_PROCESS_WORKERS", min(os.cpu_count() or 1, 4))),
+            thread_workers=int(get_env("EXTRACTION_THREAD_WORKERS", 4)),
+            small_file_bytes=int(get_env("EXTRACTION_SMALL_FILE_BYTES", 1024 * 1024)),
+            timeout_s=float(get_env("EXTRACTION_TIMEOUT_S", 60)),
+            max_queue_depth=int(get_env("EXTRACTION_MAX_QUEUE", 32)),
+        )
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _executor_for(self, size: int):
+        if size < self.small_file_bytes or self.process_workers <= 0:
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(
+                    max_workers=self.thread_workers, thread_name_prefix="extraction"
+                )
+            return self._thread_pool
+        if self._process_pool is None:
+            # 使用 spawn，避免在带有事件循环线程的服务进程中 fork
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self.process_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._process_pool
+
+    async def extract(self, data: bytes, kind: str, budget: ExtractionBudget) -> str:
+        """在工作池中解析文件，受超时和排队深度限制。"""
+        return await self.submit(len(data), kind, extract_text, data, kind, budget)
+
+    async def extract_file(self, path: str, size: int, kind: str, budget: ExtractionBudget) -> str:
+        """
+        在工作池中解析磁盘上的文件。
+
+        工作线程 / 进程通过内存映射直接读取文件，进程池只需传递文件路径，不需要跨进程复制文件字节。
+        """
+        return await self.submit(size, kind, extract_text_from_file, path, kind, budget)
+
+    async def submit(self, size: int, kind: str, fn, *args):
+        """
+        在工作池中执行任意的文件处理函数 `fn(*args)`，受超时和排队深度限制。
+
+        大文件会被交给进程池，`fn`、参数和返回值都必须可以被 pickle。
+        """
+        if self._pending >= self.max_queue_depth:
+            raise ExtractionOverloaded(
+                f"当前有 {self._pending} 个文件正在排队解析，已达到上限 {self.max_queue_depth}，请稍后重试"
+            )
+
+        loop = asyncio.get_running_loop()
+        executor = self._executor_for(size)
+        task = executor.submit(fn, *args)
+        self._pending += 1
+        if executor is self._process_pool:
+            self._process_futures.add(task)
+        # 超时或取消后线程 / 进程可能仍在解析，任务真正结束时才从排队深度中扣除
+        task.add_done_callback(lambda done: self._call_soon(loop, self._on_done, done))
+        try:
+            # 调用方被取消时 wait_for 会取消 future；尚未开始的任务将不会执行
+            return await asyncio.wait_for(asyncio.wrap_future(task), timeout=self.timeout_s)
+        except asyncio.TimeoutError:
+            logger.warning(f"{kind} 文件解析超时 ({size} 字节, {self.timeout_s}s)")
+            self._on_timeout(task)
+            raise ExtractionTimeout(f"文件解析超过 {self.timeout_s} 秒，已放弃") from None
+
+    @staticmethod
+    def _call_soon(loop: asyncio.AbstractEventLoop, callback, *args) -> None:
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    def _on_done(self, task: Future) -> None:
+        self._pending -= 1
+        self._process_futures.discard(task)
+        self._reap_retired()
+
+    def _on_timeout(self, task: Future) -> None:
+        """进程池中的任务超时：停用该进程池，之后的任务交给新的进程池。"""
+        if task in self._process_futures:
+            others = {other for other in self._process_futures if other is not task and not other.done()}
+            self._retired.append((self._process_pool, others))
+            self._process_pool, self._process_futures = None, set()
+            logger.warning("进程池中有解析任务超时，换用新的进程池")
+        for _, remaining in self._retired:
+            remaining.discard(task)
+        self._reap_retired()
+
+    def _reap_retired(self) -> None:
+        """终止其他任务都已完成的停用进程池，结束仍在运行的超时任务。"""
+        for entry in list(self._retired):
+            pool, remaining = entry
+            remaining.difference_update([other for other in remaining if other.done()])
+            if not remaining:
+                self._retired.remove(entry)
+                self._terminate(pool)
+
+    @staticmethod
+    def _terminate(pool: ProcessPoolExecutor) -> None:
+        for process in list((pool._processes or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self, wait: bool = False) -> None:
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=wait, cancel_futures=True)
+            self._thread_pool = None
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=wait, cancel_futures=True)
+            self._process_pool = None
+        for pool, _ in self._retired:
+            self._terminate(pool)
+        self._retired.clear()
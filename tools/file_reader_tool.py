@@ -1,36 +1,139 @@
-import io
-import os
+import asyncio
+import time
+from typing import Optional
+
 from google.genai import types
 from google.adk.agents import callback_context
 from google.adk.models.llm_request import LlmRequest
 
-# --- 导入所有需要的文件处理库 (如果库未安装，会给出明确错误提示) ---
-try:
-    import docx
-except ImportError:
-    class docx:
-        @staticmethod
-        def Document(stream):
-            raise ImportError("请运行 'pip install python-docx' 来安装处理 .docx 文件的库。")
-try:
-    import openpyxl
-except ImportError:
-    class openpyxl:
-        @staticmethod
-        def load_workbook(stream):
-            raise ImportError("请运行 'pip install openpyxl' 来安装处理 .xlsx 文件的库。")
-try:
-    import pptx
-except ImportError:
-    class pptx:
-        @staticmethod
-        def Presentation(stream):
-            raise ImportError("请运行 'pip install python-pptx' 来安装处理 .pptx 文件的库。")
+from app_config import get_env
+from telemetry import telemetry
+from tools.artifact_store import artifact_store, parse_ref
+from tools.document_extractors import ExtractionBudget, detect_kind, extract_text, extract_text_from_file
+from tools.extraction_cache import ExtractionCache, make_cache_key, make_digest_cache_key
+from tools.extraction_pool import ExtractionPool
 
 # --- 核心修改：将 application/pdf 添加到原生支持的类型中 ---
 # 我们的回调将跳过这些类型，让模型直接处理
 NATIVELY_SUPPORTED_MIME_PREFIXES = ("image", "video", "application/pdf")
 
+# 提取逻辑发生变化时递增此版本号，使旧的缓存条目自动失效
+EXTRACTOR_VERSION = "3"
+
+# --- 提取结果缓存 (内存 LRU + 可选磁盘层) ---
+extraction_cache = ExtractionCache(
+    max_bytes=int(get_env("EXTRACTION_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+    disk_dir=get_env("EXTRACTION_CACHE_DIR") or None,
+)
+
+# --- 单个文件的提取预算 (行数 / 字符数 / token 数) ---
+extraction_budget = ExtractionBudget.from_env()
+
+# --- 异步回调使用的解析工作池 ---
+extraction_pool = ExtractionPool.from_env()
+
+
+class _ExtractionJob:
+    """
+    一个需要提取文本的文件 part。
+
+    文件可以是消息中的 `inline_data`，也可以是指向 `artifact_store` 的引用；
+    后者的缓存键直接由引用中的摘要得到，命中缓存时完全不需要读取文件。
+    """
+
+    __slots__ = ("part", "file_name", "mime_type", "kind", "data", "path", "size", "cache_key")
+
+    def __init__(self, part: types.Part, digest: Optional[str] = None):
+        self.part = part
+        blob = part.file_data if digest else part.inline_data
+        self.mime_type = blob.mime_type or ""
+        self.file_name = blob.display_name or "uploaded_file"
+        # 结合MIME类型和文件名后缀进行判断
+        self.kind = detect_kind(self.mime_type, self.file_name)
+        signature = f"{self.kind}:{extraction_budget.signature()}"
+        if digest:
+            self.data = None
+            self.path = artifact_store.path(digest)
+            self.size = artifact_store.size(digest)
+            self.cache_key = make_digest_cache_key(digest, signature, EXTRACTOR_VERSION)
+        else:
+            self.data = blob.data
+            self.path = None
+            self.size = len(self.data)
+            self.cache_key = make_cache_key(self.data, signature, EXTRACTOR_VERSION)
+
+    def extract(self) -> str:
+        if self.path is not None:
+            return extract_text_from_file(self.path, self.kind, extraction_budget)
+        return extract_text(self.data, self.kind, extraction_budget)
+
+    async def extract_async(self) -> str:
+        if self.path is not None:
+            return await extraction_pool.extract_file(self.path, self.size, self.kind, extraction_budget)
+        return await extraction_pool.extract(self.data, self.kind, extraction_budget)
+
+
+def _is_native(mime_type: str) -> bool:
+    return any(mime_type.startswith(prefix) for prefix in NATIVELY_SUPPORTED_MIME_PREFIXES)
+
+
+def _plan_job(part: types.Part) -> Optional[_ExtractionJob]:
+    """判断一个 part 是否需要提取文本；不需要时返回 None，原样保留。"""
+    # 已卸载到文件存储的上传文件：原生支持的类型留给 materialize_artifacts_callback_async 还原
+    digest = parse_ref(part)
+    if digest:
+        return None if _is_native(part.file_data.mime_type or "") else _ExtractionJob(part, digest)
+
+    # 检查这是否是一个包含文件数据的 part
+    if not (part.inline_data and part.inline_data.data):
+        return None
+
+    # 如果文件类型是原生支持的（图片、视频、PDF），则直接跳过，保留原始part
+    if _is_native(part.inline_data.mime_type or ""):
+        return None
+
+    return _ExtractionJob(part)
+
+
+def _render_job(job: _ExtractionJob, text_content: Optional[str], error: Optional[BaseException]) -> list:
+    """把提取结果（或错误）渲染为替换原始文件的 part 列表。"""
+    if error is None and text_content is None:
+        error = ValueError("未能从文件中提取任何文本内容")
+
+    if error is not None:
+        error_message = f"无法自动读取文件 '{job.file_name}' 的内容 (MIME类型: {job.mime_type})，错误: {error}。请基于文件名进行推断，或告知用户无法处理此文件。"
+        # 文件存储的引用模型无法访问，只保留错误说明
+        if job.path is not None:
+            return [types.Part(text=error_message)]
+        return [job.part, types.Part(text=error_message)]
+
+    formatted_text = (
+        f"用户上传了文件 '{job.file_name}' (MIME类型: '{job.mime_type}'), 其提取出的文本内容如下:\n--- 文件开始 ---\n"
+        f"{text_content}\n--- 文件结束 ---"
+    )
+    return [types.Part(text=formatted_text)]
+
+
+def _context_ids(context) -> tuple[Optional[str], Optional[str]]:
+    try:
+        return context.session.id, context.invocation_id
+    except Exception:
+        return None, None
+
+
+def _timed_extract(job: _ExtractionJob, session_id: Optional[str], invocation_id: Optional[str]) -> str:
+    """同步解析一个文件，并按文件类型和大小记录耗时。"""
+    start = time.perf_counter()
+    try:
+        text = job.extract()
+    except Exception as e:
+        telemetry.record_extraction(job.kind, job.size, time.perf_counter() - start,
+                                    session_id, invocation_id, error=e)
+        raise
+    telemetry.record_extraction(job.kind, job.size, time.perf_counter() - start, session_id, invocation_id)
+    return text
+
+
 def read_files_as_text_callback(
     callback_context: callback_context, llm_request: LlmRequest
 ):
@@ -42,66 +145,97 @@ def read_files_as_text_callback(
     - **解决了因访问不存在的.uri属性导致的AttributeError。**
     - 智能地结合MIME类型和文件名后缀来判断文件类型。
     - 为所有提取出的文本提供了清晰的上下文，以获得更准确的模型响应。
+    - 提取结果按文件内容哈希缓存，同一文件在后续 ReAct 步骤中不会被重复解析。
+    - 以流式方式读取文档，并受每个文件的行数 / 字符数 / token 预算约束，超出时采样并注明截断情况。
+    - 已卸载到 `artifact_store` 的文件按引用处理：缓存键取自引用中的摘要，解析时通过内存映射读取磁盘文件。
+
+    该版本在调用线程中同步解析；在事件循环中运行时请使用 `read_files_as_text_callback_async`。
     """
     if not llm_request.contents:
         return
 
+    session_id, invocation_id = _context_ids(callback_context)
     for content in llm_request.contents:
         if content.role != "user":
             continue
 
         new_parts = []
         for part in content.parts:
-            # 检查这是否是一个包含文件数据的 part
-            if not (part.inline_data and part.inline_data.data):
-                new_parts.append(part)
-                continue
-
-            mime_type = part.inline_data.mime_type or ""
-
-            # 如果文件类型是原生支持的（图片、视频、PDF），则直接跳过，保留原始part
-            if any(mime_type.startswith(prefix) for prefix in NATIVELY_SUPPORTED_MIME_PREFIXES):
+            job = _plan_job(part)
+            if job is None:
                 new_parts.append(part)
                 continue
 
             # --- 进入我们的文件处理逻辑 ---
-            text_content = None
-            file_name = part.inline_data.display_name or "uploaded_file"
-            
             try:
-                # 结合MIME类型和文件名后缀进行判断
-                file_ext = os.path.splitext(file_name)[1].lower()
-
-                # 1. 处理 Word (.docx)
-                if mime_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document" or file_ext == ".docx":
-                    document = docx.Document(io.BytesIO(part.inline_data.data))
-                    text_content = "\n".join([p.text for p in document.paragraphs])
-                # 2. 处理 Excel (.xlsx)
-                elif mime_type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" or file_ext == ".xlsx":
-                    workbook = openpyxl.load_workbook(io.BytesIO(part.inline_data.data))
-                    full_text = [f"--- 工作表: {name} ---\n" + "\n".join("\t".join(str(cell.value) if cell.value is not None else "" for cell in row) for row in workbook[name].iter_rows()) for name in workbook.sheetnames]
-                    text_content = "\n\n".join(full_text)
-                # 3. 处理 PowerPoint (.pptx)
-                elif mime_type == "application/vnd.openxmlformats-officedocument.presentationml.presentation" or file_ext == ".pptx":
-                    presentation = pptx.Presentation(io.BytesIO(part.inline_data.data))
-                    full_text = [f"--- 幻灯片 {i+1} ---\n" + "\n".join(shape.text_frame.text for shape in slide.shapes if hasattr(shape, "text_frame") and shape.text_frame) for i, slide in enumerate(presentation.slides)]
-                    text_content = "\n\n".join(full_text)
-                # 4. 如果不是Office文档，则一律尝试作为文本文件解码
-                else:
-                    text_content = part.inline_data.data.decode("utf-8")
-
-                if text_content is not None:
-                    formatted_text = (
-                        f"用户上传了文件 '{file_name}' (MIME类型: '{mime_type}'), 其提取出的文本内容如下:\n--- 文件开始 ---\n"
-                        f"{text_content}\n--- 文件结束 ---"
-                    )
-                    new_parts.append(types.Part(text=formatted_text))
-                else:
-                    raise ValueError("未能从文件中提取任何文本内容")
-
+                text_content = extraction_cache.get_or_compute(
+                    job.cache_key, lambda: _timed_extract(job, session_id, invocation_id)
+                )
+                new_parts.extend(_render_job(job, text_content, None))
             except Exception as e:
-                error_message = f"无法自动读取文件 '{file_name}' 的内容 (MIME类型: {mime_type})，错误: {e}。请基于文件名进行推断，或告知用户无法处理此文件。"
+                new_parts.extend(_render_job(job, None, e))
+
+        content.parts = new_parts
+
+
+async def read_files_as_text_callback_async(
+    callback_context: callback_context, llm_request: LlmRequest
+):
+    """
+    `read_files_as_text_callback` 的异步版本。
+
+    文档解析被发送到有界的工作池中执行，不会阻塞事件循环；同一次请求中的多个文件并发解析。
+    每个文件有独立的超时时间，排队过深时新文件会被拒绝并以错误提示的形式告知模型。
+    """
+    if not llm_request.contents:
+        return
+
+    plans = []
+    jobs_by_key: dict[str, _ExtractionJob] = {}
+    for content in llm_request.contents:
+        if content.role != "user":
+            continue
+        content_jobs = [_plan_job(part) for part in content.parts]
+        plans.append((content, content_jobs))
+        for job in content_jobs:
+            if job is not None:
+                jobs_by_key.setdefault(job.cache_key, job)
+
+    session_id, invocation_id = _context_ids(callback_context)
+
+    async def _timed_extract_async(job: _ExtractionJob) -> str:
+        # 只在缓存未命中、真正解析文件时计时；耗时包含在工作池中的排队时间
+        start = time.perf_counter()
+        try:
+            text = await job.extract_async()
+        except Exception as e:
+            telemetry.record_extraction(job.kind, job.size, time.perf_counter() - start,
+                                        session_id, invocation_id, error=e)
+            raise
+        telemetry.record_extraction(job.kind, job.size, time.perf_counter() - start,
+                                    session_id, invocation_id)
+        return text
+
+    async def _extract(job: _ExtractionJob) -> str:
+        return await extraction_cache.get_or_compute_async(job.cache_key, lambda: _timed_extract_async(job))
+
+    keys = list(jobs_by_key)
+    outcomes = await asyncio.gather(
+        *(_extract(jobs_by_key[key]) for key in keys), return_exceptions=True
+    )
+    results = dict(zip(keys, outcomes))
+
+    for content, content_jobs in plans:
+        new_parts = []
+        for part, job in zip(content.parts, content_jobs):
+            if job is None:
                 new_parts.append(part)
-                new_parts.append(types.Part(text=error_message))
-        
-        content.parts = new_parts
\ No newline at end of file
+                continue
+            outcome = results[job.cache_key]
+            if isinstance(outcome, asyncio.CancelledError):
+                raise outcome
+            if isinstance(outcome, BaseException):
+                new_parts.extend(_render_job(job, None, outcome))
+            else:
+                new_parts.extend(_render_job(job, outcome, None))
+        content.parts = new_parts
@@ -0,0 +1,114 @@
+"""
+所有代理共享的 MCP 客户端。
+
+此前主代理和三个子代理各自创建一个 `McpToolset`，指向同一个 MCP 服务器，
+每个实例都会单独建立连接、握手并列出工具。这里改为进程内只保留一个工具集实例：
+
+- 连接复用：所有代理共用同一个 MCP 会话及其底层 HTTP keep-alive 客户端，
+  主代理转交给子代理时不会重新握手。
+- 并发上限：对同一 MCP 服务器的工具调用并发数受 `MCP_MAX_CONCURRENCY` 限制。
+- 工具列表缓存：`tools/list` 的结果在 `MCP_TOOL_LIST_TTL_S` 秒内复用，到期后自动刷新。
+- 预热：应用启动时调用 `warm_up_mcp()` 提前建立连接，首个用户请求无需承担握手开销。
+- 截止时间：工具调用（包括排队等待并发名额的时间）不会超过本次请求剩余的时间（见 `tools/step_budget.py`）。
+"""
+
+import asyncio
+import functools
+import weakref
+from typing import List, Optional
+
+from google.adk.agents.readonly_context import ReadonlyContext
+from google.adk.tools.base_tool import BaseTool
+from google.adk.tools.mcp_tool import StreamableHTTPConnectionParams
+from google.adk.tools.mcp_tool.mcp_toolset import McpToolset
+
+from app_config import get_env
+from logger_config import logger
+from tools.step_budget import remaining_s
+
+MCP_SERVER_URL = get_env("MCP_SERVER_URL", "https://mcp.635262140.xyz/mcp")
+MCP_MAX_CONCURRENCY = int(get_env("MCP_MAX_CONCURRENCY", 8))
+MCP_TOOL_LIST_TTL_S = float(get_env("MCP_TOOL_LIST_TTL_S", 300))
+
+
+class SharedMcpToolset(McpToolset):
+    """在多个代理之间共享的 `McpToolset`，额外限制工具调用的并发数。"""
+
+    def __init__(self, *, max_concurrency: int, **kwargs):
+        super().__init__(**kwargs)
+        self._max_concurrency = max_concurrency
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # 信号量与事件循环绑定；批处理等场景可能在不同的事件循环中复用本工具集
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self._max_concurrency)
+            self._semaphores[loop] = semaphore
+        return semaphore
+
+    def _limit(self, tool: BaseTool) -> BaseTool:
+        if getattr(tool, "_shared_mcp_limited", False):
+            return tool
+        run_async = tool.run_async
+
+        @functools.wraps(run_async)
+        async def limited_run_async(**kwargs):
+            tool_context = kwargs.get("tool_context")
+            remaining = remaining_s(tool_context.state) if tool_context is not None else None
+            if remaining is None:
+                async with self._semaphore():
+                    return await run_async(**kwargs)
+            try:
+                async with asyncio.timeout(max(remaining, 0)):
+                    async with self._semaphore():
+                        return await run_async(**kwargs)
+            except TimeoutError:
+                logger.warning(f"MCP 工具 {tool.name} 在请求截止时间前未完成，已取消")
+                return {
+                    "error": "deadline_exceeded",
+                    "message": "本次请求已到达截止时间，该工具调用已被取消，请根据已有信息给出最终答案。",
+                }
+
+        tool.run_async = limited_run_async
+        tool._shared_mcp_limited = True
+        return tool
+
+    async def get_tools(self, readonly_context: Optional[ReadonlyContext] = None) -> List[BaseTool]:
+        tools = await super().get_tools(readonly_context)
+        return [self._limit(tool) for tool in tools]
+
+
+@functools.lru_cache(maxsize=None)
+def get_mcp_toolset() -> SharedMcpToolset:
+    """返回进程内共享的 MCP 工具集；首次调用时创建（不会立即建立连接）。"""
+    # Your ADK agent connects to the remote MCP service via Streamable HTTP
+    return SharedMcpToolset(
+        connection_params=StreamableHTTPConnectionParams(
+            url=MCP_SERVER_URL,
+        ),
+        tool_list_cache_ttl_seconds=MCP_TOOL_LIST_TTL_S,
+        max_concurrency=MCP_MAX_CONCURRENCY,
+    )
+
+
+async def warm_up_mcp() -> None:
+    """建立 MCP 连接并预先拉取工具列表；失败时只记录日志，不阻止应用启动。"""
+    try:
+        tools = await get_mcp_toolset().get_tools()
+        logger.info(f"MCP 预热完成: {MCP_SERVER_URL}，共 {len(tools)} 个工具")
+    except Exception as e:
+        logger.warning(f"MCP 预热失败 ({MCP_SERVER_URL}): {e}")
+
+
+async def close_mcp() -> None:
+    """关闭共享的 MCP 会话。"""
+    if not get_mcp_toolset.cache_info().currsize:
+        return
+    try:
+        await get_mcp_toolset().close()
+    except Exception as e:
+        logger.warning(f"关闭 MCP 连接时出错: {e}")
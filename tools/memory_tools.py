@@ -4,23 +4,317 @@
 注意：ADK框架没有提供内置的“写入”工具，因为写入操作通常与Agent的具体业务逻辑紧密相关。
 因此，这里的 `save_memory_tool` 是遵循ADK官方推荐的设计模式创建的：
 定义一个函数来执行具体操作，然后使用 `FunctionTool.from_function()` 将其包装成一个工具。
+
+写入是增量、批量、异步的：
+- 每个会话记录最后一个已写入的事件，每次只提交之后新增的事件（通过 `add_events_to_memory`）；
+  写入成功后才前移该记录，放弃写入的事件会在下次保存时重新提交。
+- 不支持增量写入的记忆服务（`add_events_to_memory` 抛出 `NotImplementedError`）没有增量写入：
+  每批仍通过 `add_session_to_memory` 整体写入会话，计入 `full_sessions` 而不是 `written`。
+- 同一用户内容相同的事件只写入一次（按内容哈希去重）。
+- 工具调用只把新增事件放入后台队列并立即返回一个写入凭证；队列中的事件达到
+  `MEMORY_BATCH_SIZE` 个或等待超过 `MEMORY_FLUSH_INTERVAL_S` 秒时批量写入。
+- 应用关闭时等待正在进行的写入完成，再写入队列中剩余的事件。
 """
 
+import asyncio
+import hashlib
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+from google.adk.events.event import Event
+from google.adk.memory.base_memory_service import BaseMemoryService
 from google.adk.sessions.session import Session
 from google.adk.tools import ToolContext
 
+from app_config import get_env
+from logger_config import logger
+
+# 写入失败的批次最多重试的次数
+_MAX_ATTEMPTS = 3
+# 保留状态的写入凭证数
+_MAX_TICKETS = 4096
+
+PENDING = "pending"
+DONE = "done"
+ERROR = "error"
+
+
+def _content_hash(event: Event) -> str:
+    content = event.content.model_dump_json(exclude_none=True) if event.content else ""
+    return hashlib.sha256(f"{event.author}\n{content}".encode("utf-8")).hexdigest()
+
+
+def _delta(events: list[Event], mark: Optional[tuple[str, float]]) -> list[Event]:
+    """`mark` (事件 ID, 时间戳) 之后的事件；通常只需从末尾向前扫描新增的部分。"""
+    if mark is None:
+        return list(events)
+    last_id, last_timestamp = mark
+    for index in range(len(events) - 1, -1, -1):
+        if events[index].id == last_id:
+            return list(events[index + 1:])
+    # 已写入的事件被会话库压缩删除时，按时间戳判断
+    return [event for event in events if event.timestamp > last_timestamp]
+
+
+class _PendingGroup:
+    """一个会话等待写入的事件。"""
+
+    def __init__(self, memory_service: BaseMemoryService, session: Session, start_mark: Optional[tuple[str, float]]):
+        self.memory_service = memory_service
+        self.session = session
+        self.events: list[Event] = []
+        self.tickets: list[str] = []
+        self.attempts = 0
+        # 这些事件之前、之后的最后一个事件；写入成功且前面的事件都已写入时，已写入进度前移到 end_mark
+        self.start_mark = start_mark
+        self.end_mark = start_mark
+        # 是否通过 add_session_to_memory 整体写入
+        self.full_session = False
+
+
+class MemoryIngestQueue:
+    """
+    长期记忆的增量写入队列。
+
+    Args:
+        batch_size: 队列中的事件达到该数量时立即写入。
+        flush_interval_s: 事件在队列中等待的最长时间。
+        max_tracked_sessions: 记录写入进度的会话数上限（最久未写入的会话先被遗忘，之后整体重新提交一次）。
+        max_hashes_per_user: 每个用户保留的内容哈希数上限。
+    """
+
+    def __init__(self, batch_size: int = 64, flush_interval_s: float = 2.0,
+                 max_tracked_sessions: int = 10_000, max_hashes_per_user: int = 5_000):
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.max_tracked_sessions = max_tracked_sessions
+        self.max_hashes_per_user = max_hashes_per_user
+        # 已写入的进度 与 已放入队列的进度（写入中的事件不再重复入队）
+        self._marks: "OrderedDict[tuple, tuple[str, float]]" = OrderedDict()
+        self._queued: dict[tuple, tuple[str, float]] = {}
+        self._full_session_services: set[int] = set()
+        self._hashes: "OrderedDict[tuple, OrderedDict[str, None]]" = OrderedDict()
+        self._pending: "OrderedDict[tuple, _PendingGroup]" = OrderedDict()
+        self._pending_events = 0
+        self._tickets: "OrderedDict[str, str]" = OrderedDict()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closing = False
+        self._counters = {"enqueued": 0, "duplicates": 0, "written": 0, "batches": 0, "full_sessions": 0,
+                          "errors": 0}
+
+    @classmethod
+    def from_env(cls) -> "MemoryIngestQueue":
+        return cls(
+            batch_size=int(get_env("MEMORY_BATCH_SIZE", 64)),
+            flush_interval_s=float(get_env("MEMORY_FLUSH_INTERVAL_S", 2.0)),
+        )
+
+    # --- 入队 ---
+    def _is_new_content(self, user_key: tuple, event: Event) -> bool:
+        hashes = self._hashes.get(user_key)
+        if hashes is None:
+            hashes = self._hashes[user_key] = OrderedDict()
+            while len(self._hashes) > self.max_tracked_sessions:
+                self._hashes.popitem(last=False)
+        digest = _content_hash(event)
+        if digest in hashes:
+            hashes.move_to_end(digest)
+            return False
+        hashes[digest] = None
+        while len(hashes) > self.max_hashes_per_user:
+            hashes.popitem(last=False)
+        return True
+
+    def enqueue(self, memory_service: BaseMemoryService, session: Session) -> tuple[str, int]:
+        """把会话中尚未写入的事件放入队列，返回 (写入凭证, 新增事件数)。"""
+        session_key = (id(memory_service), session.app_name, session.user_id, session.id)
+        user_key = session_key[:3]
+        requeue = session_key not in self._queued
+        base = self._marks.get(session_key) if requeue else self._queued[session_key]
+        events = _delta(session.events, base)
+        end_mark = (events[-1].id, events[-1].timestamp) if events else base
+
+        fresh = []
+        for event in events:
+            if event.partial or not event.content or not event.content.parts:
+                continue
+            if self._is_new_content(user_key, event):
+                fresh.append(event)
+            else:
+                self._counters["duplicates"] += 1
+
+        ticket = uuid.uuid4().hex[:12]
+        self._set_ticket(ticket, DONE if not fresh else PENDING)
+        if not fresh:
+            if events and requeue and session_key not in self._pending:
+                # 没有待写入的事件，全是重复内容时直接前移已写入进度
+                self._commit_mark(session_key, end_mark)
+            return ticket, 0
+        self._queued[session_key] = end_mark
+        group = self._pending.get(session_key)
+        if group is None:
+            group = self._pending[session_key] = _PendingGroup(memory_service, session, base)
+        elif requeue:
+            # 之前的写入被放弃，这一组从已写入进度开始重新提交
+            group.start_mark = base
+        group.session = session
+        group.end_mark = end_mark
+        group.events.extend(fresh)
+        group.tickets.append(ticket)
+        self._pending_events += len(fresh)
+        self._counters["enqueued"] += len(fresh)
+        self._ensure_flusher()
+        if self._pending_events >= self.batch_size:
+            self._wakeup.set()
+        return ticket, len(fresh)
+
+    def _commit_mark(self, session_key: tuple, mark: tuple[str, float]) -> None:
+        self._marks[session_key] = mark
+        self._marks.move_to_end(session_key)
+        while len(self._marks) > self.max_tracked_sessions:
+            self._marks.popitem(last=False)
+
+    def _set_ticket(self, ticket: str, status: str) -> None:
+        self._tickets[ticket] = status
+        self._tickets.move_to_end(ticket)
+        while len(self._tickets) > _MAX_TICKETS:
+            self._tickets.popitem(last=False)
+
+    def ticket_status(self, ticket: str) -> Optional[str]:
+        return self._tickets.get(ticket)
+
+    # --- 后台写入 ---
+    def _ensure_flusher(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._wakeup, self._flusher = loop, asyncio.Event(), None
+        if self._flusher is None or self._flusher.done():
+            self._flusher = loop.create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval_s)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._pending:
+                await self.flush()
+            if self._closing:
+                return
+
+    async def _write(self, group: _PendingGroup, session_key: tuple) -> None:
+        if id(group.memory_service) not in self._full_session_services:
+            try:
+                await group.memory_service.add_events_to_memory(
+                    app_name=session_key[1], user_id=session_key[2], events=group.events, session_id=session_key[3],
+                )
+                return
+            except NotImplementedError:
+                self._full_session_services.add(id(group.memory_service))
+        # 该记忆服务只能整体写入会话
+        group.full_session = True
+        await group.memory_service.add_session_to_memory(group.session)
+
+    def _requeue(self, session_key: tuple, group: _PendingGroup) -> None:
+        """把写入未完成的一组事件放回队列，排在之后入队的同一会话事件前面。"""
+        newer = self._pending.get(session_key)
+        if newer is None:
+            self._pending[session_key] = group
+        else:
+            newer.events[:0] = group.events
+            newer.tickets[:0] = group.tickets
+            newer.attempts = group.attempts
+            newer.start_mark = group.start_mark
+        self._pending_events += len(group.events)
+
+    async def flush(self) -> None:
+        """写入队列中的全部事件；失败的会话稍后重试。"""
+        groups, self._pending, self._pending_events = self._pending, OrderedDict(), 0
+        start = time.perf_counter()
+        try:
+            results = await asyncio.gather(
+                *(self._write(group, session_key) for session_key, group in groups.items()), return_exceptions=True
+            )
+        except asyncio.CancelledError:
+            # 写入被取消时把事件放回队列，交给下一次写入
+            for session_key, group in groups.items():
+                self._requeue(session_key, group)
+            raise
+        for (session_key, group), result in zip(groups.items(), results):
+            if not isinstance(result, BaseException):
+                if group.full_session:
+                    self._counters["full_sessions"] += 1
+                else:
+                    self._counters["written"] += len(group.events)
+                if self._marks.get(session_key) == group.start_mark:
+                    self._commit_mark(session_key, group.end_mark)
+                if self._queued.get(session_key) == group.end_mark:
+                    del self._queued[session_key]
+                for ticket in group.tickets:
+                    self._set_ticket(ticket, DONE)
+                continue
+            self._counters["errors"] += 1
+            group.attempts += 1
+            if group.attempts >= _MAX_ATTEMPTS:
+                logger.error(f"写入长期记忆失败，放弃 {len(group.events)} 个事件 (会话 {session_key[3]}): {result}")
+                for ticket in group.tickets:
+                    self._set_ticket(ticket, ERROR)
+                # 已写入进度停在这些事件之前，并忘记它们的内容，以便之后再次保存时重新提交
+                self._queued.pop(session_key, None)
+                hashes = self._hashes.get(session_key[:3], {})
+                for event in group.events:
+                    hashes.pop(_content_hash(event), None)
+                continue
+            logger.warning(f"写入长期记忆失败，稍后重试 (会话 {session_key[3]}): {result}")
+            self._requeue(session_key, group)
+        self._counters["batches"] += 1
+        logger.debug(f"长期记忆批量写入 {len(groups)} 个会话，用时 {time.perf_counter() - start:.3f}s")
+
+    async def close(self) -> None:
+        """等待正在进行的写入完成，停止后台任务并写入剩余事件（应用关闭时调用）。"""
+        flusher, self._flusher = self._flusher, None
+        if flusher is not None and not flusher.done() and self._loop is asyncio.get_running_loop():
+            self._closing = True
+            self._wakeup.set()
+            try:
+                await flusher
+            finally:
+                self._closing = False
+        # 失败的会话最多再重试到 _MAX_ATTEMPTS 次
+        while self._pending:
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {**self._counters, "pending": self._pending_events, "tracked_sessions": len(self._marks)}
+
+
+memory_ingest_queue = MemoryIngestQueue.from_env()
+
+
 async def save_memory_tool(
     session: Session, tool_context: ToolContext
 ) -> str:
     """
     将session保存到长期记忆中。
 
+    只提交上次保存之后新增的事件，写入在后台批量完成，调用会立即返回。
+
     Args:
         session: 要存储的会话。
         tool_context: 工具调用上下文，由ADK自动提供。
 
     Returns:
-        一条确认信息。
+        一条包含写入凭证的确认信息。
     """
-    await tool_context._invocation_context.memory_service.add_session_to_memory(session)
-    return f"{session} 已成功保存。"
+    memory_service = tool_context._invocation_context.memory_service
+    if memory_service is None:
+        return "当前没有配置长期记忆服务，未保存。"
+    ticket, count = memory_ingest_queue.enqueue(memory_service, session)
+    if count == 0:
+        return f"{session.id} 没有需要保存的新内容 (凭证 {ticket})。"
+    return f"{session.id} 的 {count} 个新事件已加入长期记忆写入队列 (凭证 {ticket})。"
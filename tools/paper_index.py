@@ -0,0 +1,492 @@
+"""
+上传论文的本地检索索引。
+
+PaperAnalyzeAgent 和 ExperimentDesignAgent 原本在每一个 ReAct 步骤中都会拿到整篇论文：
+PDF 作为原生文件原样交给模型，Word 文档的全文被整体放进提示词。
+综述、补充材料这类长文档会很快撑满上下文，也拖慢每一次模型调用。
+
+本模块在上传时按页（PDF、幻灯片）或按节（Word / Markdown 标题）读取文档、切分为片段，
+并在进程内建立 BM25 倒排索引，不依赖任何外部服务：
+- `PaperIndexPlugin` 在用户消息写入会话后立即在后台为其中的文档建立索引；
+- `index_papers_callback_async` 在模型调用前把已建立索引的长文档替换为简短的摘要说明；
+- 代理通过 `search_uploaded_papers` 工具按需检索与当前步骤相关的段落。
+
+索引以文件内容的 SHA-256 摘要为键保存在磁盘上（默认位于 `artifact_store` 目录下的 `index/`，
+随上传文件一起按保留期清理），会话中的后续轮次、其他工作进程以及论文并行分析的子会话都直接复用，
+同一个文件只解析一次。
+"""
+
+import asyncio
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from typing import Optional
+
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.plugins.base_plugin import BasePlugin
+from google.adk.tools import ToolContext
+from google.genai import types
+
+from app_config import get_env
+from logger_config import logger
+from tools.artifact_store import ArtifactNotFound, artifact_store, iter_uploaded_files, parse_ref
+from tools.document_extractors import DOCX_MIME_TYPE, PDF_MIME_TYPE, PPTX_MIME_TYPE, read_sections_from_file
+from tools.file_reader_tool import extraction_pool
+
+# 索引格式或切分逻辑发生变化时递增此版本号，旧的索引文件不再被使用
+INDEX_VERSION = "1"
+
+# 每个片段的目标字符数
+CHUNK_CHARS = int(get_env("PAPER_INDEX_CHUNK_CHARS", 1200))
+# 单个文件最多索引的字符数
+MAX_INDEX_CHARS = int(get_env("PAPER_INDEX_MAX_CHARS", 2_000_000))
+# 文本不超过该字符数的文档仍然整体放入上下文，不替换为摘要说明
+INLINE_CHARS = int(get_env("PAPER_INDEX_INLINE_CHARS", 12_000))
+# 摘要说明中保留的开头部分字符数
+PREVIEW_CHARS = int(get_env("PAPER_INDEX_PREVIEW_CHARS", 600))
+# 单次检索最多返回的片段数
+MAX_TOP_K = 10
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TEXT_EXTENSIONS = (".txt", ".md", ".markdown", ".rst", ".tex")
+_KIND_BY_MIME = {PDF_MIME_TYPE: "pdf", DOCX_MIME_TYPE: "docx", PPTX_MIME_TYPE: "pptx"}
+_KIND_BY_EXTENSION = {".pdf": "pdf", ".docx": "docx", ".pptx": "pptx", **{ext: "text" for ext in _TEXT_EXTENSIONS}}
+_UNIT_NAMES = {"pdf": "页", "pptx": "张幻灯片"}
+
+
+def paper_kind(mime_type: str, file_name: str) -> Optional[str]:
+    """判断文件是否是可以建立检索索引的文档（pdf / docx / pptx / text），不是时返回 None。"""
+    kind = _KIND_BY_MIME.get(mime_type) or _KIND_BY_EXTENSION.get(os.path.splitext(file_name)[1].lower())
+    if kind:
+        return kind
+    if mime_type in ("text/plain", "text/markdown"):
+        return "text"
+    return None
+
+
+# --- 分词：英文按单词（小写、去停用词、去复数 s），中文按相邻两字 ---
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[\u3400-\u4dbf\u4e00-\u9fff]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from in into is it of on or that the this to was were with".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        word = match.group()
+        if word[0] >= "\u3400":
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        elif word not in _STOPWORDS and (len(word) > 1 or word.isdigit()):
+            if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+                word = word[:-1]
+            tokens.append(word)
+    return tokens
+
+
+def chunk_sections(sections: list[tuple[str, str]], chunk_chars: int) -> list[tuple[str, str]]:
+    """
+    把 (位置, 文本) 形式的各页 / 各节按段落切分为不超过 `chunk_chars` 的片段。
+
+    片段不跨页 / 跨节，一页被切成多个片段时位置标注为 “第 3 页 (2/4)”。
+    """
+    chunks = []
+    for location, text in sections:
+        pieces, current, size = [], [], 0
+        for paragraph in text.split("\n"):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            # 超长段落（例如没有换行的 PDF 页面）按固定长度硬切
+            while len(paragraph) > chunk_chars:
+                if current:
+                    pieces.append("\n".join(current))
+                    current, size = [], 0
+                pieces.append(paragraph[:chunk_chars])
+                paragraph = paragraph[chunk_chars:]
+            if current and size + len(paragraph) > chunk_chars:
+                pieces.append("\n".join(current))
+                current, size = [], 0
+            current.append(paragraph)
+            size += len(paragraph) + 1
+        if current:
+            pieces.append("\n".join(current))
+        for i, piece in enumerate(pieces):
+            label = location if len(pieces) == 1 else f"{location} ({i + 1}/{len(pieces)})"
+            chunks.append((label, piece))
+    return chunks
+
+
+def build_chunks(path: str, kind: str, chunk_chars: int, max_chars: int) -> tuple[int, list[tuple[str, str]]]:
+    """读取并切分磁盘上的文档，返回 (页数 / 节数, 片段列表)。在解析工作池中执行。"""
+    sections = read_sections_from_file(path, kind, max_chars)
+    return len(sections), chunk_sections(sections, chunk_chars)
+
+
+class PaperIndex:
+    """
+    一个文档的 BM25 倒排索引。
+
+    Args:
+        digest: 文件内容的 SHA-256 摘要。
+        kind: 文档类型（pdf / docx / pptx / text）。
+        section_count: 页数或节数。
+        chunks: (位置, 文本) 形式的片段列表。
+    """
+
+    def __init__(self, digest: str, kind: str, section_count: int, chunks: list[tuple[str, str]]):
+        self.digest = digest
+        self.kind = kind
+        self.section_count = section_count
+        self.chunks = chunks
+        self.chars = sum(len(text) for _, text in chunks)
+        self.lengths: list[int] = []
+        self.postings: dict[str, list[tuple[int, int]]] = {}
+        for chunk_id, (location, text) in enumerate(chunks):
+            counts = Counter(tokenize(f"{location}\n{text}"))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings.setdefault(term, []).append((chunk_id, tf))
+
+    def describe(self) -> str:
+        return f"{self.section_count} {_UNIT_NAMES.get(self.kind, '节')}，共 {len(self.chunks)} 个片段，约 {self.chars} 字"
+
+    def preview(self, max_chars: int) -> str:
+        pieces, size = [], 0
+        for _, text in self.chunks:
+            if size >= max_chars:
+                break
+            pieces.append(text[: max_chars - size])
+            size += len(pieces[-1])
+        return "\n".join(pieces)
+
+    def to_dict(self) -> dict:
+        # 倒排表在加载时由片段重新计算，文件中只保存片段本身
+        return {
+            "version": INDEX_VERSION,
+            "digest": self.digest,
+            "kind": self.kind,
+            "section_count": self.section_count,
+            "chunks": self.chunks,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> Optional["PaperIndex"]:
+        if data.get("version") != INDEX_VERSION:
+            return None
+        return cls(data["digest"], data["kind"], data["section_count"], [tuple(c) for c in data["chunks"]])
+
+
+def search(indexes: list[tuple[str, PaperIndex]], query: str, top_k: int) -> list[dict]:
+    """
+    在多个文档上做 BM25 检索，返回得分最高的 `top_k` 个片段。
+
+    文档频率和平均片段长度按全部文档合并计算，不同文档的得分可以直接比较。
+    """
+    terms = set(tokenize(query))
+    total_chunks = sum(len(index.chunks) for _, index in indexes)
+    if not terms or not total_chunks:
+        return []
+    avg_length = sum(sum(index.lengths) for _, index in indexes) / total_chunks or 1.0
+
+    scores: dict[tuple[int, int], float] = defaultdict(float)
+    for term in terms:
+        df = sum(len(index.postings.get(term, ())) for _, index in indexes)
+        if not df:
+            continue
+        idf = math.log(1 + (total_chunks - df + 0.5) / (df + 0.5))
+        for doc_id, (_, index) in enumerate(indexes):
+            for chunk_id, tf in index.postings.get(term, ()):
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * index.lengths[chunk_id] / avg_length)
+                scores[doc_id, chunk_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+    best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+    results = []
+    for (doc_id, chunk_id), score in best:
+        name, index = indexes[doc_id]
+        location, text = index.chunks[chunk_id]
+        results.append({"file_name": name, "location": location, "score": round(score, 3), "text": text})
+    return results
+
+
+class PaperIndexStore:
+    """
+    以文件摘要为键的索引存储：内存 LRU + 磁盘上的 JSON 文件。
+
+    同一个文件的并发建索引请求会合并为一次解析。
+
+    Args:
+        root_dir: 索引文件目录。
+        max_cached: 内存中最多保留的索引数。
+    """
+
+    def __init__(self, root_dir: str, max_cached: int = 16):
+        self.root_dir = root_dir
+        self.max_cached = max_cached
+        self._cache: "OrderedDict[str, PaperIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._background: set[asyncio.Task] = set()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "builds": 0, "failures": 0, "stubbed": 0, "searches": 0}
+
+    @classmethod
+    def from_env(cls) -> "PaperIndexStore":
+        return cls(
+            root_dir=get_env("PAPER_INDEX_DIR", os.path.join(artifact_store.root_dir, "index")),
+            max_cached=int(get_env("PAPER_INDEX_CACHE_SIZE", 16)),
+        )
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root_dir, f"{digest}.c{CHUNK_CHARS}.v{INDEX_VERSION}.json")
+
+    def _remember(self, index: PaperIndex) -> None:
+        with self._lock:
+            self._cache[index.digest] = index
+            self._cache.move_to_end(index.digest)
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+
+    def _cached(self, digest: str) -> Optional[PaperIndex]:
+        with self._lock:
+            index = self._cache.get(digest)
+            if index is not None:
+                self._cache.move_to_end(digest)
+                self._counters["memory_hits"] += 1
+            return index
+
+    def _load(self, digest: str) -> Optional[PaperIndex]:
+        try:
+            with open(self.path(digest), encoding="utf-8") as f:
+                index = PaperIndex.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning(f"读取索引文件失败，将重新建立: {e}")
+            return None
+        if index is not None:
+            self._count("disk_hits")
+        return index
+
+    def _save(self, index: PaperIndex) -> None:
+        path = self.path(index.digest)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(self.root_dir, exist_ok=True)
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(index.to_dict(), f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入索引文件失败，索引仅保留在内存中: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    async def _load_or_build(self, digest: str, kind: str) -> PaperIndex:
+        index = await asyncio.to_thread(self._load, digest)
+        if index is None:
+            if not artifact_store.exists(digest):
+                raise ArtifactNotFound(f"文件 {digest[:16]} 已不在存储中（可能已过期被清理）")
+            start = time.perf_counter()
+            section_count, chunks = await extraction_pool.submit(
+                artifact_store.size(digest), kind, build_chunks,
+                artifact_store.path(digest), kind, CHUNK_CHARS, MAX_INDEX_CHARS,
+            )
+            index = PaperIndex(digest, kind, section_count, chunks)
+            await asyncio.to_thread(self._save, index)
+            self._count("builds")
+            logger.info(
+                f"已为 {kind} 文件 {digest[:12]} 建立检索索引: {index.describe()}，"
+                f"耗时 {time.perf_counter() - start:.2f}s"
+            )
+        self._remember(index)
+        return index
+
+    async def ensure(self, digest: str, kind: str) -> PaperIndex:
+        """返回文件的索引；内存和磁盘中都没有时在解析工作池中建立。"""
+        index = self._cached(digest)
+        if index is not None:
+            return index
+        future = self._inflight.get(digest)
+        if future is None:
+            future = asyncio.ensure_future(self._load_or_build(digest, kind))
+            self._inflight[digest] = future
+            future.add_done_callback(lambda _: self._inflight.pop(digest, None))
+        try:
+            # 调用方被取消时不取消共享的建索引任务
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._count("failures")
+            raise
+
+    def prefetch(self, digest: str, kind: str) -> None:
+        """在后台为文件建立索引，不等待结果。"""
+        if self._cached(digest) is not None:
+            return
+
+        async def _run():
+            try:
+                await self.ensure(digest, kind)
+            except Exception as e:
+                logger.warning(f"后台建立检索索引失败 ({digest[:12]}): {e}")
+
+        task = asyncio.create_task(_run())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counters, "cached": len(self._cache), "building": len(self._inflight)}
+
+
+paper_index_store = PaperIndexStore.from_env()
+
+
+def _indexable(part: types.Part) -> Optional[tuple[str, str]]:
+    """如果 part 是已卸载到文件存储、可以建立索引的文档，返回 (摘要, 文档类型)。"""
+    digest = parse_ref(part)
+    if not digest:
+        return None
+    kind = paper_kind(part.file_data.mime_type or "", part.file_data.display_name or "")
+    return (digest, kind) if kind else None
+
+
+class PaperIndexPlugin(BasePlugin):
+    """用户消息写入会话后，立即在后台为其中上传的文档建立检索索引。"""
+
+    def __init__(self, name: str = "paper_index", store: Optional[PaperIndexStore] = None):
+        super().__init__(name)
+        self.store = store or paper_index_store
+
+    async def before_run_callback(self, *, invocation_context: InvocationContext) -> Optional[types.Content]:
+        # 此时用户消息已经过 ArtifactOffloadPlugin 处理，文件以引用的形式出现
+        content = invocation_context.user_content
+        for part in (content.parts or []) if content else []:
+            target = _indexable(part)
+            if target:
+                self.store.prefetch(*target)
+        return None
+
+
+paper_index_plugin = PaperIndexPlugin()
+
+
+async def index_papers_callback_async(callback_context, llm_request):
+    """
+    一个“模型调用前”回调：把请求中已建立索引的长文档替换为简短的摘要说明
+    （页数、片段数和开头部分），由代理通过 `search_uploaded_papers` 按需检索具体段落。
+
+    需要排在 `read_files_as_text_callback_async` 之前。文本不超过 `PAPER_INDEX_INLINE_CHARS`
+    的短文档、以及无法建立索引的文件（例如没有文字层的扫描版 PDF）保持原样，交给后续回调处理。
+    """
+    if not llm_request.contents:
+        return
+    targets = {
+        target
+        for content in llm_request.contents
+        if content.role == "user"
+        for part in content.parts or []
+        if (target := _indexable(part))
+    }
+    if not targets:
+        return
+
+    async def _ensure(digest: str, kind: str):
+        try:
+            return await paper_index_store.ensure(digest, kind)
+        except Exception as e:
+            logger.warning(f"文档 {digest[:12]} 无法建立检索索引，保留原始文件: {e}")
+            return None
+
+    keys = list(targets)
+    indexes = dict(zip(keys, await asyncio.gather(*(_ensure(*target) for target in keys))))
+
+    for content in llm_request.contents:
+        if content.role != "user":
+            continue
+        new_parts = []
+        for part in content.parts or []:
+            target = _indexable(part)
+            index = indexes.get(target) if target else None
+            if index is None or index.chars <= INLINE_CHARS:
+                new_parts.append(part)
+                continue
+            paper_index_store._count("stubbed")
+            name = part.file_data.display_name or "uploaded_file"
+            new_parts.append(types.Part(text=(
+                f"用户上传了文件 '{name}' ({index.describe()})。全文已建立本地检索索引，为节省上下文没有整体放入对话。\n"
+                f"--- 开头部分 ---\n{index.preview(PREVIEW_CHARS)}\n--- 开头部分结束 ---\n"
+                f"需要文中的具体内容时，请调用 `search_uploaded_papers` 工具检索相关段落，引用时注明页码或章节。"
+            )))
+        content.parts = new_parts
+
+
+async def search_uploaded_papers(
+    query: str, tool_context: ToolContext, file_name: str = "", top_k: int = 5
+) -> dict:
+    """
+    在用户上传的论文和文档（PDF、Word、PPT、Markdown / 文本）中检索与问题相关的段落。
+
+    长文档不会整体出现在对话中；需要方法细节、实验条件、数据或结论时，用具体的关键词检索，
+    每次只取回最相关的几个段落。可以多次调用，用不同的关键词（中英文术语均可）检索不同方面。
+
+    Args:
+        query: 检索关键词或问题，例如 "DNA origami assembly buffer Mg2+ 浓度"。
+        file_name: 可选，只在指定的文件中检索，例如 "paper.pdf"；留空时检索所有上传的文档。
+        top_k: 返回的段落数，默认 5，最多 10。
+
+    Returns:
+        包含 passages 列表的结果，每个段落带有 file_name、location（页码或章节）、score 和 text。
+    """
+    wanted = os.path.basename(file_name.strip()).lower()
+    papers, available = [], []
+    for part, digest in iter_uploaded_files(tool_context):
+        target = _indexable(part)
+        if not target:
+            continue
+        name = part.file_data.display_name or "uploaded_file"
+        available.append(name)
+        if not wanted or name.lower() == wanted:
+            papers.append((name, target))
+    if not papers:
+        if available:
+            return {"status": "error", "message": f"没有找到名为 '{file_name}' 的文档，可检索的文档: {available}"}
+        return {"status": "error", "message": "对话中没有可检索的上传文档。"}
+
+    outcomes = await asyncio.gather(
+        *(paper_index_store.ensure(*target) for _, target in papers), return_exceptions=True
+    )
+    indexes, failed = [], []
+    for (name, _), outcome in zip(papers, outcomes):
+        if isinstance(outcome, asyncio.CancelledError):
+            raise outcome
+        if isinstance(outcome, BaseException):
+            failed.append(f"{name}: {outcome}")
+        else:
+            indexes.append((name, outcome))
+    if not indexes:
+        return {"status": "error", "message": f"文档无法建立检索索引: {failed}"}
+
+    paper_index_store._count("searches")
+    passages = search(indexes, query, min(max(int(top_k), 1), MAX_TOP_K))
+    result = {"status": "success", "query": query, "searched_files": [name for name, _ in indexes], "passages": passages}
+    if failed:
+        result["failed_files"] = failed
+    if not passages:
+        result["message"] = "没有找到与查询相关的段落，请换用其他关键词重试。"
+    return result
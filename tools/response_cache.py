@@ -0,0 +1,331 @@
+"""
+子代理级别的回复缓存（可选，`AGENT_RESPONSE_CACHE=1` 开启）。
+
+很多用户提交的研究课题几乎相同（例如同一个 DNA 传感器的设计问题），
+ExperimentDesignAgent / PaperAnalyzeAgent 每次都会重新走一遍完整的 ReAct 检索循环。
+
+本模块通过子代理的 `before_agent_callback` / `after_agent_callback` 接入：
+- 缓存键由四部分组成：规范化后的用户问题、附带文件的摘要、该代理 `SYSTEM_PROMPT` 的哈希
+  （提示词版本），以及知识库版本（`KB_VERSION` 环境变量 + 缓存库中的版本号）。
+- 问题完全相同时直接命中。问题规范化时忽略空白和标点，但数字、单位和拉丁字母 / 编号
+  （例如 `1.5 fM`、`microRNA-21`）原样保留，不忽略大小写。
+- 近似匹配默认关闭（`AGENT_CACHE_SIMILARITY=1`）。调低该阈值后，在同一范围（代理、提示词、文件、
+  知识库版本都相同）内按字符二元组的 Jaccard 相似度查找近似重复的问题；只有数字、单位和
+  拉丁字母 / 编号完全相同、且相似度不低于阈值时才视为命中，避免把 1 fM 的设计返回给 1 pM 的请求。
+- 命中时跳过整个代理，直接返回保存的报告。
+- 只缓存会话中的第一轮请求（之后的请求可能依赖对话上下文），触发了步数 / 时间预算或工具调用出错的
+  运行结果不会被缓存。
+- 数据保存在本地 SQLite 文件中，多个工作进程共享；条目按 TTL 过期，并按最近使用时间淘汰。
+  知识库重建索引（`/knowledge-base/invalidate`）时缓存库中的版本号递增，所有进程立即不再使用旧条目。
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from google.adk.agents.callback_context import CallbackContext
+from google.genai import types
+
+from app_config import get_env
+from logger_config import logger
+from telemetry import telemetry
+from tools.artifact_store import parse_ref
+
+_PUNCTUATION_RE = re.compile(r"[\s\W_]+", re.UNICODE)
+# 数字、单位和拉丁字母 / 编号，例如 1.5、fM、microRNA-21、Fe3O4、pH7.4
+_KEY_TOKEN_RE = re.compile(r"[0-9A-Za-zµμ]+(?:[.\-+/][0-9A-Za-zµμ]+)*")
+
+# 近似匹配时每个范围内最多比较的条目数（按最近使用排序）
+_MAX_CANDIDATES = 500
+
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS responses (
+    scope TEXT NOT NULL,
+    query TEXT NOT NULL,
+    response TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (scope, query)
+);
+CREATE INDEX IF NOT EXISTS idx_responses_scope_used ON responses (scope, last_used);
+CREATE INDEX IF NOT EXISTS idx_responses_used ON responses (last_used);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+
+def normalize_query(text: str) -> str:
+    """忽略空白和标点；数字、单位和拉丁字母 / 编号原样保留，相邻的两个以空格分隔。"""
+    pieces: list[str] = []
+    last = 0
+    for match in _KEY_TOKEN_RE.finditer(text):
+        gap = _PUNCTUATION_RE.sub("", text[last:match.start()].casefold())
+        if pieces and not gap:
+            gap = " "
+        pieces += [gap, match.group()]
+        last = match.end()
+    pieces.append(_PUNCTUATION_RE.sub("", text[last:].casefold()))
+    return "".join(pieces).strip()
+
+
+def key_tokens(query: str) -> list[str]:
+    """规范化问题中的数字、单位和拉丁字母 / 编号，近似匹配时必须完全相同。"""
+    return sorted(_KEY_TOKEN_RE.findall(query))
+
+
+def _shingles(text: str) -> set[str]:
+    if len(text) < 2:
+        return {text}
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def similarity(a: str, b: str) -> float:
+    """两个规范化问题的字符二元组 Jaccard 相似度。"""
+    sa, sb = _shingles(a), _shingles(b)
+    return len(sa & sb) / len(sa | sb) if sa or sb else 1.0
+
+
+def prompt_version(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+class AgentResponseCache:
+    """
+    保存在本地 SQLite 文件中的代理回复缓存。
+
+    Args:
+        path: 缓存库文件路径。
+        enabled: 是否启用；关闭时回调直接返回，不会创建缓存库。
+        ttl_s: 条目存活时间（秒）。
+        max_entries: 最多保留的条目数，超出时淘汰最久未使用的条目。
+        similarity_threshold: 近似命中的最低相似度，1（默认）表示只接受完全相同的问题。
+        kb_tag: 部署时指定的知识库版本标签。
+    """
+
+    def __init__(self, path: str, enabled: bool = False, ttl_s: float = 7 * 24 * 3600,
+                 max_entries: int = 2000, similarity_threshold: float = 1.0, kb_tag: str = ""):
+        self.path = path
+        self.enabled = enabled
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.kb_tag = kb_tag
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "near_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "skipped": 0}
+
+    @classmethod
+    def from_env(cls) -> "AgentResponseCache":
+        return cls(
+            path=get_env("AGENT_CACHE_PATH", "./.cache/agent_responses.db"),
+            enabled=get_env("AGENT_RESPONSE_CACHE", "0") == "1",
+            ttl_s=float(get_env("AGENT_CACHE_TTL_S", 7 * 24 * 3600)),
+            max_entries=int(get_env("AGENT_CACHE_MAX_ENTRIES", 2000)),
+            similarity_threshold=float(get_env("AGENT_CACHE_SIMILARITY", 1.0)),
+            kb_tag=get_env("KB_VERSION", ""),
+        )
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def _db(self) -> sqlite3.Connection:
+        # 调用方持有 self._lock
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.executescript(_SCHEMA_SQL)
+            self._conn = conn
+        return self._conn
+
+    def kb_version(self) -> str:
+        with self._lock:
+            row = self._db().execute("SELECT value FROM meta WHERE key = 'kb_version'").fetchone()
+        return f"{self.kb_tag}:{row[0] if row else 0}"
+
+    def bump_kb_version(self) -> str:
+        """知识库更新后调用：所有旧条目不再命中，并清除它们。"""
+        if not self.enabled:
+            return ""
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT INTO meta (key, value) VALUES ('kb_version', 1) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+            )
+            db.execute("DELETE FROM responses")
+        version = self.kb_version()
+        logger.info(f"代理回复缓存已失效 (kb_version={version})")
+        return version
+
+    def lookup(self, scope: str, query: str) -> Optional[tuple[str, float]]:
+        """返回 (保存的回复, 相似度)；没有命中时返回 None。"""
+        now = time.time()
+        cutoff = now - self.ttl_s
+        with self._lock:
+            db = self._db()
+            row = db.execute(
+                "SELECT response FROM responses WHERE scope = ? AND query = ? AND created_at >= ?",
+                (scope, query, cutoff),
+            ).fetchone()
+            if row is not None:
+                db.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE scope = ? AND query = ?",
+                           (now, scope, query))
+                self._counters["hits"] += 1
+                return row[0], 1.0
+            if self.similarity_threshold >= 1:
+                self._counters["misses"] += 1
+                return None
+            candidates = db.execute(
+                "SELECT query, response FROM responses WHERE scope = ? AND created_at >= ? "
+                "ORDER BY last_used DESC LIMIT ?",
+                (scope, cutoff, _MAX_CANDIDATES),
+            ).fetchall()
+            tokens = key_tokens(query)
+            best = max(
+                ((similarity(query, q), q, r) for q, r in candidates if key_tokens(q) == tokens), default=None
+            )
+            if best is None or best[0] < self.similarity_threshold:
+                self._counters["misses"] += 1
+                return None
+            score, matched, response = best
+            db.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE scope = ? AND query = ?",
+                       (now, scope, matched))
+            self._counters["near_hits"] += 1
+            return response, score
+
+    def store(self, scope: str, query: str, response: str) -> None:
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO responses (scope, query, response, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (scope, query, response, now, now),
+            )
+            expired = db.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_s,)).rowcount
+            overflow = db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                db.execute(
+                    "DELETE FROM responses WHERE rowid IN "
+                    "(SELECT rowid FROM responses ORDER BY last_used LIMIT ?)",
+                    (overflow,),
+                )
+            self._counters["stores"] += 1
+            self._counters["evictions"] += max(expired, 0) + max(overflow, 0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counters, "enabled": int(self.enabled)}
+
+    def for_prompt(self, prompt: str) -> "_AgentCacheCallbacks":
+        """返回挂载到某个代理上的回调；`prompt` 为该代理的系统提示词，用于区分提示词版本。"""
+        return _AgentCacheCallbacks(self, prompt_version(prompt))
+
+
+agent_response_cache = AgentResponseCache.from_env()
+
+
+def _request_query(callback_context: CallbackContext) -> Optional[str]:
+    """本次请求规范化后的问题；没有文字内容时返回 None。"""
+    content = callback_context.user_content
+    text = " ".join(part.text for part in (content.parts or []) if part.text) if content else ""
+    query = normalize_query(text)
+    return query or None
+
+
+def _files_hash(callback_context: CallbackContext) -> str:
+    content = callback_context.user_content
+    digests = []
+    for part in (content.parts or []) if content else []:
+        digest = parse_ref(part)
+        if digest is None and part.inline_data and part.inline_data.data:
+            digest = hashlib.sha256(part.inline_data.data).hexdigest()
+        if digest:
+            digests.append(digest)
+    return hashlib.sha256("\n".join(sorted(digests)).encode()).hexdigest()[:16] if digests else "-"
+
+
+def _is_first_turn(callback_context: CallbackContext) -> bool:
+    invocation_id = callback_context.invocation_id
+    return not any(
+        event.author == "user" and event.invocation_id != invocation_id
+        for event in callback_context.session.events
+    )
+
+
+def _final_report(callback_context: CallbackContext) -> Optional[str]:
+    """
+    该代理在本次调用中给出的最终报告；运行过程中有工具调用出错或触发了预算时返回 None，不予缓存。
+    """
+    invocation_id, agent_name = callback_context.invocation_id, callback_context.agent_name
+    if any(key.startswith(f"temp:step_budget:{agent_name}:triggered:") for key in callback_context.state.to_dict()):
+        return None
+    report = None
+    for event in callback_context.session.events:
+        if event.invocation_id != invocation_id or event.author != agent_name or not event.content:
+            continue
+        for part in event.content.parts or []:
+            response = part.function_response.response if part.function_response else None
+            if isinstance(response, dict) and (response.get("error") or response.get("isError")
+                                               or response.get("status") == "error"):
+                return None
+        if event.is_final_response():
+            text = "".join(part.text for part in event.content.parts or [] if part.text and not part.thought)
+            report = text or report
+    return report
+
+
+class _AgentCacheCallbacks:
+    """一个代理的缓存回调：`before_agent_callback` 需排在 `telemetry.before_agent_callback` 之前。"""
+
+    def __init__(self, cache: AgentResponseCache, prompt_hash: str):
+        self.cache = cache
+        self.prompt_hash = prompt_hash
+
+    async def _key(self, callback_context: CallbackContext) -> Optional[tuple[str, str]]:
+        if not self.cache.enabled or not _is_first_turn(callback_context):
+            return None
+        query = _request_query(callback_context)
+        if query is None:
+            return None
+        kb_version = await asyncio.to_thread(self.cache.kb_version)
+        scope = f"{callback_context.agent_name}|{self.prompt_hash}|{_files_hash(callback_context)}|{kb_version}"
+        return scope, query
+
+    async def before_agent_callback(self, callback_context: CallbackContext) -> Optional[types.Content]:
+        """命中缓存时直接返回保存的报告，跳过整个代理。"""
+        start = time.perf_counter()
+        try:
+            key = await self._key(callback_context)
+            found = await asyncio.to_thread(self.cache.lookup, *key) if key else None
+        except sqlite3.Error as e:
+            logger.warning(f"读取代理回复缓存失败: {e}")
+            return None
+        if found is None:
+            return None
+        response, score = found
+        telemetry.record("agent_cache", callback_context.agent_name, time.perf_counter() - start,
+                         callback_context.session.id, callback_context.invocation_id, similarity=round(score, 3))
+        logger.info(f"[{callback_context.agent_name}] 命中回复缓存 (相似度 {score:.2f})")
+        return types.Content(role="model", parts=[types.Part(text=response)])
+
+    async def after_agent_callback(self, callback_context: CallbackContext) -> None:
+        try:
+            key = await self._key(callback_context)
+            if key is None:
+                return None
+            report = _final_report(callback_context)
+            if report is None:
+                self.cache._count("skipped")
+                return None
+            await asyncio.to_thread(self.cache.store, *key, report)
+        except sqlite3.Error as e:
+            logger.warning(f"写入代理回复缓存失败: {e}")
+        return None
@@ -0,0 +1,165 @@
+"""
+请求级截止时间与 ReAct 循环的步数 / 工具调用预算。
+
+每个代理都以 `PlanReActPlanner` 循环运行，此前对迭代次数、工具调用次数和总耗时都没有限制：
+一个反复检索知识库的子代理可以占用一个请求好几分钟，挤占整个工作进程。
+
+- 截止时间：代理第一次调用模型时，如果本次调用还没有截止时间，就按 `REQUEST_DEADLINE_S` 设置一个，
+  保存在调用级的 `temp:` 状态中。主代理转交给子代理时共享同一个状态，论文并行分析的子会话
+  通过 `state_delta` 继承它，MCP 工具调用（`tools/mcp_client.py`）按剩余时间设置超时。
+- 步数 / 工具调用预算：每个代理的模型调用次数和工具调用次数分别受 `AGENT_MAX_STEPS` 和
+  `AGENT_MAX_TOOL_CALLS` 限制，可以用 `AGENT_MAX_STEPS_<ROLE>` / `AGENT_MAX_TOOL_CALLS_<ROLE>` 按角色覆盖。
+- 任一预算用尽（或剩余时间不足 `REQUEST_FINAL_RESERVE_S`）时，本次模型调用的工具被移除，
+  代理被要求立即根据已收集到的信息给出最终报告；之后的工具调用直接返回错误，不再执行。
+
+每个预算被触发的次数按代理和预算类型计入 `/metrics`（`cheminsight_budget_triggers_total`）。
+"""
+
+import time
+from typing import Any, Optional
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.adk.tools.base_tool import BaseTool
+from google.adk.tools.tool_context import ToolContext
+from google.genai import types
+
+from app_config import get_env
+from logger_config import logger
+from telemetry import telemetry
+
+# 本次调用的截止时间（Unix 时间戳）；temp: 状态只在一次调用内有效，不会写入会话库
+DEADLINE_STATE_KEY = "temp:request_deadline"
+
+REQUEST_DEADLINE_S = float(get_env("REQUEST_DEADLINE_S", 240))
+# 剩余时间少于该值时，要求代理直接生成最终报告
+FINAL_RESERVE_S = float(get_env("REQUEST_FINAL_RESERVE_S", 40))
+# 被要求给出最终报告后，模型仍然没有结束时最多再调用的次数
+_MAX_FORCED_STEPS = 2
+
+STEPS = "steps"
+TOOL_CALLS = "tool_calls"
+DEADLINE = "deadline"
+
+_FINAL_NOTICES = {
+    STEPS: "本次任务的推理步数已达到上限。",
+    TOOL_CALLS: "本次任务的工具调用次数已达到上限。",
+    DEADLINE: "本次请求即将到达截止时间。",
+}
+
+
+def remaining_s(state) -> Optional[float]:
+    """本次调用距离截止时间的秒数；没有截止时间时返回 None。"""
+    deadline = state.get(DEADLINE_STATE_KEY)
+    return None if deadline is None else deadline - time.time()
+
+
+def _limit(name: str, role: str, default: int) -> int:
+    return int(get_env(f"{name}_{role.upper()}", get_env(name, default)))
+
+
+class StepBudget:
+    """
+    一个代理的步数与工具调用预算，以回调的形式挂载到 `LlmAgent` 上：
+    - `before_model_callback`：设置（或继承）本次调用的截止时间并计步；预算用尽时移除工具并要求给出最终报告。
+      需排在上下文处理回调之后、`telemetry.before_model_callback` 之前。
+    - `before_tool_callback`：计数；预算用尽时不执行工具，直接返回错误。需排在结果缓存之前。
+
+    Args:
+        max_steps: 每次调用中该代理最多的模型调用次数，0 表示不限制。
+        max_tool_calls: 每次调用中该代理最多的工具调用次数（不含 `transfer_to_agent`），0 表示不限制。
+    """
+
+    def __init__(self, max_steps: int = 10, max_tool_calls: int = 6):
+        self.max_steps = max_steps
+        self.max_tool_calls = max_tool_calls
+
+    @classmethod
+    def for_role(cls, role: str) -> "StepBudget":
+        return cls(
+            max_steps=_limit("AGENT_MAX_STEPS", role, 10),
+            max_tool_calls=_limit("AGENT_MAX_TOOL_CALLS", role, 6),
+        )
+
+    @staticmethod
+    def _key(agent_name: str, counter: str) -> str:
+        return f"temp:step_budget:{agent_name}:{counter}"
+
+    def _trigger(self, context, budget: str) -> None:
+        """每个代理的每种预算在一次调用中只计一次。"""
+        key = self._key(context.agent_name, f"triggered:{budget}")
+        if context.state.get(key):
+            return
+        context.state[key] = True
+        telemetry.record_budget_trigger(context.agent_name, budget)
+        logger.info(f"[{context.agent_name}] {budget} 预算已用尽 (调用 {context.invocation_id})")
+
+    def _exhausted(self, state, agent_name: str, steps: int) -> Optional[str]:
+        if self.max_steps and steps >= self.max_steps:
+            return STEPS
+        if self.max_tool_calls and state.get(self._key(agent_name, TOOL_CALLS), 0) >= self.max_tool_calls:
+            return TOOL_CALLS
+        remaining = remaining_s(state)
+        if remaining is not None and remaining <= FINAL_RESERVE_S:
+            return DEADLINE
+        return None
+
+    # --- ADK 回调 ---
+    def before_model_callback(
+        self, callback_context: CallbackContext, llm_request: LlmRequest
+    ) -> Optional[LlmResponse]:
+        state, agent_name = callback_context.state, callback_context.agent_name
+        # 在模型调用前（而不是 before_agent_callback 中）写入状态，变更会合并到模型响应事件中，
+        # 不会为此额外追加一个会话事件
+        if state.get(DEADLINE_STATE_KEY) is None and REQUEST_DEADLINE_S > 0:
+            state[DEADLINE_STATE_KEY] = time.time() + REQUEST_DEADLINE_S
+        steps = state.get(self._key(agent_name, STEPS), 0) + 1
+        state[self._key(agent_name, STEPS)] = steps
+        budget = self._exhausted(state, agent_name, steps)
+        if budget is None:
+            return None
+        self._trigger(callback_context, budget)
+
+        forced = state.get(self._key(agent_name, "forced"), 0) + 1
+        state[self._key(agent_name, "forced")] = forced
+        if forced > _MAX_FORCED_STEPS:
+            # 已多次要求给出最终报告但模型仍在尝试调用工具，直接结束该代理
+            return LlmResponse(content=types.Content(role="model", parts=[types.Part(
+                text="由于本次请求的处理预算已用尽，未能完成全部分析，请缩小问题范围后重试。"
+            )]))
+
+        # 移除全部工具，模型只能输出文本，从而进入最终报告步骤
+        llm_request.tools_dict.clear()
+        if llm_request.config is not None:
+            llm_request.config.tools = None
+            llm_request.config.tool_config = None
+        llm_request.append_instructions([
+            f"{_FINAL_NOTICES[budget]}不要再调用任何工具或转交给其他代理，"
+            "请立即根据目前已经收集到的信息给出最终答案 (/*FINAL_ANSWER*/)，并简要说明哪些方面因预算限制未能进一步检索。"
+        ])
+        return None
+
+    def before_tool_callback(
+        self, tool: BaseTool, args: dict[str, Any], tool_context: ToolContext
+    ) -> Optional[dict]:
+        state = tool_context.state
+        budget = None
+        if tool.name != "transfer_to_agent":
+            key = self._key(tool_context.agent_name, TOOL_CALLS)
+            calls = state.get(key, 0) + 1
+            state[key] = calls
+            if self.max_tool_calls and calls > self.max_tool_calls:
+                budget = TOOL_CALLS
+        remaining = remaining_s(state)
+        if budget is None and remaining is not None and remaining <= 0:
+            budget = DEADLINE
+        if budget is None:
+            return None
+        self._trigger(tool_context, budget)
+        # 带 error 字段的结果不会被 tool_result_cache 缓存
+        return {
+            "status": "error",
+            "error": "budget_exhausted",
+            "message": f"{_FINAL_NOTICES[budget]}该工具未被执行，请根据已有信息给出最终答案。",
+        }
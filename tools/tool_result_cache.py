@@ -0,0 +1,158 @@
+"""
+幂等 MCP 检索工具的结果缓存。
+
+ExperimentDesignAgent 和 PaperAnalyzeAgent 在每个新任务开始时都会优先检索知识库，
+相同的检索请求在不同会话之间、以及同一个 ReAct 循环内部会被反复发送到远程 MCP 服务器。
+
+本模块通过 `LlmAgent` 的 `before_tool_callback` / `after_tool_callback` 接入：
+- 缓存键为工具名 + 规范化后的参数（去除首尾空白、合并连续空白、忽略键顺序）。
+  不忽略大小写：化学式（Co 与 CO）和各类 ID 区分大小写。
+- 只有白名单 (`MCP_CACHEABLE_TOOLS`) 中的工具会被缓存。
+- 条目按 TTL 过期，并按条目数上限做 LRU 淘汰。
+- 知识库重建索引后调用 `invalidate()` 使全部缓存失效。
+"""
+
+import copy
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Optional
+
+from google.adk.tools.base_tool import BaseTool
+from google.adk.tools.tool_context import ToolContext
+
+from app_config import get_env
+from logger_config import logger
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return _WHITESPACE_RE.sub(" ", value.strip())
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+class ToolResultCache:
+    """
+    带 TTL 和容量上限的工具调用结果缓存。
+
+    Args:
+        cacheable_tools: 允许缓存的工具名集合。
+        ttl_s: 条目存活时间（秒）。
+        max_entries: 最多保留的条目数。
+    """
+
+    def __init__(self, cacheable_tools: Iterable[str], ttl_s: float = 600.0, max_entries: int = 1024):
+        self.cacheable_tools = frozenset(cacheable_tools)
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.kb_version = 0
+        self._entries: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 由缓存直接应答的调用 ID；ADK 在这种情况下仍会执行 after_tool_callback，需要跳过回写
+        self._served_call_ids: set[str] = set()
+        self._counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+
+    @classmethod
+    def from_env(cls) -> "ToolResultCache":
+        names = get_env("MCP_CACHEABLE_TOOLS", "ragflow_retrieval,search_knowledge_base")
+        return cls(
+            cacheable_tools=[name.strip() for name in names.split(",") if name.strip()],
+            ttl_s=float(get_env("MCP_RESULT_CACHE_TTL_S", 600)),
+            max_entries=int(get_env("MCP_RESULT_CACHE_MAX_ENTRIES", 1024)),
+        )
+
+    def make_key(self, tool_name: str, args: dict[str, Any]) -> str:
+        normalized = json.dumps(_normalize(args or {}), sort_keys=True, ensure_ascii=False, default=str)
+        return f"{tool_name}:{normalized}"
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            expires_at, response = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return copy.deepcopy(response)
+
+    def put(self, key: str, response: dict) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_s, copy.deepcopy(response))
+            self._entries.move_to_end(key)
+            self._counters["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def invalidate(self, tool_name: Optional[str] = None) -> int:
+        """
+        使缓存失效。知识库重建索引后调用。
+
+        Args:
+            tool_name: 只清除该工具的条目；为 None 时清除全部条目并递增知识库版本号。
+
+        Returns:
+            当前的知识库版本号。
+        """
+        with self._lock:
+            if tool_name is None:
+                self._entries.clear()
+                self.kb_version += 1
+            else:
+                prefix = f"{tool_name}:"
+                for key in [k for k in self._entries if k.startswith(prefix)]:
+                    del self._entries[key]
+            self._counters["invalidations"] += 1
+            logger.info(f"工具结果缓存已失效 (tool={tool_name or '*'}, kb_version={self.kb_version})")
+            return self.kb_version
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+            stats["kb_version"] = self.kb_version
+        return stats
+
+    # --- ADK 回调 ---
+    def before_tool_callback(
+        self, tool: BaseTool, args: dict[str, Any], tool_context: ToolContext
+    ) -> Optional[dict]:
+        """命中缓存时直接返回结果，跳过实际的 MCP 调用。"""
+        if tool.name not in self.cacheable_tools:
+            return None
+        response = self.get(self.make_key(tool.name, args))
+        if response is not None and tool_context.function_call_id:
+            with self._lock:
+                self._served_call_ids.add(tool_context.function_call_id)
+        return response
+
+    def after_tool_callback(
+        self, tool: BaseTool, args: dict[str, Any], tool_context: ToolContext, tool_response: dict
+    ) -> Optional[dict]:
+        """缓存成功的调用结果；MCP 返回错误时不缓存。"""
+        if tool.name not in self.cacheable_tools or not isinstance(tool_response, dict):
+            return None
+        with self._lock:
+            if tool_context.function_call_id in self._served_call_ids:
+                self._served_call_ids.discard(tool_context.function_call_id)
+                return None
+        if tool_response.get("isError") or tool_response.get("error"):
+            return None
+        self.put(self.make_key(tool.name, args), tool_response)
+        return None
+
+
+tool_result_cache = ToolResultCache.from_env()